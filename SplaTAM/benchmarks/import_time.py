@@ -0,0 +1,97 @@
+"""
+Benchmark the time it takes to import every entry script.
+
+Every script is imported (not run, the __main__ block is skipped) in a fresh interpreter, so that module caches
+don't carry over between scripts. Besides the wall-clock import time, the benchmark reports the number of loaded
+modules & whether importing the script loaded torchmetrics or initialized CUDA.
+
+Usage:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py scripts/splatam.py --repeats 5 --output import_time.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imports the script passed as argument & prints the import statistics as json
+IMPORT_CODE = """
+import importlib.util, json, sys, time
+sys.path.insert(0, sys.argv[1])
+start_time = time.perf_counter()
+spec = importlib.util.spec_from_file_location("benchmarked_entry_script", sys.argv[2])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+import_time = time.perf_counter() - start_time
+torch = sys.modules.get("torch")
+print(json.dumps({
+    "import_time": import_time,
+    "num_modules": len(sys.modules),
+    "torchmetrics_loaded": "torchmetrics" in sys.modules,
+    "cuda_initialized": bool(torch is not None and torch.cuda.is_initialized()),
+}))
+"""
+
+
+def get_entry_scripts():
+    """All scripts with a __main__ block."""
+    entry_scripts = []
+    for script_path in sorted(glob.glob(os.path.join(_BASE_DIR, "scripts", "*.py")) +
+                              glob.glob(os.path.join(_BASE_DIR, "viz_scripts", "*.py"))):
+        if " " in os.path.basename(script_path):
+            continue
+        with open(script_path, "r") as f:
+            if "__name__ == \"__main__\"" in f.read():
+                entry_scripts.append(script_path)
+    return entry_scripts
+
+
+def time_import(script_path, repeats):
+    runs = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", IMPORT_CODE, _BASE_DIR, script_path],
+                                cwd=_BASE_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            return {"error": error[-1] if len(error) > 0 else f"exit code {result.returncode}"}
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    import_times = sorted(run["import_time"] for run in runs)
+    stats = dict(runs[-1])
+    stats["import_time"] = import_times[len(import_times) // 2]
+    stats["import_time_min"] = import_times[0]
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scripts", nargs="*", type=str, help="Scripts to benchmark (default: all entry scripts).")
+    parser.add_argument("--repeats", default=3, type=int, help="Number of imports per script (median is reported).")
+    parser.add_argument("--output", default=None, type=str, help="Path to save the results as json.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    scripts = [os.path.abspath(script) for script in args.scripts] if len(args.scripts) > 0 else get_entry_scripts()
+
+    results = {}
+    for script_path in scripts:
+        script_name = os.path.relpath(script_path, _BASE_DIR)
+        stats = time_import(script_path, args.repeats)
+        results[script_name] = stats
+        if "error" in stats:
+            print(f"{script_name}: import failed ({stats['error']})")
+        else:
+            print(f"{script_name}: {stats['import_time']*1000:.1f} ms (min {stats['import_time_min']*1000:.1f} ms), "
+                  f"{stats['num_modules']} modules, torchmetrics loaded: {stats['torchmetrics_loaded']}, "
+                  f"CUDA initialized: {stats['cuda_initialized']}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Saved results to {args.output}")
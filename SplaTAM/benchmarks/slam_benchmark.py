@@ -0,0 +1,457 @@
+"""
+Benchmark the SLAM building blocks on deterministic synthetic RGB-D sequences (see synthetic_rgbd.py).
+
+Stages:
+    data_loading: NeRFCapture dataset indexing & frame loading (per frame & batched)
+    keyframe_selection: overlap-based keyframe selection against a growing keyframe list
+    densify_prune: opacity/size pruning & gradient-based densification (incl. optimizer state surgery)
+    knn_init: grid-accelerated 3-NN scale initialization of a frame's points (alone & against an existing map)
+    pose_math: quaternion/rotation conversions & transforming the Gaussians to a camera frame
+    pose_prediction: motion models initializing the camera pose of a new frame (timing & pose error of the prediction)
+    evaluation: trajectory metrics (batch ATE/RPE & online ATE) & image metrics
+
+Every stage is run in a fresh interpreter by default, so that its peak memory can be measured separately. The peak
+memory of a CPU run is the increase of the peak resident set size during the stage (a lower bound if the setup of the
+stage used more memory than the stage itself), on CUDA it is the peak allocated device memory of the stage.
+Everything runs on CPU-only machines, the rasterizer is not required.
+
+Usage:
+    python benchmarks/slam_benchmark.py --scale small
+    python benchmarks/slam_benchmark.py --scale medium --stages pose_math evaluation --device cuda
+    python benchmarks/slam_benchmark.py --scale small --output benchmarks/results.json # Appends the run & compares
+                                                                                          # to the previous one
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _BASE_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import torch
+
+from synthetic_rgbd import SyntheticRGBDSequence
+
+SCALES = {
+    'small': dict(num_frames=30, height=120, width=160, num_gaussians=50_000, num_eval_poses=10_000,
+                  knn_frame_size=(240, 320)),
+    'medium': dict(num_frames=100, height=240, width=320, num_gaussians=200_000, num_eval_poses=100_000,
+                   knn_frame_size=(480, 640)),
+    'large': dict(num_frames=300, height=480, width=640, num_gaussians=1_000_000, num_eval_poses=1_000_000,
+                  knn_frame_size=(1000, 1000)), # 1M point frames
+}
+STAGES = ['data_loading', 'keyframe_selection', 'densify_prune', 'knn_init', 'pose_math', 'pose_prediction', 'evaluation']
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+
+def time_fn(fn, device, repeats, setup=None):
+    """Median & min wall-clock time of fn over repeats runs (setup is called before every run & not timed)."""
+    times = []
+    for _ in range(repeats):
+        args = setup() if setup is not None else ()
+        synchronize(device)
+        start_time = time.perf_counter()
+        fn(*args)
+        synchronize(device)
+        times.append(time.perf_counter() - start_time)
+    times = sorted(times)
+    return times[len(times) // 2], times[0]
+
+
+def measurement(items, unit, times):
+    median_time, min_time = times
+    return {'items': items, 'unit': unit, 'time': median_time, 'min_time': min_time,
+            'throughput': items / median_time if median_time > 0 else float('inf')}
+
+
+def random_gaussians(num_gaussians, device, gaussian_distribution="isotropic", seed=0):
+    """Random Gaussians inside the synthetic room, with an Adam optimizer that has state."""
+    generator = torch.Generator().manual_seed(seed)
+    num_scales = 1 if gaussian_distribution == "isotropic" else 3
+    params = {
+        'means3D': (torch.rand(num_gaussians, 3, generator=generator) * 2 - 1) * torch.tensor([3.0, 1.5, 3.0]),
+        'rgb_colors': torch.rand(num_gaussians, 3, generator=generator),
+        'unnorm_rotations': torch.randn(num_gaussians, 4, generator=generator),
+        'logit_opacities': torch.randn(num_gaussians, 1, generator=generator) * 3,
+        'log_scales': torch.log(torch.rand(num_gaussians, num_scales, generator=generator) * 0.05 + 1e-3),
+        'cam_unnorm_rots': torch.tensor([1.0, 0.0, 0.0, 0.0])[None, :, None].repeat(1, 1, 2),
+        'cam_trans': torch.zeros(1, 3, 2),
+    }
+    params = {k: torch.nn.Parameter(v.to(device).contiguous()) for k, v in params.items()}
+    optimizer = torch.optim.Adam([{'params': [v], 'name': k, 'lr': 1e-4} for k, v in params.items()],
+                                 lr=0.0, eps=1e-15)
+    for v in params.values():
+        v.grad = torch.zeros_like(v)
+    optimizer.step()
+
+    means2D = torch.zeros(num_gaussians, 3, device=device, requires_grad=True)
+    means2D.grad = torch.rand(num_gaussians, 3, generator=generator).to(device) * 4e-4
+    variables = {
+        'max_2D_radius': torch.zeros(num_gaussians, device=device),
+        'means2D_gradient_accum': torch.zeros(num_gaussians, device=device),
+        'denom': torch.zeros(num_gaussians, device=device),
+        'timestep': torch.zeros(num_gaussians, device=device),
+        'seen': torch.rand(num_gaussians, generator=generator).to(device) > 0.3,
+        'means2D': means2D,
+        'scene_radius': torch.tensor(1.0, device=device),
+    }
+    return params, variables, optimizer
+
+
+def duplicated_gaussians(num_gaussians, device, seed=0):
+    """Random Gaussians whose second half duplicates the first half (jittered by a fraction of their scale)."""
+    params, variables, optimizer = random_gaussians(num_gaussians, device, seed=seed)
+    half = num_gaussians // 2
+    with torch.no_grad():
+        scales = torch.exp(params['log_scales'][:half])
+        params['means3D'][half:2 * half] = params['means3D'][:half] + 0.1 * scales * torch.randn_like(
+            params['means3D'][:half])
+        params['rgb_colors'][half:2 * half] = params['rgb_colors'][:half]
+    return params, variables, optimizer
+
+
+def bench_data_loading(scale, device, repeats):
+    from datasets.gradslam_datasets import NeRFCaptureDataset
+
+    sequence = SyntheticRGBDSequence(scale['num_frames'], scale['height'], scale['width'])
+    tmp_dir = tempfile.mkdtemp(prefix="splatam_benchmark_")
+    try:
+        sequence.write_nerfcapture(os.path.join(tmp_dir, "synthetic"))
+        make_dataset = lambda use_index_cache: NeRFCaptureDataset(
+            tmp_dir, "synthetic", desired_height=scale['height'], desired_width=scale['width'],
+            device=device, use_index_cache=use_index_cache)
+        dataset = make_dataset(True)
+
+        def load_all():
+            for frame_idx in range(len(dataset)):
+                dataset[frame_idx]
+
+        def load_batched():
+            for start in range(0, len(dataset), 8):
+                dataset.get_frames(list(range(start, min(start + 8, len(dataset)))))
+
+        return {
+            'index': measurement(len(dataset), 'frames', time_fn(lambda: make_dataset(False), device, repeats)),
+            'index_cached': measurement(len(dataset), 'frames', time_fn(lambda: make_dataset(True), device, repeats)),
+            'getitem': measurement(len(dataset), 'frames', time_fn(load_all, device, repeats)),
+            'get_frames': measurement(len(dataset), 'frames', time_fn(load_batched, device, repeats)),
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_keyframe_selection(scale, device, repeats):
+    from utils.keyframe_selection import keyframe_selection_overlap
+
+    sequence = SyntheticRGBDSequence(scale['num_frames'], scale['height'], scale['width'])
+    intrinsics = torch.tensor(sequence.intrinsics, device=device).float()
+    frames = []
+    for frame_idx in range(len(sequence)):
+        _, depth, c2w = sequence[frame_idx]
+        frames.append({'id': frame_idx, 'est_w2c': torch.linalg.inv(torch.tensor(c2w, device=device).float()),
+                       'depth': torch.from_numpy(depth).to(device)[None]})
+    keyframe_every = 5
+
+    def select_all():
+        torch.manual_seed(0)
+        np.random.seed(0)
+        keyframe_list = []
+        for frame in frames:
+            keyframe_selection_overlap(frame['depth'], frame['est_w2c'], intrinsics, keyframe_list, k=8)
+            if frame['id'] % keyframe_every == 0:
+                keyframe_list.append(frame)
+
+    return {'select': measurement(len(frames), 'selections', time_fn(select_all, device, repeats))}
+
+
+def bench_densify_prune(scale, device, repeats):
+    from utils.gaussian_merge import merge_duplicate_gaussians
+    from utils.slam_external import prune_gaussians, densify
+
+    num_gaussians = scale['num_gaussians']
+    prune_dict = dict(start_after=0, remove_big_after=0, stop_after=20, prune_every=20,
+                      removal_opacity_threshold=0.005, final_removal_opacity_threshold=0.005,
+                      reset_opacities=False, reset_opacities_every=500)
+    densify_dict = dict(start_after=0, remove_big_after=0, stop_after=5000, densify_every=100, grad_thresh=0.0002,
+                        num_to_split_into=2, removal_opacity_threshold=0.005, final_removal_opacity_threshold=0.005,
+                        reset_opacities_every=3000)
+    setup = lambda: random_gaussians(num_gaussians, device)
+    prune_times = time_fn(lambda params, variables, optimizer: prune_gaussians(params, variables, optimizer, 0, prune_dict),
+                          device, repeats, setup=setup)
+    densify_times = time_fn(lambda params, variables, optimizer: densify(params, variables, optimizer, 100, densify_dict),
+                            device, repeats, setup=setup)
+    merge_times = time_fn(lambda params, variables, optimizer: merge_duplicate_gaussians(params, variables, optimizer, {}),
+                          device, repeats, setup=lambda: duplicated_gaussians(num_gaussians, device))
+    return {
+        'prune': measurement(num_gaussians, 'gaussians', prune_times),
+        'densify': measurement(num_gaussians, 'gaussians', densify_times),
+        'merge': measurement(num_gaussians, 'gaussians', merge_times),
+    }
+
+
+def bench_knn_init(scale, device, repeats):
+    from utils.neighbor_search import knn_mean_sq_dist
+
+    height, width = scale['knn_frame_size']
+    sequence = SyntheticRGBDSequence(2, height, width, depth_noise=0.01)
+    intrinsics = sequence.intrinsics
+    v, u = np.meshgrid(np.arange(height), np.arange(width), indexing="ij")
+    frame_pts = []
+    for frame_idx in range(2):
+        _, depth, c2w = sequence[frame_idx]
+        pts_cam = np.stack([(u - intrinsics[0, 2]) / intrinsics[0, 0] * depth,
+                            (v - intrinsics[1, 2]) / intrinsics[1, 1] * depth, depth], axis=-1).reshape(-1, 3)
+        frame_pts.append(torch.from_numpy(pts_cam @ c2w[:3, :3].T + c2w[:3, 3]).float().to(device))
+    pts, map_pts = frame_pts[1], frame_pts[0]
+    # Same voxel size as get_pointcloud: 4 pixel footprints at the median depth
+    voxel_size = 4 * float(np.median(sequence[1][1])) / intrinsics[0, 0]
+
+    return {
+        'frame': measurement(pts.shape[0], 'points', time_fn(lambda: knn_mean_sq_dist(pts, voxel_size), device,
+                                                             repeats)),
+        'frame_and_map': measurement(pts.shape[0], 'points', time_fn(
+            lambda: knn_mean_sq_dist(pts, voxel_size, map_pts=map_pts), device, repeats)),
+    }
+
+
+def bench_pose_math(scale, device, repeats):
+    from utils.slam_external import build_rotation
+    from utils.slam_helpers import matrix_to_quaternion, transform_to_frame
+
+    num_gaussians = scale['num_gaussians']
+    params, _, _ = random_gaussians(num_gaussians, device, gaussian_distribution="anisotropic")
+    quats = params['unnorm_rotations'].detach()
+    rots = build_rotation(quats)
+
+    def transform():
+        with torch.no_grad():
+            transform_to_frame(params, 1, gaussians_grad=False, camera_grad=False)
+
+    return {
+        'build_rotation': measurement(num_gaussians, 'rotations', time_fn(lambda: build_rotation(quats), device, repeats)),
+        'matrix_to_quaternion': measurement(num_gaussians, 'rotations',
+                                            time_fn(lambda: matrix_to_quaternion(rots), device, repeats)),
+        'transform_to_frame': measurement(num_gaussians, 'gaussians', time_fn(transform, device, repeats)),
+    }
+
+
+def bench_pose_prediction(scale, device, repeats):
+    from utils.motion_model import MOTION_MODELS, camera_centers, predict_pose
+    from utils.slam_helpers import matrix_to_quaternion
+
+    # The trajectory loops around the room once, so fewer frames means faster camera motion between frames
+    w2cs = torch.from_numpy(np.linalg.inv(SyntheticRGBDSequence(scale['num_frames'], 1, 1).poses)).float().to(device)
+    rots = torch.nn.functional.normalize(matrix_to_quaternion(w2cs[:, :3, :3]))
+    trans = w2cs[:, :3, 3]
+    centers = camera_centers(rots, trans)
+
+    results = {}
+    for motion_model in MOTION_MODELS:
+        def predict_all():
+            with torch.no_grad():
+                return [predict_pose(rots[time_idx-3:time_idx], trans[time_idx-3:time_idx], motion_model)
+                        for time_idx in range(3, len(rots))]
+        times = time_fn(predict_all, device, repeats)
+        pred_rots, pred_trans = [torch.cat(poses) for poses in zip(*predict_all())]
+        pred_centers = camera_centers(pred_rots, pred_trans)
+        # Rotation error (deg) & camera center error (m) of the predictions against the actual poses
+        rot_errors = 2 * torch.acos((pred_rots * rots[3:]).sum(dim=-1).abs().clamp(max=1.0)) * 180 / np.pi
+        results[motion_model] = measurement(len(pred_rots), 'poses', times)
+        results[motion_model]['rot_error_deg'] = float(rot_errors.mean())
+        results[motion_model]['center_error_m'] = float((pred_centers - centers[3:]).norm(dim=-1).mean())
+    return results
+
+
+def bench_evaluation(scale, device, repeats):
+    from utils.slam_external import calc_psnr
+    from utils.trajectory_eval import OnlineATEEstimator, evaluate_trajectory
+
+    num_poses = scale['num_eval_poses']
+    gt_poses = SyntheticRGBDSequence(num_poses, 1, 1).poses
+    rng = np.random.default_rng(0)
+    est_poses = gt_poses.copy()
+    est_poses[:, :3, 3] += np.cumsum(rng.normal(scale=1e-4, size=(num_poses, 3)), axis=0)
+    gt_w2cs = np.linalg.inv(gt_poses)
+    est_w2cs = np.linalg.inv(est_poses)
+    num_online_poses = min(num_poses, 10_000)
+
+    def online_ate():
+        estimator = OnlineATEEstimator(drift_threshold=0.1)
+        for pose_idx in range(num_online_poses):
+            estimator.update(gt_w2cs[pose_idx], est_w2cs[pose_idx])
+
+    sequence = SyntheticRGBDSequence(min(scale['num_frames'], 16), scale['height'], scale['width'], depth_noise=0.0)
+    gt_ims = torch.stack([torch.from_numpy(sequence[frame_idx][0]) for frame_idx in range(len(sequence))])
+    gt_ims = gt_ims.to(device).permute(0, 3, 1, 2).float() / 255
+    ims = (gt_ims + 0.02 * torch.randn(gt_ims.shape, generator=torch.Generator().manual_seed(0)).to(device)).clamp(0, 1)
+
+    results = {
+        'trajectory': measurement(num_poses, 'poses',
+                                  time_fn(lambda: evaluate_trajectory(gt_poses, est_poses, rpe_deltas=(1, 10)),
+                                          device, repeats)),
+        'online_ate': measurement(num_online_poses, 'poses', time_fn(online_ate, device, repeats)),
+        'psnr': measurement(len(ims), 'images', time_fn(lambda: [calc_psnr(im, gt_im).mean() for im, gt_im in
+                                                                 zip(ims, gt_ims)], device, repeats)),
+    }
+    try:
+        from utils.metrics import get_metric
+        ms_ssim = get_metric('ms_ssim')
+    except ImportError:
+        ms_ssim = None
+    if ms_ssim is not None and min(scale['height'], scale['width']) > 160:
+        results['ms_ssim'] = measurement(len(ims), 'images', time_fn(
+            lambda: ms_ssim(ims, gt_ims, data_range=1.0, size_average=False), device, repeats))
+    return results
+
+
+def run_stage(stage, scale, device, repeats):
+    """Run a stage in the current process & measure its peak memory."""
+    if torch.device(device).type == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+    start_rss = get_peak_rss_mb()
+    results = globals()[f"bench_{stage}"](scale, device, repeats)
+    if torch.device(device).type == "cuda":
+        peak_memory_mb = (torch.cuda.max_memory_allocated() - start_memory) / 2**20
+    else:
+        peak_rss = get_peak_rss_mb()
+        peak_memory_mb = None if peak_rss is None else peak_rss - start_rss
+    for result in results.values():
+        result['peak_memory_mb'] = peak_memory_mb
+    return results
+
+
+def run_stage_isolated(stage, scale, device, repeats):
+    """Run a stage in a fresh interpreter, so that the memory of other stages doesn't affect its peak memory."""
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", stage, "--device", device,
+                             "--repeats", str(repeats), "--scale-json", json.dumps(scale)],
+                            cwd=_BASE_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        return {'error': error[-1] if len(error) > 0 else f"exit code {result.returncode}"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS & in kilobytes on Linux
+    return peak_rss / 2**20 if sys.platform == "darwin" else peak_rss / 2**10
+
+
+def get_git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=_BASE_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=_BASE_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip() != ""
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_runs(path):
+    if path is None or not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def print_results(run, previous_run=None):
+    print(f"\nCommit: {run['git_commit']} | Scale: {run['scale_name']} | Device: {run['device']}")
+    if previous_run is not None:
+        print(f"Compared to {previous_run['git_commit']} ({previous_run['timestamp']})")
+    for name, result in run['results'].items():
+        if 'error' in result:
+            print(f"{name:<36} failed ({result['error']})")
+            continue
+        line = f"{name:<36}{result['throughput']:>14.1f} {result['unit']}/s{result['time']*1000:>12.2f} ms"
+        if result.get('peak_memory_mb') is not None:
+            line += f"{result['peak_memory_mb']:>10.1f} MB"
+        if 'rot_error_deg' in result:
+            line += f"  (error {result['rot_error_deg']:.3f} deg, {result['center_error_m'] * 100:.2f} cm)"
+        previous_result = None if previous_run is None else previous_run['results'].get(name)
+        if previous_result is not None and 'throughput' in previous_result:
+            line += f"{result['throughput'] / previous_result['throughput']:>8.2f}x"
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", default="small", choices=list(SCALES.keys()), help="Size of the benchmark.")
+    parser.add_argument("--stages", nargs="*", default=STAGES, choices=STAGES, help="Stages to run.")
+    parser.add_argument("--device", default="cpu", type=str, help="Torch device (e.g. cpu or cuda).")
+    parser.add_argument("--repeats", default=3, type=int, help="Number of runs per measurement (median is reported).")
+    parser.add_argument("--num-frames", default=None, type=int, help="Override the number of frames of the scale.")
+    parser.add_argument("--num-gaussians", default=None, type=int, help="Override the number of Gaussians of the scale.")
+    parser.add_argument("--no-isolate", action="store_true", help="Run all stages in this process.")
+    parser.add_argument("--output", default=None, type=str,
+                        help="Json file the run is appended to (compared to the last run with the same settings).")
+    parser.add_argument("--worker", default=None, type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--scale-json", default=None, type=str, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_stage(args.worker, json.loads(args.scale_json), args.device, args.repeats)))
+        sys.exit(0)
+
+    scale = dict(SCALES[args.scale])
+    if args.num_frames is not None:
+        scale['num_frames'] = args.num_frames
+    if args.num_gaussians is not None:
+        scale['num_gaussians'] = args.num_gaussians
+
+    results = {}
+    for stage in args.stages:
+        print(f"Running {stage}...")
+        if args.no_isolate:
+            stage_results = run_stage(stage, scale, args.device, args.repeats)
+        else:
+            stage_results = run_stage_isolated(stage, scale, args.device, args.repeats)
+        if 'error' in stage_results:
+            results[stage] = stage_results
+        else:
+            results.update({f"{stage}/{name}": result for name, result in stage_results.items()})
+
+    run = {
+        'git_commit': get_git_commit(),
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'scale_name': args.scale,
+        'scale': scale,
+        'device': args.device,
+        'repeats': args.repeats,
+        'platform': platform.platform(),
+        'python_version': platform.python_version(),
+        'torch_version': torch.__version__,
+        'results': results,
+    }
+    runs = load_runs(args.output)
+    previous_runs = [previous_run for previous_run in runs if previous_run['scale'] == scale and
+                     previous_run['device'] == args.device]
+    print_results(run, previous_runs[-1] if len(previous_runs) > 0 else None)
+
+    if args.output is not None:
+        runs.append(run)
+        with open(args.output, "w") as f:
+            json.dump(runs, f, indent=4)
+        print(f"Saved results to {args.output}")
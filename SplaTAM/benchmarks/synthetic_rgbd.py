@@ -0,0 +1,164 @@
+"""
+Deterministic synthetic RGB-D sequences with known geometry & trajectory for benchmarking.
+
+The scene is the inside of an axis-aligned box room with procedurally textured walls, which is ray cast exactly, so
+the depth of every pixel & the camera pose of every frame are known. Cameras follow the GradSLAM (OpenCV) convention:
+x right, y down, z forward, with camera-to-world poses.
+"""
+
+import json
+import os
+
+import cv2
+import imageio
+import numpy as np
+
+# Flips the y & z axes between the GradSLAM (OpenCV) & ARKit/NeRF (OpenGL) camera conventions
+ARKIT_TO_GRADSLAM = np.diag([1.0, -1.0, -1.0, 1.0])
+
+# Wall colors of the -x, +x, -y, +y, -z & +z faces of the room
+FACE_COLORS = np.array([
+    [0.85, 0.35, 0.30],
+    [0.30, 0.70, 0.35],
+    [0.80, 0.80, 0.75],
+    [0.45, 0.40, 0.35],
+    [0.30, 0.45, 0.85],
+    [0.85, 0.75, 0.30],
+])
+
+
+def look_at(position, target, up=(0.0, -1.0, 0.0)):
+    """Camera-to-world pose (OpenCV convention) of a camera at position looking at target."""
+    position = np.asarray(position, dtype=np.float64)
+    forward = np.asarray(target, dtype=np.float64) - position
+    forward /= np.linalg.norm(forward)
+    right = np.cross(forward, np.asarray(up, dtype=np.float64))
+    right /= np.linalg.norm(right)
+    down = np.cross(forward, right)
+    c2w = np.eye(4)
+    c2w[:3, 0] = right
+    c2w[:3, 1] = down
+    c2w[:3, 2] = forward
+    c2w[:3, 3] = position
+    return c2w
+
+
+def generate_trajectory(num_frames, radius=1.0, num_loops=1.0):
+    """
+    Smooth camera trajectory on a wobbling circle in the middle of the room, looking outwards at the walls.
+
+    Returns:
+        poses: (num_frames, 4, 4) camera-to-world poses.
+    """
+    poses = np.zeros((num_frames, 4, 4))
+    for frame_idx in range(num_frames):
+        theta = 2 * np.pi * num_loops * frame_idx / max(num_frames, 1)
+        position = np.array([radius * np.cos(theta), 0.15 * np.sin(3 * theta), radius * np.sin(theta)])
+        view_angle = theta + 0.5 * np.pi + 0.3 * np.sin(2 * theta)
+        target = position + np.array([np.cos(view_angle), 0.1 * np.cos(theta), np.sin(view_angle)])
+        poses[frame_idx] = look_at(position, target)
+    return poses
+
+
+def get_intrinsics(height, width, fov_x=np.deg2rad(70.0)):
+    fx = 0.5 * width / np.tan(0.5 * fov_x)
+    return np.array([[fx, 0.0, 0.5 * width], [0.0, fx, 0.5 * height], [0.0, 0.0, 1.0]])
+
+
+def render_box_room(c2w, intrinsics, height, width, room_half_size=(3.0, 1.5, 3.0)):
+    """
+    Ray cast the box room from a camera.
+
+    Args:
+        c2w: (4, 4) camera-to-world pose (inside the room).
+        intrinsics: (3, 3) camera intrinsics.
+        height, width: image size.
+        room_half_size: half extent of the room along x, y & z.
+
+    Returns:
+        color: (height, width, 3) uint8 image.
+        depth: (height, width) float32 depth (z-distance along the optical axis, in meters).
+    """
+    v, u = np.meshgrid(np.arange(height) + 0.5, np.arange(width) + 0.5, indexing="ij")
+    rays_cam = np.stack([(u - intrinsics[0, 2]) / intrinsics[0, 0],
+                         (v - intrinsics[1, 2]) / intrinsics[1, 1],
+                         np.ones_like(u)], axis=-1) # z = 1, so the ray parameter equals the depth
+    rays_world = rays_cam @ c2w[:3, :3].T
+    origin = c2w[:3, 3]
+
+    # Distance to the room wall along every axis (the wall in the direction of the ray)
+    half_size = np.asarray(room_half_size)
+    with np.errstate(divide="ignore"):
+        bounds = np.where(rays_world > 0, half_size, -half_size)
+        axis_depths = np.where(np.abs(rays_world) > 1e-12, (bounds - origin) / rays_world, np.inf)
+    hit_axis = np.argmin(axis_depths, axis=-1)
+    depth = np.take_along_axis(axis_depths, hit_axis[..., None], axis=-1)[..., 0]
+    hit_points = origin + rays_world * depth[..., None]
+
+    # Checkerboard & stripe texture on the two in-plane coordinates of every wall
+    face = 2 * hit_axis + (np.take_along_axis(rays_world, hit_axis[..., None], axis=-1)[..., 0] > 0)
+    plane_axes = np.stack([(hit_axis + 1) % 3, (hit_axis + 2) % 3], axis=-1)
+    plane_coords = np.take_along_axis(hit_points, plane_axes, axis=-1)
+    checker = (np.floor(plane_coords[..., 0] * 2.0) + np.floor(plane_coords[..., 1] * 2.0)) % 2
+    stripes = 0.5 + 0.5 * np.sin(plane_coords[..., 0] * 9.0) * np.cos(plane_coords[..., 1] * 7.0)
+    shading = 0.55 + 0.3 * checker + 0.15 * stripes
+    color = FACE_COLORS[face] * shading[..., None]
+    color = (np.clip(color, 0.0, 1.0) * 255).astype(np.uint8)
+    return color, depth.astype(np.float32)
+
+
+class SyntheticRGBDSequence:
+    """
+    Lazily rendered synthetic RGB-D sequence.
+
+    Args:
+        num_frames: number of frames.
+        height, width: image size.
+        seed: seed of the depth noise (the geometry & trajectory are fixed).
+        depth_noise: standard deviation of the multiplicative depth noise (0 for exact depth).
+    """
+    def __init__(self, num_frames, height, width, seed=0, depth_noise=0.0):
+        self.num_frames = num_frames
+        self.height = height
+        self.width = width
+        self.seed = seed
+        self.depth_noise = depth_noise
+        self.poses = generate_trajectory(num_frames)
+        self.intrinsics = get_intrinsics(height, width)
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self, index):
+        """Returns the (H, W, 3) uint8 color, (H, W) float32 depth & (4, 4) camera-to-world pose of a frame."""
+        color, depth = render_box_room(self.poses[index], self.intrinsics, self.height, self.width)
+        if self.depth_noise > 0:
+            rng = np.random.default_rng(self.seed * 1_000_003 + index)
+            depth = depth * (1.0 + self.depth_noise * rng.standard_normal(depth.shape)).astype(np.float32)
+        return color, depth, self.poses[index]
+
+    def write_nerfcapture(self, output_dir):
+        """Write the sequence in the NeRFCapture format (transforms.json, rgb/*.png & depth/*.tiff in meters)."""
+        os.makedirs(os.path.join(output_dir, "rgb"), exist_ok=True)
+        os.makedirs(os.path.join(output_dir, "depth"), exist_ok=True)
+        manifest = {
+            "w": self.width,
+            "h": self.height,
+            "fl_x": float(self.intrinsics[0, 0]),
+            "fl_y": float(self.intrinsics[1, 1]),
+            "cx": float(self.intrinsics[0, 2]),
+            "cy": float(self.intrinsics[1, 2]),
+            "frames": [],
+        }
+        for frame_idx in range(self.num_frames):
+            color, depth, c2w = self[frame_idx]
+            cv2.imwrite(os.path.join(output_dir, "rgb", f"{frame_idx}.png"), cv2.cvtColor(color, cv2.COLOR_RGB2BGR))
+            imageio.imwrite(os.path.join(output_dir, "depth", f"{frame_idx}.tiff"), depth)
+            manifest["frames"].append({
+                "file_path": f"rgb/{frame_idx}.png",
+                "depth_path": f"depth/{frame_idx}.tiff",
+                "transform_matrix": (ARKIT_TO_GRADSLAM @ c2w @ ARKIT_TO_GRADSLAM).tolist(),
+            })
+        with open(os.path.join(output_dir, "transforms.json"), "w") as f:
+            json.dump(manifest, f, indent=4)
+        return output_dir
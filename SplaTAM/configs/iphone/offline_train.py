@@ -61,6 +61,50 @@ config = dict(
     save_checkpoints=True, # Save Checkpoints
     checkpoint_interval=100, # Checkpoint Interval
     use_wandb=False,
+    online_ate=dict( # Running ATE of the tracked trajectory against the ARKit poses
+        enabled=True,
+        with_scale=False, # Sim(3) instead of SE(3) alignment
+        drift_threshold=0.1, # Warn when the running ATE RMSE (m) exceeds this (None to disable the alarm)
+        min_frames=10, # Frames before the drift alarm is armed
+    ),
+    profiling=dict( # Per-stage runtimes, counters & histograms (saved as profile.json/csv in the output directory)
+        enabled=True,
+        detailed=False, # Also time the render, backward & optimizer step of every iteration
+        cuda_sync=False, # Synchronize CUDA around every span for accurate GPU timings (slower)
+    ),
+    gaussian_budget=dict( # Bounds the size of the map by evicting the lowest contribution Gaussians after mapping
+        enabled=False,
+        max_gaussians=None, # Max number of Gaussians (None for no limit)
+        max_bytes=None, # Max memory (bytes) of the Gaussians incl. gradients & optimizer state (None for no limit)
+        policy='drop', # Eviction policy: 'drop' or 'merge' (merge near-duplicates first, then drop if still over)
+        target_fraction=0.9, # Evict down to this fraction of the budget
+        recency_half_life=100, # Frames after which the contribution score of a Gaussian is halved
+        merge=dict(dist_ratio=0.5, color_thres=0.1, max_radius=None), # Duplicate criteria of the merge policy
+    ),
+    gaussian_merge=dict( # Periodically merges near-duplicate Gaussians (opacity-weighted moments) after mapping
+        enabled=False,
+        merge_every=10, # Frames between merge passes
+        dist_ratio=0.5, # Max center distance of duplicates, relative to the smaller of their scales
+        color_thres=0.1, # Max RGB distance of duplicates
+        max_radius=None, # Max center distance of duplicates (None for dist_ratio x the 90th percentile of the scales)
+    ),
+    spatial_index=dict( # Voxel hash over the Gaussian centers for radius, kNN & frustum queries
+        enabled=False,
+        voxel_size=0.05, # Edge length of the voxels (m)
+        chunk_size=65536, # Number of queries processed at once (bounds the memory of the queries)
+    ),
+    frustum_culling=dict( # Only render the Gaussians in the view frustum of the frame during tracking & mapping
+        enabled=False,
+        expand=0.1, # Expansion of the image plane on every side (fraction of the image size)
+        near=0.01, # Near plane (m)
+        far=100.0, # Far plane (m)
+    ),
+    keyframe_store=dict( # Storage of the mapping keyframes
+        compress=True, # Keep the keyframe color as uint8 & depth as float16
+        max_device_keyframes=64, # Max keyframes on the GPU (least recently used ones are offloaded, None for no limit)
+        offload='host', # Offload to 'host' (pinned) memory or to 'disk' (memory-mapped files)
+        offload_dir=None, # Directory of the disk offload (defaults to <output dir>/keyframes)
+    ),
     data=dict(
         dataset_name="nerfcapture",
         basedir=base_dir,
@@ -78,14 +122,21 @@ config = dict(
     tracking=dict(
         use_gt_poses=False, # Use GT Poses for Tracking in offline mode
         forward_prop=True, # Forward Propagate Poses
+        motion_model=dict( # Initialization of the camera pose of a new frame (if forward_prop)
+            type='constant_velocity', # 'constant_velocity', 'constant_acceleration' or 'linear' (SE(3) extrapolation)
+            damping=1.0, # Fraction of the extrapolated motion applied to the previous pose
+            use_arkit_prior=False, # Move the previous pose by the relative motion of the ARKit poses instead
+        ),
         visualize_tracking_loss=False, # Visualize Tracking Diff Images
         num_iters=tracking_iters,
+        num_pixels=None, # Only evaluate the loss at ~num_pixels high-gradient pixels (None for all the pixels)
         use_sil_for_loss=True,
         sil_thres=0.99,
         use_l1=True,
         use_depth_loss_thres=True,
         depth_loss_thres=20000, # Num of Tracking Iters becomes twice if this value is not met
         ignore_outlier_depth_loss=False,
+        outlier_median_samples=None, # Outlier threshold from the median of a strided subset of pixels (None for all)
         use_uncertainty_for_loss_mask=False,
         use_uncertainty_for_loss=False,
         use_chamfer=False,
@@ -93,6 +144,15 @@ config = dict(
             im=0.5,
             depth=1.0,
         ),
+        pyramid=dict( # Coarse-to-fine tracking on an image pyramid of the frame
+            enabled=False,
+            num_levels=3, # Levels including the tracking resolution
+            scale_factor=0.5, # Downsampling factor between levels
+            level_iters=[30, 15], # Max iterations of the coarse levels (coarsest first)
+            fine_iters=15, # Iterations at the tracking resolution (replaces num_iters)
+            convergence_thres=1e-3, # A coarse level stops once its loss hasn't improved by this fraction ...
+            patience=5, # ... for this many iterations
+        ),
         lrs=dict(
             means3D=0.0,
             rgb_colors=0.0,
@@ -105,10 +165,15 @@ config = dict(
     ),
     mapping=dict(
         num_iters=mapping_iters,
+        batch_size=1, # Frames rendered per optimizer step (gradients averaged over the batch)
+        keyframe_sampling=None, # 'shuffle' (covers the window every ceil(window/batch) iters), 'uniform' (with replacement) or None ('shuffle' if batch_size > 1)
         add_new_gaussians=True,
         sil_thres=0.5, # For Addition of new Gaussians
+        new_gaussian_voxel_size=None, # Merge the new Gaussians of a frame per voxel of this size (None for one per pixel)
+        skip_covered_new_gaussians=True, # Don't add merged Gaussians next to existing ones (needs the spatial index)
         use_l1=True,
         ignore_outlier_depth_loss=False,
+        outlier_median_samples=None, # Outlier threshold from the median of a strided subset of pixels (None for all)
         use_sil_for_loss=False,
         use_uncertainty_for_loss_mask=False,
         use_uncertainty_for_loss=False,
@@ -160,5 +225,10 @@ config = dict(
         view_scale=2,
         viz_fps=5, # FPS for Online Recon Viz
         enter_interactive_post_online=True, # Enter Interactive Mode after Offline Recon Viz
+        lod=dict( # Render a cut of a level-of-detail hierarchy of the Gaussians (For Final Recon Viz)
+            enabled=False,
+            max_depth=12, # Levels of the octree (cached next to params.npz as params_lod.npz)
+            pixel_error=1.0, # Max projected error (pixels) of the aggregated Gaussians of the cut
+        ),
     ),
 )
@@ -16,5 +16,10 @@ config = dict(
         view_scale=2,
         viz_fps=5, # FPS for Online Recon Viz
         enter_interactive_post_online=True, # Enter Interactive Mode after Online Recon Viz
+        lod=dict( # Render a cut of a level-of-detail hierarchy of the Gaussians (For Final Recon Viz)
+            enabled=False,
+            max_depth=12, # Levels of the octree (cached next to params.npz as params_lod.npz)
+            pixel_error=1.0, # Max projected error (pixels) of the aggregated Gaussians of the cut
+        ),
     ),
 )
\ No newline at end of file
@@ -119,6 +119,7 @@ class GradSLAMDataset(torch.utils.data.Dataset):
         embedding_dir: str = "feat_lseg_240_320",
         embedding_dim: int = 512,
         relative_pose: bool = True,  # If True, the pose is relative to the first frame
+        device_preprocess: bool = False,  # If True, resize & normalize the raw frames on `device`
         **kwargs,
     ):
         super().__init__()
@@ -146,6 +147,7 @@ class GradSLAMDataset(torch.utils.data.Dataset):
         self.embedding_dir = embedding_dir
         self.embedding_dim = embedding_dim
         self.relative_pose = relative_pose
+        self.device_preprocess = device_preprocess
 
         self.start = start
         self.end = end
@@ -159,6 +161,10 @@ class GradSLAMDataset(torch.utils.data.Dataset):
             if "distortion" in config_dict["camera_params"]
             else None
         )
+        # Optionally undistort depth as well (with nearest neighbour remapping)
+        self.undistort_depth = config_dict["camera_params"].get("undistort_depth", False)
+        # Remap tables fusing undistortion with the resize to the desired resolution, built once per source resolution
+        self._undistort_maps = {}
         self.crop_size = (
             config_dict["camera_params"]["crop_size"] if "crop_size" in config_dict["camera_params"] else None
         )
@@ -190,7 +196,8 @@ class GradSLAMDataset(torch.utils.data.Dataset):
         self.num_imgs = len(self.color_paths)
 
         # self.transformed_poses = datautils.poses_to_transforms(self.poses)
-        self.poses = torch.stack(self.poses)
+        if not torch.is_tensor(self.poses):
+            self.poses = torch.stack(self.poses)
         if self.relative_pose:
             self.transformed_poses = self._preprocess_poses(self.poses)
         else:
@@ -221,11 +228,13 @@ class GradSLAMDataset(torch.utils.data.Dataset):
             - Input: :math:`(H_\text{old}, W_\text{old}, C)`
             - Output: :math:`(H, W, C)` if `self.channels_first == False`, else :math:`(C, H, W)`.
         """
-        color = cv2.resize(
-            color,
-            (self.desired_width, self.desired_height),
-            interpolation=cv2.INTER_LINEAR,
-        )
+        if color.shape[:2] != (self.desired_height, self.desired_width):
+            color = cv2.resize(
+                color,
+                (self.desired_width, self.desired_height),
+                interpolation=cv2.INTER_LINEAR,
+            )
+        color = color.astype(np.float32)
         if self.normalize_color:
             color = datautils.normalize_image(color)
         if self.channels_first:
@@ -246,16 +255,67 @@ class GradSLAMDataset(torch.utils.data.Dataset):
             - depth: :math:`(H_\text{old}, W_\text{old})`
             - Output: :math:`(H, W, 1)` if `self.channels_first == False`, else :math:`(1, H, W)`.
         """
-        depth = cv2.resize(
-            depth.astype(float),
-            (self.desired_width, self.desired_height),
-            interpolation=cv2.INTER_NEAREST,
-        )
-        depth = np.expand_dims(depth, -1)
+        if depth.shape[:2] != (self.desired_height, self.desired_width):
+            depth = cv2.resize(
+                depth,
+                (self.desired_width, self.desired_height),
+                interpolation=cv2.INTER_NEAREST,
+            )
+        depth = np.expand_dims(depth, -1).astype(np.float32)
         if self.channels_first:
             depth = datautils.channels_first(depth)
         return depth / self.png_depth_scale
 
+    def _get_undistort_maps(self, height: int, width: int):
+        r"""Returns the (cached) remap tables that undistort an image of size :math:`(H_\text{old}, W_\text{old})`
+        and resize it to the desired resolution in a single `cv2.remap`. The undistorted image has the same
+        intrinsics as `cv2.undistort` would produce, scaled to the desired resolution.
+        """
+        if (height, width) not in self._undistort_maps:
+            K = as_intrinsics_matrix([self.fx, self.fy, self.cx, self.cy])
+            src_K = datautils.scale_intrinsics(K, height / self.orig_height, width / self.orig_width)
+            dst_K = datautils.scale_intrinsics(K, self.height_downsample_ratio, self.width_downsample_ratio)
+            self._undistort_maps[(height, width)] = cv2.initUndistortRectifyMap(
+                src_K, self.distortion, None, dst_K, (self.desired_width, self.desired_height), cv2.CV_16SC2
+            )
+        return self._undistort_maps[(height, width)]
+
+    def _undistort(self, color: np.ndarray, depth: np.ndarray):
+        r"""Undistorts & resizes the raw color (and optionally depth) to the desired resolution with the cached
+        remap tables. Depth is remapped with nearest neighbour interpolation to not mix depth values.
+        """
+        map1, map2 = self._get_undistort_maps(*color.shape[:2])
+        color = cv2.remap(color, map1, map2, interpolation=cv2.INTER_LINEAR)
+        if self.undistort_depth:
+            map1, map2 = self._get_undistort_maps(*depth.shape[:2])
+            depth = cv2.remap(depth, map1, map2, interpolation=cv2.INTER_NEAREST)
+        return color, depth
+
+    def _preprocess_on_device(self, color: np.ndarray, depth: np.ndarray):
+        r"""Uploads a batch of raw frames to `self.device` in their storage dtype, and resizes them there.
+
+        Args:
+            color (np.ndarray): Raw (uint8) rgb images
+            depth (np.ndarray): Raw depth images
+
+        Returns:
+            color (torch.Tensor): Resized float32 rgb images normalized to :math:`[0, 1]`
+            depth (torch.Tensor): Resized float32 depth images in meters
+
+        Shape:
+            - color: :math:`(B, H_\text{old}, W_\text{old}, C)`
+            - depth: :math:`(B, H_\text{old}, W_\text{old})`
+            - Output: :math:`(B, C, H, W)` and :math:`(B, 1, H, W)`
+        """
+        color = datautils.resize_color_batch(
+            datautils.to_device_tensor(color, self.device), self.desired_height, self.desired_width
+        )
+        depth = datautils.resize_depth_batch(
+            datautils.to_device_tensor(depth, self.device), self.desired_height, self.desired_width,
+            self.png_depth_scale,
+        )
+        return color, depth
+
     def _preprocess_poses(self, poses: torch.Tensor):
         r"""Preprocesses the poses by setting first pose in a sequence to identity and computing the relative
         homogenous transformation for all other poses.
@@ -287,41 +347,101 @@ class GradSLAMDataset(torch.utils.data.Dataset):
         K = torch.from_numpy(K)
         return K
 
+    def get_scaled_intrinsics(self):
+        """
+        Return the 4x4 camera intrinsics matrix scaled to the desired resolution
+        """
+        K = self.get_cam_K()
+        K = datautils.scale_intrinsics(K, self.height_downsample_ratio, self.width_downsample_ratio)
+        intrinsics = torch.eye(4).to(K)
+        intrinsics[:3, :3] = K
+        return intrinsics
+
     def read_embedding_from_file(self, embedding_path: str):
         """
         Read embedding from file and process it. To be implemented in subclass for each dataset separately.
         """
         raise NotImplementedError
 
-    def __getitem__(self, index):
-        color_path = self.color_paths[index]
-        depth_path = self.depth_paths[index]
-        color = np.asarray(imageio.imread(color_path), dtype=float)
-        color = self._preprocess_color(color)
+    def read_color(self, color_path: str):
+        """
+        Read the raw rgb image in its storage dtype (uint8)
+        """
+        return np.asarray(imageio.imread(color_path))
+
+    def read_depth(self, depth_path: str):
+        """
+        Read the raw depth image in its storage dtype (e.g. uint16 for png, float32 for exr & tiff)
+        """
         if ".png" in depth_path:
             # depth_data = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
-            depth = np.asarray(imageio.imread(depth_path), dtype=np.int64)
+            return np.asarray(imageio.imread(depth_path))
         elif ".exr" in depth_path:
-            depth = readEXR_onlydepth(depth_path)
+            return readEXR_onlydepth(depth_path)
         elif ".tiff" in depth_path:
-            depth = np.asarray(imageio.imread(depth_path), dtype=np.float32)
+            return np.asarray(imageio.imread(depth_path), dtype=np.float32)
         else:
             raise ValueError(f"Unsupported depth file format for path: {depth_path}")
 
-        K = as_intrinsics_matrix([self.fx, self.fy, self.cx, self.cy])
-        if self.distortion is not None:
-            # undistortion is only applied on color image, not depth!
-            color = cv2.undistort(color, K, self.distortion)
+    def get_frames(self, indices):
+        """
+        Load & preprocess a batch of frames with a single upload & resize on `self.device`.
+        Irrespective of `channels_first` & `normalize_color`, the frames are returned channels first,
+        with color normalized to [0, 1] & depth in meters (the layout used by SLAM).
 
-        color = torch.from_numpy(color)
-        K = torch.from_numpy(K)
+        Args:
+            indices (list of int): Indices of the frames to load
 
-        depth = self._preprocess_depth(depth)
-        depth = torch.from_numpy(depth)
+        Returns:
+            color (torch.Tensor): Color images of shape (B, 3, H, W)
+            depth (torch.Tensor): Depth images of shape (B, 1, H, W)
+            intrinsics (torch.Tensor): Intrinsics of shape (4, 4)
+            poses (torch.Tensor): Poses of shape (B, 4, 4)
+        """
+        color, depth = [], []
+        for index in indices:
+            curr_color = self.read_color(self.color_paths[index])
+            curr_depth = self.read_depth(self.depth_paths[index])
+            if self.distortion is not None:
+                curr_color, curr_depth = self._undistort(curr_color, curr_depth)
+            color.append(curr_color)
+            depth.append(curr_depth)
+        color, depth = self._preprocess_on_device(np.stack(color), np.stack(depth))
+        intrinsics = self.get_scaled_intrinsics()
+        poses = self.transformed_poses[list(indices)]
+        return (
+            color.type(self.dtype),
+            depth.type(self.dtype),
+            intrinsics.to(self.device).type(self.dtype),
+            poses.to(self.device).type(self.dtype),
+        )
 
-        K = datautils.scale_intrinsics(K, self.height_downsample_ratio, self.width_downsample_ratio)
-        intrinsics = torch.eye(4).to(K)
-        intrinsics[:3, :3] = K
+    def __getitem__(self, index):
+        color_path = self.color_paths[index]
+        depth_path = self.depth_paths[index]
+        color = self.read_color(color_path)
+        depth = self.read_depth(depth_path)
+
+        if self.distortion is not None:
+            # Undistortion is fused with the resize (depth is only undistorted if undistort_depth is set)
+            color, depth = self._undistort(color, depth)
+
+        if self.device_preprocess:
+            color, depth = self._preprocess_on_device(color[None], depth[None])
+            color, depth = color[0], depth[0]
+            if not self.normalize_color:
+                color = color * 255
+            if not self.channels_first:
+                color = color.permute(1, 2, 0)
+                depth = depth.permute(1, 2, 0)
+        else:
+            color = self._preprocess_color(color)
+            color = torch.from_numpy(color)
+
+            depth = self._preprocess_depth(depth)
+            depth = torch.from_numpy(depth)
+
+        intrinsics = self.get_scaled_intrinsics()
 
         pose = self.transformed_poses[index]
 
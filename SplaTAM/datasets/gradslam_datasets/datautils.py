@@ -5,10 +5,14 @@ from typing import List, Union
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 
 __all__ = [
     "normalize_image",
     "channels_first",
+    "to_device_tensor",
+    "resize_color_batch",
+    "resize_depth_batch",
     "scale_intrinsics",
     "pointquaternion_to_homogeneous",
     "poses_to_transforms",
@@ -32,7 +36,7 @@ def normalize_image(rgb: Union[torch.Tensor, np.ndarray]):
     if torch.is_tensor(rgb):
         return rgb.float() / 255
     elif isinstance(rgb, np.ndarray):
-        return rgb.astype(float) / 255
+        return rgb.astype(np.float32) / 255
     else:
         raise TypeError("Unsupported input rgb type: %r" % type(rgb))
 
@@ -70,6 +74,68 @@ def channels_first(rgb: Union[torch.Tensor, np.ndarray]):
         return rgb.permute(*ordering).contiguous()
 
 
+def to_device_tensor(array: np.ndarray, device: Union[str, torch.device]):
+    r"""Uploads a numpy array to `device` in its storage dtype (e.g. uint8 color or uint16 depth) so that
+    only the raw bytes are transferred. uint16 arrays are transferred as int16 and widened to int32 on `device`.
+
+    Args:
+        array (numpy.ndarray): Array to upload
+        device (str or torch.device): Target device
+
+    Returns:
+        torch.Tensor: Tensor on `device`
+    """
+    if array.dtype == np.uint16:
+        tensor = torch.from_numpy(np.ascontiguousarray(array).view(np.int16)).to(device)
+        return tensor.to(torch.int32) & 0xFFFF
+    return torch.from_numpy(np.ascontiguousarray(array)).to(device)
+
+
+def resize_color_batch(color: torch.Tensor, height: int, width: int):
+    r"""Resizes a batch of channels last color images (any dtype, values in :math:`[0, 255]`) with bilinear
+    interpolation (matching `cv2.INTER_LINEAR`), and returns them channels first & normalized to :math:`[0, 1]`.
+
+    Args:
+        color (torch.Tensor): Batch of color images
+        height (int): Desired height
+        width (int): Desired width
+
+    Returns:
+        torch.Tensor: Resized float32 color images in range :math:`[0, 1]`
+
+    Shape:
+        - color: :math:`(B, H_\text{old}, W_\text{old}, C)`
+        - Output: :math:`(B, C, H, W)`
+    """
+    color = color.permute(0, 3, 1, 2).float()
+    if color.shape[-2:] != (height, width):
+        color = F.interpolate(color, size=(height, width), mode="bilinear", align_corners=False)
+    return color / 255
+
+
+def resize_depth_batch(depth: torch.Tensor, height: int, width: int, depth_scale: float = 1.0):
+    r"""Resizes a batch of depth images with nearest neighbour interpolation (matching `cv2.INTER_NEAREST`),
+    and returns them channels first & divided by `depth_scale`.
+
+    Args:
+        depth (torch.Tensor): Batch of depth images
+        height (int): Desired height
+        width (int): Desired width
+        depth_scale (float): Scale to divide the depth values by (e.g. to convert them to meters)
+
+    Returns:
+        torch.Tensor: Resized float32 depth images
+
+    Shape:
+        - depth: :math:`(B, H_\text{old}, W_\text{old})`
+        - Output: :math:`(B, 1, H, W)`
+    """
+    depth = depth.unsqueeze(1).float()
+    if depth.shape[-2:] != (height, width):
+        depth = F.interpolate(depth, size=(height, width), mode="nearest")
+    return depth / depth_scale
+
+
 def scale_intrinsics(
     intrinsics: Union[np.ndarray, torch.Tensor],
     h_ratio: Union[float, int],
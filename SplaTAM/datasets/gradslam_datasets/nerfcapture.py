@@ -15,6 +15,13 @@ def create_filepath_index_mapping(frames):
     return {frame["file_path"]: index for index, frame in enumerate(frames)}
 
 
+# Flips the y & z axes to convert ARKit/NeRF (OpenGL) camera-to-world poses to the GradSLAM (OpenCV) convention
+ARKIT_TO_GRADSLAM = np.diag([1.0, -1.0, -1.0, 1.0]).astype(np.float32)
+
+INDEX_CACHE_NAME = ".nerfcapture_index.npz"
+INDEX_CACHE_VERSION = 1
+
+
 class NeRFCaptureDataset(GradSLAMDataset):
     def __init__(
         self,
@@ -28,31 +35,35 @@ class NeRFCaptureDataset(GradSLAMDataset):
         load_embeddings: Optional[bool] = False,
         embedding_dir: Optional[str] = "embeddings",
         embedding_dim: Optional[int] = 512,
+        use_index_cache: Optional[bool] = True,
         **kwargs,
     ):
         self.input_folder = os.path.join(basedir, sequence)
         config_dict = {}
         config_dict["dataset_name"] = "nerfcapture"
         self.pose_path = None
-        
-        # Load NeRFStudio format camera & poses data
-        self.cams_metadata = self.load_cams_metadata()
-        self.frames_metadata = self.cams_metadata["frames"]
-        self.filepath_index_mapping = create_filepath_index_mapping(self.frames_metadata)
 
-        # Load RGB & Depth filepaths
-        self.image_names = natsorted(os.listdir(f"{self.input_folder}/rgb"))
-        self.image_names = [f'rgb/{image_name}' for image_name in self.image_names]
+        # Load the image names, poses & intrinsics from the sidecar index cache if it is up to date,
+        # otherwise parse the NeRFStudio format camera & poses data (and refresh the cache)
+        index = self.load_index_cache() if use_index_cache else None
+        if index is None:
+            index = self.build_index()
+            if use_index_cache:
+                self.save_index_cache(index)
+        self.image_names = index["image_names"]
+        self.depth_names = index["depth_names"]
+        self.c2w_poses = index["poses"]
+        intrinsics = index["intrinsics"]
 
         # Init Intrinsics
         config_dict["camera_params"] = {}
         config_dict["camera_params"]["png_depth_scale"] = 1.0 # Depth is in meters
-        config_dict["camera_params"]["image_height"] = self.cams_metadata["h"]
-        config_dict["camera_params"]["image_width"] = self.cams_metadata["w"]
-        config_dict["camera_params"]["fx"] = self.cams_metadata["fl_x"]
-        config_dict["camera_params"]["fy"] = self.cams_metadata["fl_y"]
-        config_dict["camera_params"]["cx"] = self.cams_metadata["cx"]
-        config_dict["camera_params"]["cy"] = self.cams_metadata["cy"]
+        config_dict["camera_params"]["image_height"] = int(intrinsics["h"])
+        config_dict["camera_params"]["image_width"] = int(intrinsics["w"])
+        config_dict["camera_params"]["fx"] = float(intrinsics["fl_x"])
+        config_dict["camera_params"]["fy"] = float(intrinsics["fl_y"])
+        config_dict["camera_params"]["cx"] = float(intrinsics["cx"])
+        config_dict["camera_params"]["cy"] = float(intrinsics["cy"])
 
         super().__init__(
             config_dict,
@@ -72,40 +83,85 @@ class NeRFCaptureDataset(GradSLAMDataset):
         cams_metadata = json.load(open(cams_metadata_path, "r"))
         return cams_metadata
     
+    def get_index_cache_key(self):
+        """Key identifying the state of transforms.json & the rgb folder the index cache was built from."""
+        metadata_stat = os.stat(f"{self.input_folder}/transforms.json")
+        rgb_stat = os.stat(f"{self.input_folder}/rgb")
+        return np.array([INDEX_CACHE_VERSION, metadata_stat.st_mtime_ns, metadata_stat.st_size, rgb_stat.st_mtime_ns],
+                        dtype=np.int64)
+
+    def build_index(self):
+        """Parse transforms.json once into the sorted image & depth names, (N, 4, 4) GradSLAM poses & intrinsics."""
+        # Load NeRFStudio format camera & poses data
+        cams_metadata = self.load_cams_metadata()
+        frames_metadata = cams_metadata["frames"]
+        filepath_index_mapping = create_filepath_index_mapping(frames_metadata)
+
+        # Load RGB filepaths
+        image_names = natsorted(os.listdir(f"{self.input_folder}/rgb"))
+        image_names = [f'rgb/{image_name}' for image_name in image_names]
+        missing_names = [image_name for image_name in image_names if image_name not in filepath_index_mapping]
+        if len(missing_names) > 0:
+            raise ValueError(f"{len(missing_names)} images have no pose in transforms.json (e.g. {missing_names[0]}).")
+        # Correctly form the depth path by replacing the folder and the extension
+        depth_names = [f"depth/{os.path.splitext(os.path.basename(image_name))[0]}.tiff" for image_name in image_names]
+
+        # Get all poses in GradSLAM format with a single batched axis flip
+        c2w = np.array([frames_metadata[filepath_index_mapping[image_name]]["transform_matrix"]
+                        for image_name in image_names], dtype=np.float32).reshape(-1, 4, 4)
+        poses = ARKIT_TO_GRADSLAM @ c2w @ ARKIT_TO_GRADSLAM.T
+
+        intrinsics = {key: cams_metadata[key] for key in ["h", "w", "fl_x", "fl_y", "cx", "cy"]}
+        return {"image_names": image_names, "depth_names": depth_names, "poses": poses, "intrinsics": intrinsics}
+
+    def load_index_cache(self):
+        """Load the sidecar index cache. Returns None if it doesn't exist or is stale."""
+        cache_path = os.path.join(self.input_folder, INDEX_CACHE_NAME)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with np.load(cache_path) as cache:
+                if not np.array_equal(cache["key"], self.get_index_cache_key()):
+                    return None
+                intrinsics_keys = [str(key) for key in cache["intrinsics_keys"]]
+                return {
+                    "image_names": cache["image_names"].tolist(),
+                    "depth_names": cache["depth_names"].tolist(),
+                    "poses": cache["poses"],
+                    "intrinsics": dict(zip(intrinsics_keys, cache["intrinsics"].tolist())),
+                }
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save_index_cache(self, index):
+        """Save the index next to transforms.json. Failing to write it (e.g. read-only dataset) is not an error."""
+        cache_path = os.path.join(self.input_folder, INDEX_CACHE_NAME)
+        intrinsics_keys = list(index["intrinsics"].keys())
+        try:
+            with open(cache_path, "wb") as f:
+                np.savez(
+                    f,
+                    key=self.get_index_cache_key(),
+                    image_names=np.array(index["image_names"]),
+                    depth_names=np.array(index["depth_names"]),
+                    poses=index["poses"],
+                    intrinsics_keys=np.array(intrinsics_keys),
+                    intrinsics=np.array([index["intrinsics"][key] for key in intrinsics_keys], dtype=np.float64),
+                )
+        except OSError as e:
+            print(f"Could not save the NeRFCapture index cache to {cache_path}: {e}")
+
     def get_filepaths(self):
         base_path = f"{self.input_folder}"
-        color_paths = []
-        depth_paths = []
-        self.tmp_poses = []
-        P = torch.tensor(
-            [
-                [1, 0, 0, 0],
-                [0, -1, 0, 0],
-                [0, 0, -1, 0],
-                [0, 0, 0, 1]
-            ]
-        ).float()
-        for image_name in self.image_names:
-            # Search for image name in frames_metadata
-            frame_metadata = self.frames_metadata[self.filepath_index_mapping.get(image_name)]
-            # Get path of image and depth
-            color_path = f"{base_path}/{image_name}"
-            # Correctly form the depth path by replacing the folder and the extension
-            depth_filename = os.path.splitext(os.path.basename(image_name))[0] + ".tiff"
-            depth_path = os.path.join(base_path, "depth", depth_filename)
-            color_paths.append(color_path)
-            depth_paths.append(depth_path)
-            # Get pose of image in GradSLAM format
-            c2w = torch.from_numpy(np.array(frame_metadata["transform_matrix"])).float()
-            _pose = P @ c2w @ P.T
-            self.tmp_poses.append(_pose)
+        color_paths = [f"{base_path}/{image_name}" for image_name in self.image_names]
+        depth_paths = [f"{base_path}/{depth_name}" for depth_name in self.depth_names]
         embedding_paths = None
         if self.load_embeddings:
             embedding_paths = natsorted(glob.glob(f"{base_path}/{self.embedding_dir}/*.pt"))
         return color_paths, depth_paths, embedding_paths
 
     def load_poses(self):
-        return self.tmp_poses
+        return torch.from_numpy(self.c2w_poses).float()
 
     def read_embedding_from_file(self, embedding_file_path):
         print(embedding_file_path)
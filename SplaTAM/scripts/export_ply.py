@@ -1,10 +1,17 @@
 import os
+import sys
 import argparse
 from importlib.machinery import SourceFileLoader
 
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, _BASE_DIR)
+
 import numpy as np
 from plyfile import PlyData, PlyElement
 
+from utils.gaussian_lod import build_lod
+
 # Spherical harmonic constant
 C0 = 0.28209479177387814
 
@@ -47,6 +54,9 @@ def save_ply(path, means, scales, rotations, rgbs, opacities, normals=None):
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("config", type=str, help="Path to config file.")
+    parser.add_argument("--lod_level", type=int, default=None,
+                        help="Export the aggregated Gaussians of this level of the LOD hierarchy instead of all the Gaussians.")
+    parser.add_argument("--lod_depth", type=int, default=12, help="Depth of the LOD hierarchy.")
     return parser.parse_args()
 
 
@@ -60,13 +70,18 @@ if __name__ == "__main__":
     run_name = config['run_name']
     params_path = os.path.join(work_path, run_name, "params.npz")
 
-    params = dict(np.load(params_path, allow_pickle=True))
+    if args.lod_level is None:
+        params = dict(np.load(params_path, allow_pickle=True))
+        ply_path = os.path.join(work_path, run_name, "splat.ply")
+    else:
+        # Aggregated Gaussians of a level of the LOD hierarchy
+        lod = build_lod(params_path, dict(max_depth=args.lod_depth), device="cpu")
+        params = {k: v.numpy() for k, v in lod.level_params(args.lod_level).items()}
+        ply_path = os.path.join(work_path, run_name, f"splat_lod{args.lod_level}.ply")
     means = params['means3D']
     scales = params['log_scales']
     rotations = params['unnorm_rotations']
     rgbs = params['rgb_colors']
     opacities = params['logit_opacities']
 
-    ply_path = os.path.join(work_path, run_name, "splat.ply")
-
     save_ply(ply_path, means, scales, rotations, rgbs, opacities)
\ No newline at end of file
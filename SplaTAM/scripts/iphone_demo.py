@@ -8,6 +8,7 @@ https://github.com/NVlabs/instant-ngp/blob/master/scripts/nerfcapture2nerf.py
 import argparse
 import os
 import shutil
+import signal
 import sys
 import time
 from pathlib import Path
@@ -27,12 +28,22 @@ from tqdm import tqdm
 
 from datasets.gradslam_datasets.geometryutils import relative_transformation
 from utils.common_utils import seed_everything, save_params_ckpt, save_params
-from utils.eval_helpers import report_progress
-from utils.keyframe_selection import keyframe_selection_overlap
+from utils.eval_helpers import report_progress, get_estimated_w2c
+from utils.gaussian_budget import enforce_gaussian_budget
+from utils.gaussian_merge import merge_duplicate_gaussians
+from utils.instrumentation import build_profiler
+from utils.keyframe_selection import keyframe_selection_overlap, KeyframeSampler
+from utils.keyframe_store import build_keyframe_store
+from utils.motion_model import get_relative_motion
+from utils.rate_control import RateController, PERSIST, TRACK_AND_MAP
 from utils.recon_helpers import setup_camera
 from utils.slam_external import build_rotation, prune_gaussians, densify
-from utils.slam_helpers import matrix_to_quaternion
-from scripts.splatam import get_loss, initialize_optimizer, initialize_params, initialize_camera_pose, get_pointcloud, add_new_gaussians
+from utils.slam_helpers import matrix_to_quaternion, frustum_cull_gaussians, sample_tracking_pixels
+from utils.spatial_hash import build_spatial_index
+from utils.tracking_pyramid import build_tracking_pyramid
+from utils.trajectory_eval import OnlineATEEstimator
+from scripts.splatam import (get_loss, track_coarse_levels, initialize_optimizer, initialize_params, initialize_camera_pose,
+                             get_pointcloud, add_new_gaussians, grow_camera_trajectory, trim_camera_trajectory)
 
 from diff_gaussian_rasterization import GaussianRasterizer as Renderer
 
@@ -123,20 +134,53 @@ def dataset_capture_loop(reader: DataReader, save_path: Path, overwrite: bool, n
     time_idx = total_frames
     num_frames = n_frames # Total frames desired
 
-    # Initialize list to keep track of Keyframes
-    keyframe_list = []
+    # Open-ended capture (num_frames <= 0): grow the trajectory on demand & stop on a control signal or idle timeout
+    streaming = num_frames is None or num_frames <= 0
+    streaming_config = config.get('streaming', {})
+    idle_timeout = streaming_config.get('idle_timeout', 30.0)
+    stop_file = streaming_config.get('stop_file', None)
+    max_keyframes = streaming_config.get('max_keyframes', None)
+    stop_requested = False
+    if streaming:
+        print(f"Open-ended capture: stop with Ctrl+C{f', by creating {stop_file}' if stop_file else ''} "
+              f"or by not sending frames for {idle_timeout} s.")
+        def request_stop(signum, frame):
+            nonlocal stop_requested
+            stop_requested = True
+        prev_sigint_handler = signal.signal(signal.SIGINT, request_stop)
+    last_sample_time = time.time()
+
+    # Rate control: decide per frame whether to track & map, only track or only persist it to bound the lag
+    rate_control_config = config.get('rate_control', {})
+    rate_controller = None
+    if rate_control_config.get('enabled', False):
+        rate_controller = RateController(max_lag=rate_control_config.get('max_lag', 1.0),
+                                         min_overlap=rate_control_config.get('min_overlap', 0.8),
+                                         max_skipped_frames=rate_control_config.get('max_skipped_frames', 10),
+                                         max_frames_without_map=rate_control_config.get('max_frames_without_map', 5),
+                                         latency_ema=rate_control_config.get('latency_ema', 0.2))
+    slam_frame_indices = [] # Dataset frame index of every frame processed by SLAM
+
+    # Running ATE of the tracked trajectory against the ARKit poses (O(1) per frame, used as drift alarm)
+    online_ate_config = config.get('online_ate', {})
+    online_ate = None
+    if online_ate_config.get('enabled', True):
+        online_ate = OnlineATEEstimator(with_scale=online_ate_config.get('with_scale', False),
+                                        drift_threshold=online_ate_config.get('drift_threshold', None),
+                                        min_frames=online_ate_config.get('min_frames', 10))
+
+    # Initialize store to keep track of Keyframes (compressed & offloaded from the device if configured)
+    keyframe_list = build_keyframe_store(config, "cuda", str(save_path))
     keyframe_time_indices = []
 
     # Init Variables to keep track of ARkit poses and runtimes
     gt_w2c_all_frames = []
-    tracking_iter_time_sum = 0
-    tracking_iter_time_count = 0
-    mapping_iter_time_sum = 0
-    mapping_iter_time_count = 0
-    tracking_frame_time_sum = 0
-    tracking_frame_time_count = 0
-    mapping_frame_time_sum = 0
-    mapping_frame_time_count = 0
+    profiler = build_profiler(config)
+    gaussian_budget_config = config.get('gaussian_budget', {})
+    merge_config = config.get('gaussian_merge', {})
+    culling_config = config.get('frustum_culling', {})
+    tracking_pyramid = build_tracking_pyramid(config)
+    motion_config = config['tracking'].get('motion_model', {})
     P = torch.tensor(
         [
             [1, 0, 0, 0],
@@ -146,374 +190,533 @@ def dataset_capture_loop(reader: DataReader, save_path: Path, overwrite: bool, n
         ]
     ).float()
 
-    # Start DDS Loop
-    while True:
-        sample = reader.read_next() # Get frame from NeRFCapture
-        if sample:
-            print(f"{total_frames + 1}/{n_frames} frames received")
-
-            if total_frames == 0:
-                save_path.mkdir(parents=True, exist_ok=True)
-                images_dir.mkdir(exist_ok=True)
-                manifest["w"] = sample.width
-                manifest["h"] = sample.height
-                manifest["cx"] = sample.cx
-                manifest["cy"] = sample.cy
-                manifest["fl_x"] = sample.fl_x
-                manifest["fl_y"] = sample.fl_y
-                manifest["integer_depth_scale"] = float(depth_scale)/65535.0
+    # Start DDS Loop (the SIGINT handler of open-ended captures is restored even if it raises)
+    try:
+        while True:
+            if streaming:
+                if stop_file is not None and os.path.exists(stop_file):
+                    stop_requested = True
+                if stop_requested:
+                    print("Stop requested. Finishing capture...")
+                    break
+                if total_frames > 0 and time.time() - last_sample_time > idle_timeout:
+                    print(f"No frames received for {idle_timeout} s. Finishing capture...")
+                    break
+            sample = reader.read_next() # Get frame from NeRFCapture
+            if sample:
+                last_sample_time = time.time()
+                if streaming:
+                    print(f"{total_frames + 1} frames received")
+                else:
+                    print(f"{total_frames + 1}/{n_frames} frames received")
+
+                if total_frames == 0:
+                    save_path.mkdir(parents=True, exist_ok=True)
+                    images_dir.mkdir(exist_ok=True)
+                    manifest["w"] = sample.width
+                    manifest["h"] = sample.height
+                    manifest["cx"] = sample.cx
+                    manifest["cy"] = sample.cy
+                    manifest["fl_x"] = sample.fl_x
+                    manifest["fl_y"] = sample.fl_y
+                    manifest["integer_depth_scale"] = float(depth_scale)/65535.0
+                    if sample.has_depth:
+                        depth_dir = save_path.joinpath("depth")
+                        depth_dir.mkdir(exist_ok=True)
+
+                # RGB
+                image = np.asarray(sample.image, dtype=np.uint8).reshape((sample.height, sample.width, 3))
+                cv2.imwrite(str(images_dir.joinpath(f"{total_frames}.png")), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+                # Depth if avaiable
+                save_depth = None
                 if sample.has_depth:
-                    depth_dir = save_path.joinpath("depth")
-                    depth_dir.mkdir(exist_ok=True)
-
-            # RGB
-            image = np.asarray(sample.image, dtype=np.uint8).reshape((sample.height, sample.width, 3))
-            cv2.imwrite(str(images_dir.joinpath(f"{total_frames}.png")), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
-
-            # Depth if avaiable
-            save_depth = None
-            if sample.has_depth:
-                # Save Depth Image
-                save_depth = np.asarray(sample.depth_image, dtype=np.uint8).view(
-                    dtype=np.float32).reshape((sample.depth_height, sample.depth_width))
-                save_depth = (save_depth*65535/float(depth_scale)).astype(np.uint16)
-                save_depth = cv2.resize(save_depth, dsize=(
-                    sample.width, sample.height), interpolation=cv2.INTER_NEAREST)
-                cv2.imwrite(str(depth_dir.joinpath(f"{total_frames}.png")), save_depth)
-                # Load Depth Image for SplaTAM
-                curr_depth = np.asarray(sample.depth_image, dtype=np.uint8).view(
-                    dtype=np.float32).reshape((sample.depth_height, sample.depth_width))
-            else:
-                print("No Depth Image Received. Please make sure that the NeRFCapture App \
-                      mentions Depth Supported on the top right corner. Skipping Frame...")
-                continue
-
-            # ARKit Poses for saving dataset
-            X_WV = np.asarray(sample.transform_matrix,
-                              dtype=np.float32).reshape((4, 4)).T
-            frame = {
-                "transform_matrix": X_WV.tolist(),
-                "file_path": f"rgb/{total_frames}.png",
-                "fl_x": sample.fl_x,
-                "fl_y": sample.fl_y,
-                "cx": sample.cx,
-                "cy": sample.cy,
-                "w": sample.width,
-                "h": sample.height
-            }
-            if save_depth is not None:
-                frame["depth_path"] = f"depth/{total_frames}.png"
-            manifest["frames"].append(frame)
-
-            # Convert ARKit Pose to GradSLAM format
-            gt_pose = torch.from_numpy(X_WV).float()
-            gt_pose = P @ gt_pose @ P.T
-            if time_idx == 0:
-                first_abs_gt_pose = gt_pose
-            gt_pose = relative_transformation(first_abs_gt_pose.unsqueeze(0), gt_pose.unsqueeze(0), orthogonal_rotations=False)
-            gt_w2c = torch.linalg.inv(gt_pose[0])
-            gt_w2c_all_frames.append(gt_w2c)
+                    # Save Depth Image
+                    save_depth = np.asarray(sample.depth_image, dtype=np.uint8).view(
+                        dtype=np.float32).reshape((sample.depth_height, sample.depth_width))
+                    save_depth = (save_depth*65535/float(depth_scale)).astype(np.uint16)
+                    save_depth = cv2.resize(save_depth, dsize=(
+                        sample.width, sample.height), interpolation=cv2.INTER_NEAREST)
+                    cv2.imwrite(str(depth_dir.joinpath(f"{total_frames}.png")), save_depth)
+                    # Load Depth Image for SplaTAM
+                    curr_depth = np.asarray(sample.depth_image, dtype=np.uint8).view(
+                        dtype=np.float32).reshape((sample.depth_height, sample.depth_width))
+                else:
+                    print("No Depth Image Received. Please make sure that the NeRFCapture App \
+                          mentions Depth Supported on the top right corner. Skipping Frame...")
+                    continue
+
+                # ARKit Poses for saving dataset
+                X_WV = np.asarray(sample.transform_matrix,
+                                  dtype=np.float32).reshape((4, 4)).T
+                frame = {
+                    "transform_matrix": X_WV.tolist(),
+                    "file_path": f"rgb/{total_frames}.png",
+                    "fl_x": sample.fl_x,
+                    "fl_y": sample.fl_y,
+                    "cx": sample.cx,
+                    "cy": sample.cy,
+                    "w": sample.width,
+                    "h": sample.height
+                }
+                if save_depth is not None:
+                    frame["depth_path"] = f"depth/{total_frames}.png"
+                manifest["frames"].append(frame)
+
+                # Decide whether to track & map, only track or only persist the current frame
+                frame_start_time = time.time()
+                rate_decision = TRACK_AND_MAP
+                if rate_controller is not None:
+                    fov = 2 * np.arctan(min(sample.width / (2 * sample.fl_x), sample.height / (2 * sample.fl_y)))
+                    valid_depth = curr_depth[curr_depth > 0]
+                    scene_depth = float(np.median(valid_depth)) if valid_depth.size > 0 else 1.0
+                    rate_decision = rate_controller.decide(X_WV, sample.timestamp, frame_start_time, fov, scene_depth)
+                    if rate_decision == PERSIST:
+                        print(f"Lagging {rate_controller.lag:.2f} s behind. Only saving frame {total_frames}.")
+                        if not streaming and total_frames == n_frames - 1:
+                            break
+                        total_frames += 1
+                        continue
+                slam_frame_indices.append(total_frames)
+
+                # Convert ARKit Pose to GradSLAM format
+                gt_pose = torch.from_numpy(X_WV).float()
+                gt_pose = P @ gt_pose @ P.T
+                if time_idx == 0:
+                    first_abs_gt_pose = gt_pose
+                gt_pose = relative_transformation(first_abs_gt_pose.unsqueeze(0), gt_pose.unsqueeze(0), orthogonal_rotations=False)
+                gt_w2c = torch.linalg.inv(gt_pose[0])
+                gt_w2c_all_frames.append(gt_w2c)
             
-            # Initialize Tracking & Mapping Resolution Data
-            color = cv2.resize(image, dsize=(
-                config['data']['desired_image_width'], config['data']['desired_image_height']), interpolation=cv2.INTER_LINEAR)
-            depth = cv2.resize(curr_depth, dsize=(
-                    config['data']['desired_image_width'], config['data']['desired_image_height']), interpolation=cv2.INTER_NEAREST)
-            depth = np.expand_dims(depth, -1)
-            color = torch.from_numpy(color).cuda().float()
-            color = color.permute(2, 0, 1) / 255
-            depth = torch.from_numpy(depth).cuda().float()
-            depth = depth.permute(2, 0, 1)
-            if time_idx == 0:
-                intrinsics = torch.tensor([[sample.fl_x, 0, sample.cx], [0, sample.fl_y, sample.cy], [0, 0, 1]]).cuda().float()
-                intrinsics = intrinsics / config['data']['downscale_factor']
-                intrinsics[2, 2] = 1.0
-                first_frame_w2c = torch.eye(4).cuda().float()
-                cam = setup_camera(color.shape[2], color.shape[1], intrinsics.cpu().numpy(), first_frame_w2c.cpu().numpy())
+                # Initialize Tracking & Mapping Resolution Data
+                with profiler.span("data_load"):
+                    color = cv2.resize(image, dsize=(
+                        config['data']['desired_image_width'], config['data']['desired_image_height']), interpolation=cv2.INTER_LINEAR)
+                    depth = cv2.resize(curr_depth, dsize=(
+                            config['data']['desired_image_width'], config['data']['desired_image_height']), interpolation=cv2.INTER_NEAREST)
+                    depth = np.expand_dims(depth, -1)
+                    color = torch.from_numpy(color).cuda().float()
+                    color = color.permute(2, 0, 1) / 255
+                    depth = torch.from_numpy(depth).cuda().float()
+                    depth = depth.permute(2, 0, 1)
+                if time_idx == 0:
+                    intrinsics = torch.tensor([[sample.fl_x, 0, sample.cx], [0, sample.fl_y, sample.cy], [0, 0, 1]]).cuda().float()
+                    intrinsics = intrinsics / config['data']['downscale_factor']
+                    intrinsics[2, 2] = 1.0
+                    first_frame_w2c = torch.eye(4).cuda().float()
+                    cam = setup_camera(color.shape[2], color.shape[1], intrinsics.cpu().numpy(), first_frame_w2c.cpu().numpy())
             
-            # Initialize Densification Resolution Data
-            densify_color = cv2.resize(image, dsize=(
-                config['data']['densification_image_width'], config['data']['densification_image_height']), interpolation=cv2.INTER_LINEAR)
-            densify_depth = cv2.resize(curr_depth, dsize=(
-                config['data']['densification_image_width'], config['data']['densification_image_height']), interpolation=cv2.INTER_NEAREST)
-            densify_depth = np.expand_dims(densify_depth, -1)
-            densify_color = torch.from_numpy(densify_color).cuda().float()
-            densify_color = densify_color.permute(2, 0, 1) / 255
-            densify_depth = torch.from_numpy(densify_depth).cuda().float()
-            densify_depth = densify_depth.permute(2, 0, 1)
-            if time_idx == 0:
-                densify_intrinsics = torch.tensor([[sample.fl_x, 0, sample.cx], [0, sample.fl_y, sample.cy], [0, 0, 1]]).cuda().float()
-                densify_intrinsics = densify_intrinsics / config['data']['densify_downscale_factor']
-                densify_intrinsics[2, 2] = 1.0
-                densify_cam = setup_camera(densify_color.shape[2], densify_color.shape[1], densify_intrinsics.cpu().numpy(), first_frame_w2c.cpu().numpy())
+                # Initialize Densification Resolution Data
+                densify_color = cv2.resize(image, dsize=(
+                    config['data']['densification_image_width'], config['data']['densification_image_height']), interpolation=cv2.INTER_LINEAR)
+                densify_depth = cv2.resize(curr_depth, dsize=(
+                    config['data']['densification_image_width'], config['data']['densification_image_height']), interpolation=cv2.INTER_NEAREST)
+                densify_depth = np.expand_dims(densify_depth, -1)
+                densify_color = torch.from_numpy(densify_color).cuda().float()
+                densify_color = densify_color.permute(2, 0, 1) / 255
+                densify_depth = torch.from_numpy(densify_depth).cuda().float()
+                densify_depth = densify_depth.permute(2, 0, 1)
+                if time_idx == 0:
+                    densify_intrinsics = torch.tensor([[sample.fl_x, 0, sample.cx], [0, sample.fl_y, sample.cy], [0, 0, 1]]).cuda().float()
+                    densify_intrinsics = densify_intrinsics / config['data']['densify_downscale_factor']
+                    densify_intrinsics[2, 2] = 1.0
+                    densify_cam = setup_camera(densify_color.shape[2], densify_color.shape[1], densify_intrinsics.cpu().numpy(), first_frame_w2c.cpu().numpy())
             
-            # Initialize Params for first time step
-            if time_idx == 0:
-                # Get Initial Point Cloud
-                mask = (densify_depth > 0) # Mask out invalid depth values
-                mask = mask.reshape(-1)
-                init_pt_cld, mean3_sq_dist = get_pointcloud(densify_color, densify_depth, densify_intrinsics, first_frame_w2c, 
-                                                            mask=mask, compute_mean_sq_dist=True, 
-                                                            mean_sq_dist_method=config['mean_sq_dist_method'])
-                params, variables = initialize_params(init_pt_cld, num_frames, mean3_sq_dist, config['gaussian_distribution'])
-                variables['scene_radius'] = torch.max(densify_depth)/config['scene_radius_depth_ratio']
+                # Initialize Params for first time step
+                if time_idx == 0:
+                    # Get Initial Point Cloud
+                    mask = (densify_depth > 0) # Mask out invalid depth values
+                    mask = mask.reshape(-1)
+                    init_pt_cld, mean3_sq_dist = get_pointcloud(densify_color, densify_depth, densify_intrinsics, first_frame_w2c, 
+                                                                mask=mask, compute_mean_sq_dist=True, 
+                                                                mean_sq_dist_method=config['mean_sq_dist_method'])
+                    if streaming:
+                        init_num_frames = streaming_config.get('initial_num_frames', 256)
+                    else:
+                        init_num_frames = num_frames
+                    params, variables = initialize_params(init_pt_cld, init_num_frames, mean3_sq_dist, config['gaussian_distribution'])
+                    variables['scene_radius'] = torch.max(densify_depth)/config['scene_radius_depth_ratio']
+                    # Voxel hash over the Gaussian centers for region queries (kept in sync when Gaussians are added & pruned)
+                    variables = build_spatial_index(config, params, variables)
             
-            # Initialize Mapping & Tracking for current frame
-            iter_time_idx = time_idx
-            curr_gt_w2c = gt_w2c_all_frames
-            curr_data = {'cam': cam, 'im': color, 'depth':depth, 'id': iter_time_idx, 
-                         'intrinsics': intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': curr_gt_w2c}
-            tracking_curr_data = curr_data
+                # Initialize Mapping & Tracking for current frame
+                iter_time_idx = time_idx
+                curr_gt_w2c = gt_w2c_all_frames
+                curr_data = {'cam': cam, 'im': color, 'depth':depth, 'id': iter_time_idx, 
+                             'intrinsics': intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': curr_gt_w2c}
+                tracking_curr_data = curr_data
             
-            # Optimization Iterations
-            num_iters_mapping = config['mapping']['num_iters']
+                # Optimization Iterations
+                num_iters_mapping = config['mapping']['num_iters']
             
-            # Initialize the camera pose for the current frame
-            if time_idx > 0:
-                params = initialize_camera_pose(params, time_idx, forward_prop=config['tracking']['forward_prop'])
-
-            # Tracking
-            tracking_start_time = time.time()
-            if time_idx > 0 and not config['tracking']['use_gt_poses']:
-                # Reset Optimizer & Learning Rates for tracking
-                optimizer = initialize_optimizer(params, config['tracking']['lrs'], tracking=True)
-                # Keep Track of Best Candidate Rotation & Translation
-                candidate_cam_unnorm_rot = params['cam_unnorm_rots'][..., time_idx].detach().clone()
-                candidate_cam_tran = params['cam_trans'][..., time_idx].detach().clone()
-                current_min_loss = float(1e20)
-                # Tracking Optimization
-                iter = 0
-                do_continue_slam = False
-                num_iters_tracking = config['tracking']['num_iters']
-                progress_bar = tqdm(range(num_iters_tracking), desc=f"Tracking Time Step: {time_idx}")
-                while True:
-                    iter_start_time = time.time()
-                    # Loss for current frame
-                    loss, variables, losses = get_loss(params, tracking_curr_data, variables, iter_time_idx, config['tracking']['loss_weights'],
-                                                    config['tracking']['use_sil_for_loss'], config['tracking']['sil_thres'],
-                                                    config['tracking']['use_l1'], config['tracking']['ignore_outlier_depth_loss'], tracking=True, 
-                                                    visualize_tracking_loss=config['tracking']['visualize_tracking_loss'],
-                                                    tracking_iteration=iter)
-                    # Backprop
-                    loss.backward()
-                    # Optimizer Update
-                    optimizer.step()
-                    optimizer.zero_grad(set_to_none=True)
-                    with torch.no_grad():
-                        # Save the best candidate rotation & translation
-                        if loss < current_min_loss:
-                            current_min_loss = loss
-                            candidate_cam_unnorm_rot = params['cam_unnorm_rots'][..., time_idx].detach().clone()
-                            candidate_cam_tran = params['cam_trans'][..., time_idx].detach().clone()
-                        # Report Progress
-                        if config['report_iter_progress']:
-                            report_progress(params, tracking_curr_data, iter+1, progress_bar, iter_time_idx, sil_thres=config['tracking']['sil_thres'], tracking=True)
-                        else:
-                            progress_bar.update(1)
-                    # Update the runtime numbers
-                    iter_end_time = time.time()
-                    tracking_iter_time_sum += iter_end_time - iter_start_time
-                    tracking_iter_time_count += 1
-                    # Check if we should stop tracking
-                    iter += 1
-                    if iter == num_iters_tracking:
-                        if losses['depth'] < config['tracking']['depth_loss_thres'] and config['tracking']['use_depth_loss_thres']:
-                            break
-                        elif config['tracking']['use_depth_loss_thres'] and not do_continue_slam:
-                            do_continue_slam = True
-                            progress_bar = tqdm(range(num_iters_tracking), desc=f"Tracking Time Step: {time_idx}")
-                            num_iters_tracking = 2*num_iters_tracking
-                        else:
-                            break
+                # Grow the camera trajectory if the number of frames is not known upfront
+                if streaming:
+                    params = grow_camera_trajectory(params, time_idx + 1)
+
+                # Initialize the camera pose for the current frame
+                if time_idx > 0:
+                    with profiler.span("pose_init"):
+                        relative_motion = get_relative_motion(curr_gt_w2c) if motion_config.get('use_arkit_prior', False) else None
+                        params = initialize_camera_pose(params, time_idx, forward_prop=config['tracking']['forward_prop'],
+                                                        motion_model=motion_config.get('type', 'constant_velocity'),
+                                                        damping=motion_config.get('damping', 1.0), relative_motion=relative_motion)
+
+                # Tracking
+                tracking_start_time = time.time()
+                if time_idx > 0 and not config['tracking']['use_gt_poses']:
+                    # Reset Optimizer & Learning Rates for tracking
+                    optimizer = initialize_optimizer(params, config['tracking']['lrs'], tracking=True)
+                    # Keep Track of Best Candidate Rotation & Translation
+                    candidate_cam_unnorm_rot = params['cam_unnorm_rots'][..., time_idx].detach().clone()
+                    candidate_cam_tran = params['cam_trans'][..., time_idx].detach().clone()
+                    current_min_loss = float(1e20)
+                    # Cull the Gaussians outside the (expanded) view frustum once for all the tracking iterations
+                    if culling_config.get('enabled', False):
+                        with profiler.span("cull"):
+                            visible_idx = frustum_cull_gaussians(params, variables, time_idx, tracking_curr_data, culling_config)
+                        tracking_curr_data = {**tracking_curr_data, 'visible_idx': visible_idx}
+                        profiler.observe("tracking/visible_gaussians", visible_idx.shape[0])
+                    # Only evaluate the tracking loss at informative pixels (picked once for all the tracking iterations)
+                    depth_loss_thres = config['tracking']['depth_loss_thres']
+                    num_tracking_pixels = config['tracking'].get('num_pixels', None)
+                    if num_tracking_pixels is not None:
+                        with profiler.span("pixel_sampling"):
+                            pixel_idx = sample_tracking_pixels(tracking_curr_data['im'], tracking_curr_data['depth'],
+                                                               num_tracking_pixels)
+                        tracking_curr_data = {**tracking_curr_data, 'pixel_idx': pixel_idx}
+                        profiler.observe("tracking/loss_pixels", pixel_idx.shape[0])
+                        # The depth loss is then summed over the sampled pixels only, so scale its threshold (set for the full image)
+                        depth_loss_thres = depth_loss_thres * pixel_idx.shape[0] / tracking_curr_data['depth'][0].numel()
+                    # Coarse-to-fine tracking: most of the iterations on the coarse levels of the frame, then refine below
+                    if tracking_pyramid is not None:
+                        with profiler.span("tracking/pyramid"):
+                            levels_data = tracking_pyramid.build(tracking_curr_data)
+                            params, variables, num_coarse_iters = track_coarse_levels(params, variables, optimizer, levels_data, time_idx,
+                                                                                      config['tracking'], tracking_pyramid, profiler)
+                        profiler.observe("tracking/coarse_iters_per_frame", num_coarse_iters)
+                    # Tracking Optimization
+                    iter = 0
+                    do_continue_slam = False
+                    num_iters_tracking = config['tracking']['num_iters'] if tracking_pyramid is None else tracking_pyramid.fine_iters
+                    progress_bar = tqdm(range(num_iters_tracking), desc=f"Tracking Time Step: {time_idx}")
+                    while True:
+                        iter_start_time = time.time()
+                        # Loss for current frame
+                        with profiler.span("tracking/render", detailed=True):
+                            loss, variables, losses = get_loss(params, tracking_curr_data, variables, iter_time_idx, config['tracking']['loss_weights'],
+                                                            config['tracking']['use_sil_for_loss'], config['tracking']['sil_thres'],
+                                                            config['tracking']['use_l1'], config['tracking']['ignore_outlier_depth_loss'], tracking=True,
+                                                            outlier_median_samples=config['tracking'].get('outlier_median_samples', None),
+                                                            visualize_tracking_loss=config['tracking']['visualize_tracking_loss'],
+                                                            tracking_iteration=iter)
+                        # Backprop
+                        with profiler.span("tracking/backward", detailed=True):
+                            loss.backward()
+                        # Optimizer Update
+                        with profiler.span("tracking/optimizer_step", detailed=True):
+                            optimizer.step()
+                            optimizer.zero_grad(set_to_none=True)
+                        with torch.no_grad():
+                            # Save the best candidate rotation & translation
+                            if loss < current_min_loss:
+                                current_min_loss = loss
+                                candidate_cam_unnorm_rot = params['cam_unnorm_rots'][..., time_idx].detach().clone()
+                                candidate_cam_tran = params['cam_trans'][..., time_idx].detach().clone()
+                            # Report Progress
+                            if config['report_iter_progress']:
+                                report_progress(params, tracking_curr_data, iter+1, progress_bar, iter_time_idx, sil_thres=config['tracking']['sil_thres'], tracking=True)
+                            else:
+                                progress_bar.update(1)
+                        # Update the runtime numbers
+                        iter_end_time = time.time()
+                        profiler.add_time("tracking/iter", iter_end_time - iter_start_time)
+                        # Check if we should stop tracking
+                        iter += 1
+                        if iter == num_iters_tracking:
+                            if losses['depth'] < depth_loss_thres and config['tracking']['use_depth_loss_thres']:
+                                break
+                            elif config['tracking']['use_depth_loss_thres'] and not do_continue_slam:
+                                do_continue_slam = True
+                                progress_bar = tqdm(range(num_iters_tracking), desc=f"Tracking Time Step: {time_idx}")
+                                profiler.count("tracking/extra_iters", num_iters_tracking)
+                                num_iters_tracking = 2*num_iters_tracking
+                            else:
+                                break
 
-                progress_bar.close()
-                # Copy over the best candidate rotation & translation
-                with torch.no_grad():
-                    params['cam_unnorm_rots'][..., time_idx] = candidate_cam_unnorm_rot
-                    params['cam_trans'][..., time_idx] = candidate_cam_tran
-            elif time_idx > 0 and config['tracking']['use_gt_poses']:
-                with torch.no_grad():
-                    # Get the ground truth pose relative to frame 0
-                    rel_w2c = curr_gt_w2c[-1]
-                    rel_w2c_rot = rel_w2c[:3, :3].unsqueeze(0).detach()
-                    rel_w2c_rot_quat = matrix_to_quaternion(rel_w2c_rot)
-                    rel_w2c_tran = rel_w2c[:3, 3].detach()
-                    # Update the camera parameters
-                    params['cam_unnorm_rots'][..., time_idx] = rel_w2c_rot_quat
-                    params['cam_trans'][..., time_idx] = rel_w2c_tran
-            # Update the runtime numbers
-            tracking_end_time = time.time()
-            tracking_frame_time_sum += tracking_end_time - tracking_start_time
-            tracking_frame_time_count += 1
-
-            if time_idx == 0 or (time_idx+1) % config['report_global_progress_every'] == 0:
-                try:
-                    # Report Final Tracking Progress
-                    progress_bar = tqdm(range(1), desc=f"Tracking Result Time Step: {time_idx}")
-                    with torch.no_grad():
-                        report_progress(params, tracking_curr_data, 1, progress_bar, iter_time_idx, sil_thres=config['tracking']['sil_thres'], tracking=True)
                     progress_bar.close()
-                except:
-                    ckpt_output_dir = save_path.joinpath("checkpoints")
-                    os.makedirs(ckpt_output_dir, exist_ok=True)
-                    save_params_ckpt(params, ckpt_output_dir, time_idx)
-                    print('Failed to evaluate trajectory.')
-            
-            # Densification & KeyFrame-based Mapping
-            if time_idx == 0 or (time_idx+1) % config['map_every'] == 0:
-                # Densification
-                if config['mapping']['add_new_gaussians'] and time_idx > 0:
-                    densify_curr_data = {'cam': densify_cam, 'im': densify_color, 'depth': densify_depth, 'id': time_idx, 
-                                'intrinsics': densify_intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': curr_gt_w2c}
-
-                    # Add new Gaussians to the scene based on the Silhouette
-                    params, variables = add_new_gaussians(params, variables, densify_curr_data, 
-                                                        config['mapping']['sil_thres'], time_idx,
-                                                        config['mean_sq_dist_method'], config['gaussian_distribution'])
-                
-                with torch.no_grad():
-                    # Get the current estimated rotation & translation
-                    curr_cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
-                    curr_cam_tran = params['cam_trans'][..., time_idx].detach()
-                    curr_w2c = torch.eye(4).cuda().float()
-                    curr_w2c[:3, :3] = build_rotation(curr_cam_rot)
-                    curr_w2c[:3, 3] = curr_cam_tran
-                    # Select Keyframes for Mapping
-                    num_keyframes = config['mapping_window_size']-2
-                    selected_keyframes = keyframe_selection_overlap(depth, curr_w2c, intrinsics, keyframe_list[:-1], num_keyframes)
-                    selected_time_idx = [keyframe_list[frame_idx]['id'] for frame_idx in selected_keyframes]
-                    if len(keyframe_list) > 0:
-                        # Add last keyframe to the selected keyframes
-                        selected_time_idx.append(keyframe_list[-1]['id'])
-                        selected_keyframes.append(len(keyframe_list)-1)
-                    # Add current frame to the selected keyframes
-                    selected_time_idx.append(time_idx)
-                    selected_keyframes.append(-1)
-                    # Print the selected keyframes
-                    print(f"\nSelected Keyframes at Frame {time_idx}: {selected_time_idx}")
-
-                # Reset Optimizer & Learning Rates for Full Map Optimization
-                optimizer = initialize_optimizer(params, config['mapping']['lrs'], tracking=False) 
-
-                # Mapping
-                mapping_start_time = time.time()
-                if num_iters_mapping > 0:
-                    progress_bar = tqdm(range(num_iters_mapping), desc=f"Mapping Time Step: {time_idx}")
-                for iter in range(num_iters_mapping):
-                    iter_start_time = time.time()
-                    # Randomly select a frame until current time step amongst keyframes
-                    rand_idx = np.random.randint(0, len(selected_keyframes))
-                    selected_rand_keyframe_idx = selected_keyframes[rand_idx]
-                    if selected_rand_keyframe_idx == -1:
-                        # Use Current Frame Data
-                        iter_time_idx = time_idx
-                        iter_color = color
-                        iter_depth = depth
-                    else:
-                        # Use Keyframe Data
-                        iter_time_idx = keyframe_list[selected_rand_keyframe_idx]['id']
-                        iter_color = keyframe_list[selected_rand_keyframe_idx]['color']
-                        iter_depth = keyframe_list[selected_rand_keyframe_idx]['depth']
-                    iter_gt_w2c = gt_w2c_all_frames[:iter_time_idx+1]
-                    iter_data = {'cam': cam, 'im': iter_color, 'depth': iter_depth, 'id': iter_time_idx, 
-                                'intrinsics': intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': iter_gt_w2c}
-                    # Loss for current frame
-                    loss, variables, losses = get_loss(params, iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
-                                                    config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
-                                                    config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True)
-                    # Backprop
-                    loss.backward()
+                    profiler.observe("tracking/iters_per_frame", iter)
+                    # Copy over the best candidate rotation & translation
                     with torch.no_grad():
-                        # Prune Gaussians
-                        if config['mapping']['prune_gaussians']:
-                            params, variables = prune_gaussians(params, variables, optimizer, iter, config['mapping']['pruning_dict'])
-                        # Gaussian-Splatting's Gradient-based Densification
-                        if config['mapping']['use_gaussian_splatting_densification']:
-                            params, variables = densify(params, variables, optimizer, iter, config['mapping']['densify_dict'])
-                        # Optimizer Update
-                        optimizer.step()
-                        optimizer.zero_grad(set_to_none=True)
-                        # Report Progress
-                        if config['report_iter_progress']:
-                            report_progress(params, iter_data, iter+1, progress_bar, iter_time_idx, sil_thres=config['mapping']['sil_thres'], 
-                                            mapping=True, online_time_idx=time_idx)
-                        else:
-                            progress_bar.update(1)
-                    # Update the runtime numbers
-                    iter_end_time = time.time()
-                    mapping_iter_time_sum += iter_end_time - iter_start_time
-                    mapping_iter_time_count += 1
-                if num_iters_mapping > 0:
-                    progress_bar.close()
+                        params['cam_unnorm_rots'][..., time_idx] = candidate_cam_unnorm_rot
+                        params['cam_trans'][..., time_idx] = candidate_cam_tran
+                elif time_idx > 0 and config['tracking']['use_gt_poses']:
+                    with torch.no_grad():
+                        # Get the ground truth pose relative to frame 0
+                        rel_w2c = curr_gt_w2c[-1]
+                        rel_w2c_rot = rel_w2c[:3, :3].unsqueeze(0).detach()
+                        rel_w2c_rot_quat = matrix_to_quaternion(rel_w2c_rot)
+                        rel_w2c_tran = rel_w2c[:3, 3].detach()
+                        # Update the camera parameters
+                        params['cam_unnorm_rots'][..., time_idx] = rel_w2c_rot_quat
+                        params['cam_trans'][..., time_idx] = rel_w2c_tran
                 # Update the runtime numbers
-                mapping_end_time = time.time()
-                mapping_frame_time_sum += mapping_end_time - mapping_start_time
-                mapping_frame_time_count += 1
+                tracking_end_time = time.time()
+                profiler.add_time("tracking/frame", tracking_end_time - tracking_start_time)
+
+                # Update the running ATE with the tracked pose
+                if online_ate is not None:
+                    drift_alarm = online_ate.update(curr_gt_w2c[-1], get_estimated_w2c(params, time_idx))
+                    if drift_alarm:
+                        print(f"\nWarning: Drift detected at Time Step {time_idx}. {online_ate.summary()}")
 
                 if time_idx == 0 or (time_idx+1) % config['report_global_progress_every'] == 0:
                     try:
-                        # Report Mapping Progress
-                        progress_bar = tqdm(range(1), desc=f"Mapping Result Time Step: {time_idx}")
+                        # Report Final Tracking Progress
+                        progress_bar = tqdm(range(1), desc=f"Tracking Result Time Step: {time_idx}")
                         with torch.no_grad():
-                            report_progress(params, curr_data, 1, progress_bar, time_idx, sil_thres=config['mapping']['sil_thres'], 
-                                            mapping=True, online_time_idx=time_idx)
+                            report_progress(params, tracking_curr_data, 1, progress_bar, iter_time_idx, sil_thres=config['tracking']['sil_thres'], tracking=True)
                         progress_bar.close()
                     except:
                         ckpt_output_dir = save_path.joinpath("checkpoints")
                         os.makedirs(ckpt_output_dir, exist_ok=True)
                         save_params_ckpt(params, ckpt_output_dir, time_idx)
                         print('Failed to evaluate trajectory.')
-
-            # Add frame to keyframe list
-            if ((time_idx == 0) or ((time_idx+1) % config['keyframe_every'] == 0) or \
-                        (time_idx == num_frames-2)) and (not torch.isinf(curr_gt_w2c[-1]).any()) and (not torch.isnan(curr_gt_w2c[-1]).any()):
-                with torch.no_grad():
-                    # Get the current estimated rotation & translation
-                    curr_cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
-                    curr_cam_tran = params['cam_trans'][..., time_idx].detach()
-                    curr_w2c = torch.eye(4).cuda().float()
-                    curr_w2c[:3, :3] = build_rotation(curr_cam_rot)
-                    curr_w2c[:3, 3] = curr_cam_tran
-                    # Initialize Keyframe Info
-                    curr_keyframe = {'id': time_idx, 'est_w2c': curr_w2c, 'color': color, 'depth': depth}
-                    # Add to keyframe list
-                    keyframe_list.append(curr_keyframe)
-                    keyframe_time_indices.append(time_idx)
             
-            # Checkpoint every iteration
-            if time_idx % config["checkpoint_interval"] == 0 and config['save_checkpoints']:
-                ckpt_output_dir = save_path.joinpath("checkpoints")
-                save_params_ckpt(params, ckpt_output_dir, time_idx)
-                np.save(os.path.join(ckpt_output_dir, f"keyframe_time_indices{time_idx}.npy"), np.array(keyframe_time_indices))
-
-            torch.cuda.empty_cache()
-
-            # Save ARKit Poses at end
-            if total_frames == n_frames - 1:
-                # Write manifest as json
-                manifest_json = json.dumps(manifest, indent=4)
-                with open(save_path.joinpath("transforms.json"), "w") as f:
-                    f.write(manifest_json)
-                break
-            # Update frame count
-            total_frames += 1
-            time_idx = total_frames
+                # Densification & KeyFrame-based Mapping
+                if (time_idx == 0 or (time_idx+1) % config['map_every'] == 0) and rate_decision == TRACK_AND_MAP:
+                    # Densification
+                    if config['mapping']['add_new_gaussians'] and time_idx > 0:
+                        densify_curr_data = {'cam': densify_cam, 'im': densify_color, 'depth': densify_depth, 'id': time_idx, 
+                                    'intrinsics': densify_intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': curr_gt_w2c}
+
+                        # Add new Gaussians to the scene based on the Silhouette
+                        pre_num_pts = params['means3D'].shape[0]
+                        with profiler.span("densify"):
+                            params, variables = add_new_gaussians(params, variables, densify_curr_data, 
+                                                                config['mapping']['sil_thres'], time_idx,
+                                                                config['mean_sq_dist_method'], config['gaussian_distribution'],
+                                                                cluster_voxel_size=config['mapping'].get('new_gaussian_voxel_size', None),
+                                                                skip_covered=config['mapping'].get('skip_covered_new_gaussians', False))
+                        profiler.count("gaussians/added", params['means3D'].shape[0] - pre_num_pts)
+                        profiler.observe("gaussians/added_per_frame", params['means3D'].shape[0] - pre_num_pts)
+                
+                    with torch.no_grad(), profiler.span("keyframe_select"):
+                        # Get the current estimated rotation & translation
+                        curr_cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
+                        curr_cam_tran = params['cam_trans'][..., time_idx].detach()
+                        curr_w2c = torch.eye(4).cuda().float()
+                        curr_w2c[:3, :3] = build_rotation(curr_cam_rot)
+                        curr_w2c[:3, 3] = curr_cam_tran
+                        # Select Keyframes for Mapping
+                        num_keyframes = config['mapping_window_size']-2
+                        selected_keyframes = keyframe_selection_overlap(depth, curr_w2c, intrinsics, keyframe_list[:-1], num_keyframes)
+                        selected_time_idx = [keyframe_list[frame_idx]['id'] for frame_idx in selected_keyframes]
+                        if len(keyframe_list) > 0:
+                            # Add last keyframe to the selected keyframes
+                            selected_time_idx.append(keyframe_list[-1]['id'])
+                            selected_keyframes.append(len(keyframe_list)-1)
+                        # Add current frame to the selected keyframes
+                        selected_time_idx.append(time_idx)
+                        selected_keyframes.append(-1)
+                        # Print the selected keyframes
+                        print(f"\nSelected Keyframes at Frame {time_idx}: {selected_time_idx}")
+                        # Bring the selected keyframes back to the device before the mapping iterations
+                        keyframe_list.prefetch(selected_keyframes)
+
+                    # Reset Optimizer & Learning Rates for Full Map Optimization
+                    optimizer = initialize_optimizer(params, config['mapping']['lrs'], tracking=False) 
+
+                    # Mapping
+                    mapping_start_time = time.time()
+                    if num_iters_mapping > 0:
+                        progress_bar = tqdm(range(num_iters_mapping), desc=f"Mapping Time Step: {time_idx}")
+                    # Culled Gaussians of every keyframe (culled again once the Gaussians were added or removed)
+                    visible_idx_cache, visible_idx_means = {}, None
+                    keyframe_sampler = KeyframeSampler(selected_keyframes, batch_size=config['mapping'].get('batch_size', 1),
+                                                       policy=config['mapping'].get('keyframe_sampling', None))
+                    for iter in range(num_iters_mapping):
+                        iter_start_time = time.time()
+                        # Select a batch of frames until current time step amongst keyframes
+                        batch_keyframe_idx = keyframe_sampler.sample()
+                        # Accumulate the gradients of the batch (averaged over its frames)
+                        for selected_rand_keyframe_idx in batch_keyframe_idx:
+                            if selected_rand_keyframe_idx == -1:
+                                # Use Current Frame Data
+                                iter_time_idx = time_idx
+                                iter_color = color
+                                iter_depth = depth
+                            else:
+                                # Use Keyframe Data
+                                iter_time_idx = keyframe_list[selected_rand_keyframe_idx]['id']
+                                iter_color = keyframe_list[selected_rand_keyframe_idx]['color']
+                                iter_depth = keyframe_list[selected_rand_keyframe_idx]['depth']
+                            iter_gt_w2c = gt_w2c_all_frames[:iter_time_idx+1]
+                            iter_data = {'cam': cam, 'im': iter_color, 'depth': iter_depth, 'id': iter_time_idx, 
+                                        'intrinsics': intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': iter_gt_w2c}
+                            # Only render the Gaussians in the view frustum of the keyframe
+                            if culling_config.get('enabled', False):
+                                if visible_idx_means is not params['means3D']:
+                                    visible_idx_cache, visible_idx_means = {}, params['means3D']
+                                if iter_time_idx not in visible_idx_cache:
+                                    with profiler.span("cull"):
+                                        visible_idx_cache[iter_time_idx] = frustum_cull_gaussians(params, variables, iter_time_idx, iter_data,
+                                                                                                  culling_config)
+                                iter_data['visible_idx'] = visible_idx_cache[iter_time_idx]
+                            # Loss for current frame
+                            with profiler.span("mapping/render", detailed=True):
+                                loss, variables, losses = get_loss(params, iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
+                                                                config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
+                                                                config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True,
+                                                                outlier_median_samples=config['mapping'].get('outlier_median_samples', None))
+                            # Backprop
+                            with profiler.span("mapping/backward", detailed=True):
+                                (loss / len(batch_keyframe_idx)).backward()
+                        # Densification Gradients: the screen space gradients of a batch are scaled by 1/batch_size, so
+                        # recompute the unscaled gradients (and seen Gaussians) of its last frame, only w.r.t. means2D
+                        if config['mapping']['use_gaussian_splatting_densification'] and len(batch_keyframe_idx) > 1:
+                            densify_loss, variables, _ = get_loss(params, iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
+                                                            config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
+                                                            config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True,
+                                                            outlier_median_samples=config['mapping'].get('outlier_median_samples', None))
+                            densify_loss.backward(inputs=[variables['means2D']])
+                        with torch.no_grad():
+                            # Prune Gaussians
+                            if config['mapping']['prune_gaussians']:
+                                pre_num_pts = params['means3D'].shape[0]
+                                with profiler.span("prune"):
+                                    params, variables = prune_gaussians(params, variables, optimizer, iter, config['mapping']['pruning_dict'])
+                                profiler.count("gaussians/pruned", pre_num_pts - params['means3D'].shape[0])
+                            # Gaussian-Splatting's Gradient-based Densification
+                            if config['mapping']['use_gaussian_splatting_densification']:
+                                pre_num_pts = params['means3D'].shape[0]
+                                with profiler.span("gs_densify"):
+                                    params, variables = densify(params, variables, optimizer, iter, config['mapping']['densify_dict'])
+                                profiler.count("gaussians/densified", params['means3D'].shape[0] - pre_num_pts)
+                            # Optimizer Update
+                            with profiler.span("mapping/optimizer_step", detailed=True):
+                                optimizer.step()
+                                optimizer.zero_grad(set_to_none=True)
+                            # Report Progress
+                            if config['report_iter_progress']:
+                                report_progress(params, iter_data, iter+1, progress_bar, iter_time_idx, sil_thres=config['mapping']['sil_thres'], 
+                                                mapping=True, online_time_idx=time_idx)
+                            else:
+                                progress_bar.update(1)
+                        # Update the runtime numbers
+                        iter_end_time = time.time()
+                        profiler.add_time("mapping/iter", iter_end_time - iter_start_time)
+                    if num_iters_mapping > 0:
+                        progress_bar.close()
+                    # Update the runtime numbers
+                    mapping_end_time = time.time()
+                    profiler.add_time("mapping/frame", mapping_end_time - mapping_start_time)
+
+                    # Re-bucket the Gaussians that moved during mapping in the spatial index
+                    if 'spatial_index' in variables.keys():
+                        with profiler.span("spatial_index"):
+                            variables['spatial_index'].update(params['means3D'])
+
+                    # Merge the near-duplicate Gaussians of the map
+                    if merge_config.get('enabled', False) and (time_idx+1) % merge_config.get('merge_every', 10) == 0:
+                        with profiler.span("merge"):
+                            params, variables, num_merged = merge_duplicate_gaussians(params, variables, optimizer, merge_config)
+                        profiler.count("gaussians/merged", num_merged)
+
+                    # Evict the lowest contribution Gaussians if the map exceeds its memory budget
+                    if gaussian_budget_config.get('enabled', False):
+                        with torch.no_grad(), profiler.span("budget"):
+                            params, variables, num_evicted = enforce_gaussian_budget(params, variables, optimizer, time_idx,
+                                                                                     gaussian_budget_config)
+                        profiler.count("gaussians/evicted", num_evicted)
+                        if num_evicted > 0:
+                            print(f"\nEvicted {num_evicted} Gaussians at Time Step {time_idx} to stay within the memory budget.")
+
+                    profiler.observe("gaussians/num_after_mapping", params['means3D'].shape[0])
+
+                    if time_idx == 0 or (time_idx+1) % config['report_global_progress_every'] == 0:
+                        try:
+                            # Report Mapping Progress
+                            progress_bar = tqdm(range(1), desc=f"Mapping Result Time Step: {time_idx}")
+                            with torch.no_grad():
+                                report_progress(params, curr_data, 1, progress_bar, time_idx, sil_thres=config['mapping']['sil_thres'], 
+                                                mapping=True, online_time_idx=time_idx)
+                            progress_bar.close()
+                        except:
+                            ckpt_output_dir = save_path.joinpath("checkpoints")
+                            os.makedirs(ckpt_output_dir, exist_ok=True)
+                            save_params_ckpt(params, ckpt_output_dir, time_idx)
+                            print('Failed to evaluate trajectory.')
+
+                # Add frame to keyframe list
+                if ((time_idx == 0) or ((time_idx+1) % config['keyframe_every'] == 0) or \
+                            (time_idx == num_frames-2)) and (not torch.isinf(curr_gt_w2c[-1]).any()) and (not torch.isnan(curr_gt_w2c[-1]).any()):
+                    with torch.no_grad():
+                        # Get the current estimated rotation & translation
+                        curr_cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
+                        curr_cam_tran = params['cam_trans'][..., time_idx].detach()
+                        curr_w2c = torch.eye(4).cuda().float()
+                        curr_w2c[:3, :3] = build_rotation(curr_cam_rot)
+                        curr_w2c[:3, 3] = curr_cam_tran
+                        # Initialize Keyframe Info
+                        curr_keyframe = {'id': time_idx, 'est_w2c': curr_w2c, 'color': color, 'depth': depth}
+                        # Add to keyframe list
+                        keyframe_list.append(curr_keyframe)
+                        keyframe_time_indices.append(time_idx)
+                        # Bound the keyframe memory by dropping the oldest keyframe (the first frame is always kept)
+                        if max_keyframes is not None and len(keyframe_list) > max_keyframes:
+                            keyframe_list.pop(1)
+                            keyframe_time_indices.pop(1)
+            
+                # Checkpoint every iteration
+                if time_idx % config["checkpoint_interval"] == 0 and config['save_checkpoints']:
+                    with profiler.span("checkpoint"):
+                        ckpt_output_dir = save_path.joinpath("checkpoints")
+                        save_params_ckpt(params, ckpt_output_dir, time_idx)
+                        np.save(os.path.join(ckpt_output_dir, f"keyframe_time_indices{time_idx}.npy"), np.array(keyframe_time_indices))
+
+                torch.cuda.empty_cache()
+
+                # Update the SLAM latency estimate of the rate controller
+                if rate_controller is not None:
+                    rate_controller.update_latency(rate_decision, time.time() - frame_start_time)
+                    if (time_idx+1) % config['report_global_progress_every'] == 0:
+                        print(rate_controller.summary())
+
+                # Stop once the desired number of frames has been captured
+                if not streaming and total_frames == n_frames - 1:
+                    break
+                # Update frame count
+                total_frames += 1
+                time_idx += 1
+    finally:
+        if streaming:
+            signal.signal(signal.SIGINT, prev_sigint_handler)
+
+    if len(gt_w2c_all_frames) == 0:
+        print("No frames were processed. Exiting...")
+        return
+
+    # Save ARKit Poses at end
+    manifest_json = json.dumps(manifest, indent=4)
+    with open(save_path.joinpath("transforms.json"), "w") as f:
+        f.write(manifest_json)
+
+    # Drop unused trajectory capacity
+    params = trim_camera_trajectory(params, len(gt_w2c_all_frames))
     
     # Compute Average Runtimes
-    if tracking_iter_time_count == 0:
-        tracking_iter_time_count = 1
-        tracking_frame_time_count = 1
-    if mapping_iter_time_count == 0:
-        mapping_iter_time_count = 1
-        mapping_frame_time_count = 1
-    tracking_iter_time_avg = tracking_iter_time_sum / tracking_iter_time_count
-    tracking_frame_time_avg = tracking_frame_time_sum / tracking_frame_time_count
-    mapping_iter_time_avg = mapping_iter_time_sum / mapping_iter_time_count
-    mapping_frame_time_avg = mapping_frame_time_sum / mapping_frame_time_count
+    tracking_iter_time_avg = profiler.mean("tracking/iter")
+    tracking_frame_time_avg = profiler.mean("tracking/frame")
+    mapping_iter_time_avg = profiler.mean("mapping/iter")
+    mapping_frame_time_avg = profiler.mean("mapping/frame")
     print(f"\nAverage Tracking/Iteration Time: {tracking_iter_time_avg*1000} ms")
     print(f"Average Tracking/Frame Time: {tracking_frame_time_avg} s")
     print(f"Average Mapping/Iteration Time: {mapping_iter_time_avg*1000} ms")
     print(f"Average Mapping/Frame Time: {mapping_frame_time_avg} s")
+    if rate_controller is not None:
+        print(rate_controller.summary())
+    if online_ate is not None:
+        print(online_ate.summary())
 
     # Add Camera Parameters to Save them
     params['timestep'] = variables['timestep']
@@ -526,12 +729,19 @@ def dataset_capture_loop(reader: DataReader, save_path: Path, overwrite: bool, n
         params['gt_w2c_all_frames'].append(gt_w2c_tensor.detach().cpu().numpy())
     params['gt_w2c_all_frames'] = np.stack(params['gt_w2c_all_frames'], axis=0)
     params['keyframe_time_indices'] = np.array(keyframe_time_indices)
+    if rate_controller is not None:
+        params['slam_frame_indices'] = np.array(slam_frame_indices)
     
     # Save Parameters
     output_dir = os.path.join(config["workdir"], config["run_name"])
     save_params(params, output_dir)
     print("Saved SplaTAM Splat to: ", output_dir)
 
+    # Save the Runtime Profile
+    if profiler.enabled:
+        print(f"\n{profiler.summary()}")
+        profiler.save(output_dir)
+
 
 if __name__ == "__main__":
     args = parse_args()
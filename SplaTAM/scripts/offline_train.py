@@ -24,12 +24,20 @@ from tqdm import tqdm
 
 from datasets.gradslam_datasets.geometryutils import relative_transformation
 from utils.common_utils import seed_everything, save_params_ckpt, save_params
-from utils.eval_helpers import report_progress
-from utils.keyframe_selection import keyframe_selection_overlap
+from utils.eval_helpers import report_progress, get_estimated_w2c
+from utils.gaussian_budget import enforce_gaussian_budget
+from utils.gaussian_merge import merge_duplicate_gaussians
+from utils.instrumentation import build_profiler
+from utils.keyframe_selection import keyframe_selection_overlap, KeyframeSampler
+from utils.keyframe_store import build_keyframe_store
+from utils.motion_model import get_relative_motion
 from utils.recon_helpers import setup_camera
 from utils.slam_external import build_rotation, prune_gaussians, densify
-from utils.slam_helpers import matrix_to_quaternion
-from scripts.splatam import get_loss, initialize_optimizer, initialize_params, initialize_camera_pose, get_pointcloud, add_new_gaussians
+from utils.slam_helpers import matrix_to_quaternion, frustum_cull_gaussians, sample_tracking_pixels
+from utils.spatial_hash import build_spatial_index
+from utils.tracking_pyramid import build_tracking_pyramid
+from utils.trajectory_eval import OnlineATEEstimator
+from scripts.splatam import get_loss, track_coarse_levels, initialize_optimizer, initialize_params, initialize_camera_pose, get_pointcloud, add_new_gaussians
 
 from diff_gaussian_rasterization import GaussianRasterizer as Renderer
 
@@ -64,20 +72,26 @@ def offline_training_loop(config: dict):
 
     print(f"Processing {num_frames} frames from the dataset.")
 
-    # Initialize list to keep track of Keyframes
-    keyframe_list = []
+    # Initialize store to keep track of Keyframes (compressed & offloaded from the device if configured)
+    keyframe_list = build_keyframe_store(config, "cuda", config["workdir"])
     keyframe_time_indices = []
 
     # Init Variables to keep track of ARkit poses and runtimes
     gt_w2c_all_frames = []
-    tracking_iter_time_sum = 0
-    tracking_iter_time_count = 0
-    mapping_iter_time_sum = 0
-    mapping_iter_time_count = 0
-    tracking_frame_time_sum = 0
-    tracking_frame_time_count = 0
-    mapping_frame_time_sum = 0
-    mapping_frame_time_count = 0
+    profiler = build_profiler(config)
+    gaussian_budget_config = config.get('gaussian_budget', {})
+    merge_config = config.get('gaussian_merge', {})
+    culling_config = config.get('frustum_culling', {})
+    tracking_pyramid = build_tracking_pyramid(config)
+    motion_config = config['tracking'].get('motion_model', {})
+
+    # Running ATE of the tracked trajectory against the ARKit poses (O(1) per frame, used as drift alarm)
+    online_ate_config = config.get('online_ate', {})
+    online_ate = None
+    if online_ate_config.get('enabled', True):
+        online_ate = OnlineATEEstimator(with_scale=online_ate_config.get('with_scale', False),
+                                        drift_threshold=online_ate_config.get('drift_threshold', None),
+                                        min_frames=online_ate_config.get('min_frames', 10))
     P = torch.tensor(
         [
             [1, 0, 0, 0],
@@ -89,6 +103,7 @@ def offline_training_loop(config: dict):
 
     # Start Offline Training Loop
     for time_idx, frame_data in enumerate(tqdm(frames_data, desc="Processing Frames")):
+        data_load_start_time = time.time()
         # Load RGB
         rgb_path = data_dir / frame_data['file_path']
         image = cv2.imread(str(rgb_path))
@@ -137,6 +152,7 @@ def offline_training_loop(config: dict):
         color = color.permute(2, 0, 1) / 255
         depth = torch.from_numpy(depth).cuda().float()
         depth = depth.permute(2, 0, 1)
+        profiler.add_time("data_load", time.time() - data_load_start_time)
         if time_idx == 0:
             intrinsics = torch.tensor([[manifest['fl_x'], 0, manifest['cx']], [0, manifest['fl_y'], manifest['cy']], [0, 0, 1]]).cuda().float()
             intrinsics = intrinsics / config['data']['downscale_factor']
@@ -170,6 +186,8 @@ def offline_training_loop(config: dict):
                                                         mean_sq_dist_method=config['mean_sq_dist_method'])
             params, variables = initialize_params(init_pt_cld, num_frames, mean3_sq_dist, config['gaussian_distribution'])
             variables['scene_radius'] = torch.max(densify_depth)/config['scene_radius_depth_ratio']
+            # Voxel hash over the Gaussian centers for region queries (kept in sync when Gaussians are added & pruned)
+            variables = build_spatial_index(config, params, variables)
         
         # Initialize Mapping & Tracking for current frame
         iter_time_idx = time_idx
@@ -183,7 +201,11 @@ def offline_training_loop(config: dict):
         
         # Initialize the camera pose for the current frame
         if time_idx > 0:
-            params = initialize_camera_pose(params, time_idx, forward_prop=config['tracking']['forward_prop'])
+            with profiler.span("pose_init"):
+                relative_motion = get_relative_motion(curr_gt_w2c) if motion_config.get('use_arkit_prior', False) else None
+                params = initialize_camera_pose(params, time_idx, forward_prop=config['tracking']['forward_prop'],
+                                                motion_model=motion_config.get('type', 'constant_velocity'),
+                                                damping=motion_config.get('damping', 1.0), relative_motion=relative_motion)
 
         # Tracking
         tracking_start_time = time.time()
@@ -192,20 +214,48 @@ def offline_training_loop(config: dict):
             candidate_cam_unnorm_rot = params['cam_unnorm_rots'][..., time_idx].detach().clone()
             candidate_cam_tran = params['cam_trans'][..., time_idx].detach().clone()
             current_min_loss = float(1e20)
+            # Cull the Gaussians outside the (expanded) view frustum once for all the tracking iterations
+            if culling_config.get('enabled', False):
+                with profiler.span("cull"):
+                    visible_idx = frustum_cull_gaussians(params, variables, time_idx, tracking_curr_data, culling_config)
+                tracking_curr_data = {**tracking_curr_data, 'visible_idx': visible_idx}
+                profiler.observe("tracking/visible_gaussians", visible_idx.shape[0])
+            # Only evaluate the tracking loss at informative pixels (picked once for all the tracking iterations)
+            depth_loss_thres = config['tracking']['depth_loss_thres']
+            num_tracking_pixels = config['tracking'].get('num_pixels', None)
+            if num_tracking_pixels is not None:
+                with profiler.span("pixel_sampling"):
+                    pixel_idx = sample_tracking_pixels(tracking_curr_data['im'], tracking_curr_data['depth'],
+                                                       num_tracking_pixels)
+                tracking_curr_data = {**tracking_curr_data, 'pixel_idx': pixel_idx}
+                profiler.observe("tracking/loss_pixels", pixel_idx.shape[0])
+                # The depth loss is then summed over the sampled pixels only, so scale its threshold (set for the full image)
+                depth_loss_thres = depth_loss_thres * pixel_idx.shape[0] / tracking_curr_data['depth'][0].numel()
+            # Coarse-to-fine tracking: most of the iterations on the coarse levels of the frame, then refine below
+            if tracking_pyramid is not None:
+                with profiler.span("tracking/pyramid"):
+                    levels_data = tracking_pyramid.build(tracking_curr_data)
+                    params, variables, num_coarse_iters = track_coarse_levels(params, variables, optimizer, levels_data, time_idx,
+                                                                              config['tracking'], tracking_pyramid, profiler)
+                profiler.observe("tracking/coarse_iters_per_frame", num_coarse_iters)
             iter = 0
             do_continue_slam = False
-            num_iters_tracking = config['tracking']['num_iters']
+            num_iters_tracking = config['tracking']['num_iters'] if tracking_pyramid is None else tracking_pyramid.fine_iters
             progress_bar_tracking = tqdm(range(num_iters_tracking), desc=f"Tracking Time Step: {time_idx}")
             while True:
                 iter_start_time = time.time()
-                loss, variables, losses = get_loss(params, tracking_curr_data, variables, iter_time_idx, config['tracking']['loss_weights'],
-                                                config['tracking']['use_sil_for_loss'], config['tracking']['sil_thres'],
-                                                config['tracking']['use_l1'], config['tracking']['ignore_outlier_depth_loss'], tracking=True, 
-                                                visualize_tracking_loss=config['tracking']['visualize_tracking_loss'],
-                                                tracking_iteration=iter)
-                loss.backward()
-                optimizer.step()
-                optimizer.zero_grad(set_to_none=True)
+                with profiler.span("tracking/render", detailed=True):
+                    loss, variables, losses = get_loss(params, tracking_curr_data, variables, iter_time_idx, config['tracking']['loss_weights'],
+                                                    config['tracking']['use_sil_for_loss'], config['tracking']['sil_thres'],
+                                                    config['tracking']['use_l1'], config['tracking']['ignore_outlier_depth_loss'], tracking=True,
+                                                    outlier_median_samples=config['tracking'].get('outlier_median_samples', None),
+                                                    visualize_tracking_loss=config['tracking']['visualize_tracking_loss'],
+                                                    tracking_iteration=iter)
+                with profiler.span("tracking/backward", detailed=True):
+                    loss.backward()
+                with profiler.span("tracking/optimizer_step", detailed=True):
+                    optimizer.step()
+                    optimizer.zero_grad(set_to_none=True)
                 with torch.no_grad():
                     if loss < current_min_loss:
                         current_min_loss = loss
@@ -216,19 +266,20 @@ def offline_training_loop(config: dict):
                     else:
                         progress_bar_tracking.update(1)
                 iter_end_time = time.time()
-                tracking_iter_time_sum += iter_end_time - iter_start_time
-                tracking_iter_time_count += 1
+                profiler.add_time("tracking/iter", iter_end_time - iter_start_time)
                 iter += 1
                 if iter == num_iters_tracking:
-                    if losses['depth'] < config['tracking']['depth_loss_thres'] and config['tracking']['use_depth_loss_thres']:
+                    if losses['depth'] < depth_loss_thres and config['tracking']['use_depth_loss_thres']:
                         break
                     elif config['tracking']['use_depth_loss_thres'] and not do_continue_slam:
                         do_continue_slam = True
                         progress_bar_tracking = tqdm(range(num_iters_tracking), desc=f"Tracking Time Step: {time_idx}")
+                        profiler.count("tracking/extra_iters", num_iters_tracking)
                         num_iters_tracking = 2*num_iters_tracking
                     else:
                         break
             progress_bar_tracking.close()
+            profiler.observe("tracking/iters_per_frame", iter)
             with torch.no_grad():
                 params['cam_unnorm_rots'][..., time_idx] = candidate_cam_unnorm_rot
                 params['cam_trans'][..., time_idx] = candidate_cam_tran
@@ -241,8 +292,13 @@ def offline_training_loop(config: dict):
                 params['cam_unnorm_rots'][..., time_idx] = rel_w2c_rot_quat
                 params['cam_trans'][..., time_idx] = rel_w2c_tran
         tracking_end_time = time.time()
-        tracking_frame_time_sum += tracking_end_time - tracking_start_time
-        tracking_frame_time_count += 1
+        profiler.add_time("tracking/frame", tracking_end_time - tracking_start_time)
+
+        # Update the running ATE with the tracked pose
+        if online_ate is not None:
+            drift_alarm = online_ate.update(curr_gt_w2c[-1], get_estimated_w2c(params, time_idx))
+            if drift_alarm:
+                print(f"\nWarning: Drift detected at Time Step {time_idx}. {online_ate.summary()}")
 
         if time_idx == 0 or (time_idx+1) % config['report_global_progress_every'] == 0:
             try:
@@ -260,11 +316,17 @@ def offline_training_loop(config: dict):
             if config['mapping']['add_new_gaussians'] and time_idx > 0:
                 densify_curr_data = {'cam': densify_cam, 'im': densify_color, 'depth': densify_depth, 'id': time_idx, 
                             'intrinsics': densify_intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': curr_gt_w2c}
-                params, variables = add_new_gaussians(params, variables, densify_curr_data, 
-                                                    config['mapping']['sil_thres'], time_idx,
-                                                    config['mean_sq_dist_method'], config['gaussian_distribution'])
+                pre_num_pts = params['means3D'].shape[0]
+                with profiler.span("densify"):
+                    params, variables = add_new_gaussians(params, variables, densify_curr_data, 
+                                                        config['mapping']['sil_thres'], time_idx,
+                                                        config['mean_sq_dist_method'], config['gaussian_distribution'],
+                                                        cluster_voxel_size=config['mapping'].get('new_gaussian_voxel_size', None),
+                                                        skip_covered=config['mapping'].get('skip_covered_new_gaussians', False))
+                profiler.count("gaussians/added", params['means3D'].shape[0] - pre_num_pts)
+                profiler.observe("gaussians/added_per_frame", params['means3D'].shape[0] - pre_num_pts)
             
-            with torch.no_grad():
+            with torch.no_grad(), profiler.span("keyframe_select"):
                 curr_cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
                 curr_cam_tran = params['cam_trans'][..., time_idx].detach()
                 curr_w2c = torch.eye(4).cuda().float()
@@ -279,51 +341,106 @@ def offline_training_loop(config: dict):
                 selected_time_idx.append(time_idx)
                 selected_keyframes.append(-1)
                 # print(f"\nSelected Keyframes at Frame {time_idx}: {selected_time_idx}")
+                # Bring the selected keyframes back to the device before the mapping iterations
+                keyframe_list.prefetch(selected_keyframes)
 
             optimizer = initialize_optimizer(params, config['mapping']['lrs'], tracking=False) 
 
             mapping_start_time = time.time()
             if num_iters_mapping > 0:
                 progress_bar_mapping = tqdm(range(num_iters_mapping), desc=f"Mapping Time Step: {time_idx}")
+            # Culled Gaussians of every keyframe (culled again once the Gaussians were added or removed)
+            visible_idx_cache, visible_idx_means = {}, None
+            keyframe_sampler = KeyframeSampler(selected_keyframes, batch_size=config['mapping'].get('batch_size', 1),
+                                               policy=config['mapping'].get('keyframe_sampling', None))
             for iter in range(num_iters_mapping):
                 iter_start_time = time.time()
-                rand_idx = np.random.randint(0, len(selected_keyframes))
-                selected_rand_keyframe_idx = selected_keyframes[rand_idx]
-                if selected_rand_keyframe_idx == -1:
-                    iter_time_idx = time_idx
-                    iter_color = color
-                    iter_depth = depth
-                else:
-                    iter_time_idx = keyframe_list[selected_rand_keyframe_idx]['id']
-                    iter_color = keyframe_list[selected_rand_keyframe_idx]['color']
-                    iter_depth = keyframe_list[selected_rand_keyframe_idx]['depth']
-                iter_gt_w2c = gt_w2c_all_frames[:iter_time_idx+1]
-                iter_data = {'cam': cam, 'im': iter_color, 'depth': iter_depth, 'id': iter_time_idx, 
-                            'intrinsics': intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': iter_gt_w2c}
-                loss, variables, losses = get_loss(params, iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
-                                                config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
-                                                config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True)
-                loss.backward()
+                # Select a batch of frames until current time step amongst keyframes
+                batch_keyframe_idx = keyframe_sampler.sample()
+                # Accumulate the gradients of the batch (averaged over its frames)
+                for selected_rand_keyframe_idx in batch_keyframe_idx:
+                    if selected_rand_keyframe_idx == -1:
+                        iter_time_idx = time_idx
+                        iter_color = color
+                        iter_depth = depth
+                    else:
+                        iter_time_idx = keyframe_list[selected_rand_keyframe_idx]['id']
+                        iter_color = keyframe_list[selected_rand_keyframe_idx]['color']
+                        iter_depth = keyframe_list[selected_rand_keyframe_idx]['depth']
+                    iter_gt_w2c = gt_w2c_all_frames[:iter_time_idx+1]
+                    iter_data = {'cam': cam, 'im': iter_color, 'depth': iter_depth, 'id': iter_time_idx, 
+                                'intrinsics': intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': iter_gt_w2c}
+                    # Only render the Gaussians in the view frustum of the keyframe
+                    if culling_config.get('enabled', False):
+                        if visible_idx_means is not params['means3D']:
+                            visible_idx_cache, visible_idx_means = {}, params['means3D']
+                        if iter_time_idx not in visible_idx_cache:
+                            with profiler.span("cull"):
+                                visible_idx_cache[iter_time_idx] = frustum_cull_gaussians(params, variables, iter_time_idx, iter_data,
+                                                                                          culling_config)
+                        iter_data['visible_idx'] = visible_idx_cache[iter_time_idx]
+                    with profiler.span("mapping/render", detailed=True):
+                        loss, variables, losses = get_loss(params, iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
+                                                        config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
+                                                        config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True,
+                                                        outlier_median_samples=config['mapping'].get('outlier_median_samples', None))
+                    with profiler.span("mapping/backward", detailed=True):
+                        (loss / len(batch_keyframe_idx)).backward()
+                # Densification Gradients: the screen space gradients of a batch are scaled by 1/batch_size, so
+                # recompute the unscaled gradients (and seen Gaussians) of its last frame, only w.r.t. means2D
+                if config['mapping']['use_gaussian_splatting_densification'] and len(batch_keyframe_idx) > 1:
+                    densify_loss, variables, _ = get_loss(params, iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
+                                                    config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
+                                                    config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True,
+                                                    outlier_median_samples=config['mapping'].get('outlier_median_samples', None))
+                    densify_loss.backward(inputs=[variables['means2D']])
                 with torch.no_grad():
                     if config['mapping']['prune_gaussians']:
-                        params, variables = prune_gaussians(params, variables, optimizer, iter, config['mapping']['pruning_dict'])
+                        pre_num_pts = params['means3D'].shape[0]
+                        with profiler.span("prune"):
+                            params, variables = prune_gaussians(params, variables, optimizer, iter, config['mapping']['pruning_dict'])
+                        profiler.count("gaussians/pruned", pre_num_pts - params['means3D'].shape[0])
                     if config['mapping']['use_gaussian_splatting_densification']:
-                        params, variables = densify(params, variables, optimizer, iter, config['mapping']['densify_dict'])
-                    optimizer.step()
-                    optimizer.zero_grad(set_to_none=True)
+                        pre_num_pts = params['means3D'].shape[0]
+                        with profiler.span("gs_densify"):
+                            params, variables = densify(params, variables, optimizer, iter, config['mapping']['densify_dict'])
+                        profiler.count("gaussians/densified", params['means3D'].shape[0] - pre_num_pts)
+                    with profiler.span("mapping/optimizer_step", detailed=True):
+                        optimizer.step()
+                        optimizer.zero_grad(set_to_none=True)
                     if config['report_iter_progress']:
                         report_progress(params, iter_data, iter+1, progress_bar_mapping, iter_time_idx, sil_thres=config['mapping']['sil_thres'], 
                                         mapping=True, online_time_idx=time_idx)
                     else:
                         progress_bar_mapping.update(1)
                 iter_end_time = time.time()
-                mapping_iter_time_sum += iter_end_time - iter_start_time
-                mapping_iter_time_count += 1
+                profiler.add_time("mapping/iter", iter_end_time - iter_start_time)
             if num_iters_mapping > 0:
                 progress_bar_mapping.close()
             mapping_end_time = time.time()
-            mapping_frame_time_sum += mapping_end_time - mapping_start_time
-            mapping_frame_time_count += 1
+            profiler.add_time("mapping/frame", mapping_end_time - mapping_start_time)
+
+            # Re-bucket the Gaussians that moved during mapping in the spatial index
+            if 'spatial_index' in variables.keys():
+                with profiler.span("spatial_index"):
+                    variables['spatial_index'].update(params['means3D'])
+
+            # Merge the near-duplicate Gaussians of the map
+            if merge_config.get('enabled', False) and (time_idx+1) % merge_config.get('merge_every', 10) == 0:
+                with profiler.span("merge"):
+                    params, variables, num_merged = merge_duplicate_gaussians(params, variables, optimizer, merge_config)
+                profiler.count("gaussians/merged", num_merged)
+
+            # Evict the lowest contribution Gaussians if the map exceeds its memory budget
+            if gaussian_budget_config.get('enabled', False):
+                with torch.no_grad(), profiler.span("budget"):
+                    params, variables, num_evicted = enforce_gaussian_budget(params, variables, optimizer, time_idx,
+                                                                             gaussian_budget_config)
+                profiler.count("gaussians/evicted", num_evicted)
+                if num_evicted > 0:
+                    print(f"\nEvicted {num_evicted} Gaussians at Time Step {time_idx} to stay within the memory budget.")
+
+            profiler.observe("gaussians/num_after_mapping", params['means3D'].shape[0])
 
             if time_idx == 0 or (time_idx+1) % config['report_global_progress_every'] == 0:
                 try:
@@ -351,25 +468,24 @@ def offline_training_loop(config: dict):
                 keyframe_time_indices.append(time_idx)
         
         if time_idx % config["checkpoint_interval"] == 0 and config['save_checkpoints']:
-            ckpt_output_dir = Path(config["workdir"]) / "checkpoints"
-            save_params_ckpt(params, ckpt_output_dir, time_idx)
-            np.save(os.path.join(ckpt_output_dir, f"keyframe_time_indices{time_idx}.npy"), np.array(keyframe_time_indices))
+            with profiler.span("checkpoint"):
+                ckpt_output_dir = Path(config["workdir"]) / "checkpoints"
+                save_params_ckpt(params, ckpt_output_dir, time_idx)
+                np.save(os.path.join(ckpt_output_dir, f"keyframe_time_indices{time_idx}.npy"), np.array(keyframe_time_indices))
 
         torch.cuda.empty_cache()
 
     # Compute Average Runtimes
-    if tracking_iter_time_count == 0: tracking_iter_time_count = 1
-    if tracking_frame_time_count == 0: tracking_frame_time_count = 1
-    if mapping_iter_time_count == 0: mapping_iter_time_count = 1
-    if mapping_frame_time_count == 0: mapping_frame_time_count = 1
-    tracking_iter_time_avg = tracking_iter_time_sum / tracking_iter_time_count
-    tracking_frame_time_avg = tracking_frame_time_sum / tracking_frame_time_count
-    mapping_iter_time_avg = mapping_iter_time_sum / mapping_iter_time_count
-    mapping_frame_time_avg = mapping_frame_time_sum / mapping_frame_time_count
+    tracking_iter_time_avg = profiler.mean("tracking/iter")
+    tracking_frame_time_avg = profiler.mean("tracking/frame")
+    mapping_iter_time_avg = profiler.mean("mapping/iter")
+    mapping_frame_time_avg = profiler.mean("mapping/frame")
     print(f"\nAverage Tracking/Iteration Time: {tracking_iter_time_avg*1000} ms")
     print(f"Average Tracking/Frame Time: {tracking_frame_time_avg} s")
     print(f"Average Mapping/Iteration Time: {mapping_iter_time_avg*1000} ms")
     print(f"Average Mapping/Frame Time: {mapping_frame_time_avg} s")
+    if online_ate is not None:
+        print(online_ate.summary())
 
     # Add Camera Parameters to Save them
     params['timestep'] = variables['timestep']
@@ -388,6 +504,11 @@ def offline_training_loop(config: dict):
     save_params(params, str(output_dir))
     print("Saved SplaTAM Splat to: ", str(output_dir))
 
+    # Save the Runtime Profile
+    if profiler.enabled:
+        print(f"\n{profiler.summary()}")
+        profiler.save(str(output_dir))
+
 
 if __name__ == "__main__":
     args = parse_args()
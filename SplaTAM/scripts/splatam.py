@@ -25,14 +25,23 @@ from datasets.gradslam_datasets import (load_dataset_config, ICLDataset, Replica
                                         ScannetDataset, Ai2thorDataset, Record3DDataset, RealsenseDataset, TUMDataset,
                                         ScannetPPDataset, NeRFCaptureDataset)
 from utils.common_utils import seed_everything, save_params_ckpt, save_params
-from utils.eval_helpers import report_loss, report_progress, eval
-from utils.keyframe_selection import keyframe_selection_overlap
+from utils.eval_helpers import report_loss, report_progress, eval, get_estimated_w2c
+from utils.gaussian_budget import enforce_gaussian_budget
+from utils.gaussian_merge import merge_duplicate_gaussians
+from utils.instrumentation import build_profiler
+from utils.keyframe_selection import keyframe_selection_overlap, KeyframeSampler
+from utils.keyframe_store import build_keyframe_store
+from utils.motion_model import predict_pose, apply_relative_motion, get_relative_motion
+from utils.neighbor_search import covered_points, knn_mean_sq_dist, voxel_cluster_points
 from utils.recon_helpers import setup_camera
 from utils.slam_helpers import (
     transformed_params2rendervar, transformed_params2depthplussilhouette,
-    transform_to_frame, l1_loss_v1, matrix_to_quaternion
+    transform_to_frame, l1_loss_v1, masked_l1_loss, approx_median, matrix_to_quaternion, frustum_cull_gaussians, sample_tracking_pixels
 )
 from utils.slam_external import calc_ssim, build_rotation, prune_gaussians, densify
+from utils.spatial_hash import build_spatial_index
+from utils.tracking_pyramid import build_tracking_pyramid
+from utils.trajectory_eval import OnlineATEEstimator
 
 from diff_gaussian_rasterization import GaussianRasterizer as Renderer
 
@@ -65,7 +74,7 @@ def get_dataset(config_dict, basedir, sequence, **kwargs):
 
 
 def get_pointcloud(color, depth, intrinsics, w2c, transform_pts=True, 
-                   mask=None, compute_mean_sq_dist=False, mean_sq_dist_method="projective"):
+                   mask=None, compute_mean_sq_dist=False, mean_sq_dist_method="projective", map_pts=None):
     width, height = color.shape[2], color.shape[1]
     CX = intrinsics[0][2]
     CY = intrinsics[1][2]
@@ -94,8 +103,9 @@ def get_pointcloud(color, depth, intrinsics, w2c, transform_pts=True,
 
     # Compute mean squared distance for initializing the scale of the Gaussians
     if compute_mean_sq_dist:
-        if mean_sq_dist_method == "projective":
+        if mean_sq_dist_method in ["projective", "knn"]:
             # Projective Geometry (this is fast, farther -> larger radius)
+            # (for knn, this is only the pixel footprint used to size the voxels of the neighbor search below)
             scale_gaussian = depth_z / ((FX + FY)/2)
             mean3_sq_dist = scale_gaussian**2
         else:
@@ -111,6 +121,11 @@ def get_pointcloud(color, depth, intrinsics, w2c, transform_pts=True,
         if compute_mean_sq_dist:
             mean3_sq_dist = mean3_sq_dist[mask]
 
+    # KNN (mean squared distance to the 3 nearest points or existing Gaussians map_pts, searched in a voxel grid)
+    if compute_mean_sq_dist and mean_sq_dist_method == "knn" and point_cld.shape[0] > 0:
+        voxel_size = max(4 * torch.sqrt(torch.median(mean3_sq_dist)).item(), 1e-6)
+        mean3_sq_dist = knn_mean_sq_dist(point_cld[:, :3], voxel_size, num_knn=3, map_pts=map_pts)
+
     if compute_mean_sq_dist:
         return point_cld, mean3_sq_dist
     else:
@@ -157,6 +172,41 @@ def initialize_params(init_pt_cld, num_frames, mean3_sq_dist, gaussian_distribut
     return params, variables
 
 
+def grow_camera_trajectory(params, min_num_frames):
+    """
+    Grow the camera trajectory (cam_unnorm_rots & cam_trans) so that it can hold at least min_num_frames time steps.
+    Capacity is doubled to amortize re-allocation when the number of frames is not known upfront (streaming).
+    New time steps are initialized to the identity pose.
+    """
+    curr_num_frames = params['cam_unnorm_rots'].shape[-1]
+    if min_num_frames <= curr_num_frames:
+        return params
+    new_num_frames = max(min_num_frames, 2 * curr_num_frames)
+    num_new_frames = new_num_frames - curr_num_frames
+    device = params['cam_unnorm_rots'].device
+    new_rots = torch.zeros((1, 4, num_new_frames), device=device).float()
+    new_rots[:, 0, :] = 1.0
+    new_trans = torch.zeros((1, 3, num_new_frames), device=device).float()
+    cam_rots = torch.cat((params['cam_unnorm_rots'].detach(), new_rots), dim=-1)
+    cam_trans = torch.cat((params['cam_trans'].detach(), new_trans), dim=-1)
+    params['cam_unnorm_rots'] = torch.nn.Parameter(cam_rots.contiguous().requires_grad_(True))
+    params['cam_trans'] = torch.nn.Parameter(cam_trans.contiguous().requires_grad_(True))
+    return params
+
+
+def trim_camera_trajectory(params, num_frames):
+    """
+    Trim the camera trajectory to the first num_frames time steps (drops unused streaming capacity).
+    """
+    if params['cam_unnorm_rots'].shape[-1] == num_frames:
+        return params
+    cam_rots = params['cam_unnorm_rots'].detach()[..., :num_frames]
+    cam_trans = params['cam_trans'].detach()[..., :num_frames]
+    params['cam_unnorm_rots'] = torch.nn.Parameter(cam_rots.contiguous().requires_grad_(True))
+    params['cam_trans'] = torch.nn.Parameter(cam_trans.contiguous().requires_grad_(True))
+    return params
+
+
 def initialize_optimizer(params, lrs_dict, tracking):
     lrs = lrs_dict
     param_groups = [{'params': [v], 'name': k, 'lr': lrs[k]} for k, v in params.items()]
@@ -213,10 +263,18 @@ def initialize_first_timestep(dataset, num_frames, scene_radius_depth_ratio,
 
 def get_loss(params, curr_data, variables, iter_time_idx, loss_weights, use_sil_for_loss,
              sil_thres, use_l1, ignore_outlier_depth_loss, tracking=False, 
-             mapping=False, do_ba=False, plot_dir=None, visualize_tracking_loss=False, tracking_iteration=None):
+             mapping=False, do_ba=False, plot_dir=None, visualize_tracking_loss=False, tracking_iteration=None,
+             outlier_median_samples=None):
     # Initialize Loss Dictionary
     losses = {}
 
+    # Only render the Gaussians in the view frustum of the frame if they were culled (frustum_cull_gaussians),
+    # indexing the parameters scatters the gradients of the rendered Gaussians back to the full map
+    full_params = params
+    visible_idx = curr_data.get('visible_idx', None)
+    if visible_idx is not None:
+        params = {k: v if k in ['cam_unnorm_rots', 'cam_trans'] else v[visible_idx] for k, v in full_params.items()}
+
     if tracking:
         # Get current frame Gaussians, where only the camera pose gets gradient
         transformed_gaussians = transform_to_frame(params, iter_time_idx, 
@@ -245,12 +303,29 @@ def get_loss(params, curr_data, variables, iter_time_idx, loss_weights, use_sil_
                                                                  transformed_gaussians)
 
     # RGB Rendering
-    rendervar['means2D'].retain_grad()
+    if visible_idx is not None:
+        # Screen space gradients for all the Gaussians (zero outside the frustum)
+        means2D = torch.zeros_like(full_params['means3D'], requires_grad=True) + 0
+        rendervar['means2D'] = means2D[visible_idx]
+    else:
+        means2D = rendervar['means2D']
+    means2D.retain_grad()
     im, radius, _, = Renderer(raster_settings=curr_data['cam'])(**rendervar)
-    variables['means2D'] = rendervar['means2D']  # Gradient only accum from colour render for densification
+    variables['means2D'] = means2D  # Gradient only accum from colour render for densification
 
     # Depth & Silhouette Rendering
     depth_sil, _, _, = Renderer(raster_settings=curr_data['cam'])(**depth_sil_rendervar)
+
+    # Only evaluate the loss at the sampled pixels of the frame if any (sample_tracking_pixels), as (C, 1, num_pixels)
+    # images so that the masking below is unchanged
+    gt_im, gt_depth = curr_data['im'], curr_data['depth']
+    pixel_idx = curr_data.get('pixel_idx', None)
+    if pixel_idx is not None:
+        im = im.flatten(1)[:, pixel_idx].unsqueeze(1)
+        depth_sil = depth_sil.flatten(1)[:, pixel_idx].unsqueeze(1)
+        gt_im = gt_im.flatten(1)[:, pixel_idx].unsqueeze(1)
+        gt_depth = gt_depth.flatten(1)[:, pixel_idx].unsqueeze(1)
+
     depth = depth_sil[0, :, :].unsqueeze(0)
     silhouette = depth_sil[1, :, :]
     presence_sil_mask = (silhouette > sil_thres)
@@ -261,11 +336,11 @@ def get_loss(params, curr_data, variables, iter_time_idx, loss_weights, use_sil_
     # Mask with valid depth values (accounts for outlier depth values)
     nan_mask = (~torch.isnan(depth)) & (~torch.isnan(uncertainty))
     if ignore_outlier_depth_loss:
-        depth_error = torch.abs(curr_data['depth'] - depth) * (curr_data['depth'] > 0)
-        mask = (depth_error < 10*depth_error.median())
-        mask = mask & (curr_data['depth'] > 0)
+        depth_error = torch.abs(gt_depth - depth) * (gt_depth > 0)
+        mask = (depth_error < 10*approx_median(depth_error, outlier_median_samples))
+        mask = mask & (gt_depth > 0)
     else:
-        mask = (curr_data['depth'] > 0)
+        mask = (gt_depth > 0)
     mask = mask & nan_mask
     # Mask with presence silhouette mask (accounts for empty space)
     if tracking and use_sil_for_loss:
@@ -275,22 +350,22 @@ def get_loss(params, curr_data, variables, iter_time_idx, loss_weights, use_sil_
     if use_l1:
         mask = mask.detach()
         if tracking:
-            losses['depth'] = torch.abs(curr_data['depth'] - depth)[mask].sum()
+            losses['depth'] = masked_l1_loss(gt_depth, depth, mask, reduction='sum')
         else:
-            losses['depth'] = torch.abs(curr_data['depth'] - depth)[mask].mean()
+            losses['depth'] = masked_l1_loss(gt_depth, depth, mask, reduction='mean')
     
     # RGB Loss
     if tracking and (use_sil_for_loss or ignore_outlier_depth_loss):
-        color_mask = torch.tile(mask, (3, 1, 1))
-        color_mask = color_mask.detach()
-        losses['im'] = torch.abs(curr_data['im'] - im)[color_mask].sum()
+        # The (1, H, W) mask is broadcast over the color channels
+        color_mask = mask.detach()
+        losses['im'] = masked_l1_loss(gt_im, im, color_mask, reduction='sum')
     elif tracking:
-        losses['im'] = torch.abs(curr_data['im'] - im).sum()
+        losses['im'] = torch.abs(gt_im - im).sum()
     else:
-        losses['im'] = 0.8 * l1_loss_v1(im, curr_data['im']) + 0.2 * (1.0 - calc_ssim(im, curr_data['im']))
+        losses['im'] = 0.8 * l1_loss_v1(im, gt_im) + 0.2 * (1.0 - calc_ssim(im, gt_im))
 
-    # Visualize the Diff Images
-    if tracking and visualize_tracking_loss:
+    # Visualize the Diff Images (of the full images only)
+    if tracking and visualize_tracking_loss and pixel_idx is None:
         fig, ax = plt.subplots(2, 4, figsize=(12, 6))
         weighted_render_im = im * color_mask
         weighted_im = curr_data['im'] * color_mask
@@ -339,6 +414,10 @@ def get_loss(params, curr_data, variables, iter_time_idx, loss_weights, use_sil_
     weighted_losses = {k: v * loss_weights[k] for k, v in losses.items()}
     loss = sum(weighted_losses.values())
 
+    if visible_idx is not None:
+        full_radius = torch.zeros(full_params['means3D'].shape[0], dtype=radius.dtype, device=radius.device)
+        full_radius[visible_idx] = radius
+        radius = full_radius
     seen = radius > 0
     variables['max_2D_radius'][seen] = torch.max(radius[seen], variables['max_2D_radius'][seen])
     variables['seen'] = seen
@@ -347,6 +426,55 @@ def get_loss(params, curr_data, variables, iter_time_idx, loss_weights, use_sil_
     return loss, variables, weighted_losses
 
 
+def track_coarse_levels(params, variables, optimizer, levels_data, time_idx, tracking_dict, tracking_pyramid, profiler):
+    """
+    Optimize the camera pose of a frame on the coarse levels of its image pyramid (coarsest first).
+
+    Every level runs up to its iteration budget & stops early once its loss has converged (see TrackingPyramid). The
+    pose with the lowest loss of a level initializes the next one.
+
+    Returns:
+        params, variables: updated parameters & variables.
+        num_iters: total number of iterations over the coarse levels.
+    """
+    num_iters = 0
+    for level_data, level_iters in zip(levels_data, tracking_pyramid.level_iters):
+        candidate_cam_unnorm_rot = params['cam_unnorm_rots'][..., time_idx].detach().clone()
+        candidate_cam_tran = params['cam_trans'][..., time_idx].detach().clone()
+        level_min_loss = float(1e20)
+        num_stale_iters = 0
+        for _ in range(level_iters):
+            with profiler.span("tracking/render", detailed=True):
+                loss, variables, _ = get_loss(params, level_data, variables, time_idx, tracking_dict['loss_weights'],
+                                              tracking_dict['use_sil_for_loss'], tracking_dict['sil_thres'],
+                                              tracking_dict['use_l1'], tracking_dict['ignore_outlier_depth_loss'],
+                                              tracking=True,
+                                              outlier_median_samples=tracking_dict.get('outlier_median_samples', None))
+            with profiler.span("tracking/backward", detailed=True):
+                loss.backward()
+            with torch.no_grad():
+                # Save the pose the loss was evaluated at before the update
+                loss = loss.item()
+                if loss < level_min_loss * (1 - tracking_pyramid.convergence_thres):
+                    num_stale_iters = 0
+                else:
+                    num_stale_iters += 1
+                if loss < level_min_loss:
+                    level_min_loss = loss
+                    candidate_cam_unnorm_rot = params['cam_unnorm_rots'][..., time_idx].detach().clone()
+                    candidate_cam_tran = params['cam_trans'][..., time_idx].detach().clone()
+            with profiler.span("tracking/optimizer_step", detailed=True):
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+            num_iters += 1
+            if num_stale_iters >= tracking_pyramid.patience:
+                break
+        with torch.no_grad():
+            params['cam_unnorm_rots'][..., time_idx] = candidate_cam_unnorm_rot
+            params['cam_trans'][..., time_idx] = candidate_cam_tran
+    return params, variables, num_iters
+
+
 def initialize_new_params(new_pt_cld, mean3_sq_dist, gaussian_distribution):
     num_pts = new_pt_cld.shape[0]
     means3D = new_pt_cld[:, :3] # [num_gaussians, 3]
@@ -376,7 +504,16 @@ def initialize_new_params(new_pt_cld, mean3_sq_dist, gaussian_distribution):
 
 
 def add_new_gaussians(params, variables, curr_data, sil_thres, 
-                      time_idx, mean_sq_dist_method, gaussian_distribution):
+                      time_idx, mean_sq_dist_method, gaussian_distribution,
+                      cluster_voxel_size=None, skip_covered=False):
+    """
+    Add Gaussians for the pixels of the frame that aren't explained by the map (low silhouette or new foreground).
+
+    By default every such pixel gets a Gaussian. With cluster_voxel_size, the back-projected pixels are merged per
+    voxel (one Gaussian per voxel, with the mean position & color of its pixels & a scale covering them), and with
+    skip_covered the voxels whose merged point already has an existing Gaussian within half a voxel (searched in the
+    spatial index, if any) don't get a new Gaussian.
+    """
     # Silhouette Rendering
     transformed_gaussians = transform_to_frame(params, time_idx, gaussians_grad=False, camera_grad=False)
     depth_sil_rendervar = transformed_params2depthplussilhouette(params, curr_data['w2c'],
@@ -406,7 +543,14 @@ def add_new_gaussians(params, variables, curr_data, sil_thres,
         non_presence_mask = non_presence_mask & valid_depth_mask.reshape(-1)
         new_pt_cld, mean3_sq_dist = get_pointcloud(curr_data['im'], curr_data['depth'], curr_data['intrinsics'], 
                                     curr_w2c, mask=non_presence_mask, compute_mean_sq_dist=True,
-                                    mean_sq_dist_method=mean_sq_dist_method)
+                                    mean_sq_dist_method=mean_sq_dist_method, map_pts=params['means3D'])
+        if cluster_voxel_size is not None:
+            new_pt_cld, mean3_sq_dist = voxel_cluster_points(new_pt_cld, mean3_sq_dist, cluster_voxel_size)
+            if skip_covered and 'spatial_index' in variables.keys():
+                uncovered = ~covered_points(new_pt_cld[:, :3], variables['spatial_index'], 0.5 * cluster_voxel_size)
+                new_pt_cld, mean3_sq_dist = new_pt_cld[uncovered], mean3_sq_dist[uncovered]
+        if new_pt_cld.shape[0] == 0:
+            return params, variables
         new_params = initialize_new_params(new_pt_cld, mean3_sq_dist, gaussian_distribution)
         for k, v in new_params.items():
             params[k] = torch.nn.Parameter(torch.cat((params[k], v), dim=0).requires_grad_(True))
@@ -416,24 +560,31 @@ def add_new_gaussians(params, variables, curr_data, sil_thres,
         variables['max_2D_radius'] = torch.zeros(num_pts, device="cuda").float()
         new_timestep = time_idx*torch.ones(new_pt_cld.shape[0],device="cuda").float()
         variables['timestep'] = torch.cat((variables['timestep'],new_timestep),dim=0)
+        if 'spatial_index' in variables.keys():
+            variables['spatial_index'].insert(new_params['means3D'])
 
     return params, variables
 
 
-def initialize_camera_pose(params, curr_time_idx, forward_prop):
+def initialize_camera_pose(params, curr_time_idx, forward_prop, motion_model='constant_velocity', damping=1.0,
+                           relative_motion=None):
     with torch.no_grad():
-        if curr_time_idx > 1 and forward_prop:
-            # Initialize the camera pose for the current frame based on a constant velocity model
-            # Rotation
-            prev_rot1 = F.normalize(params['cam_unnorm_rots'][..., curr_time_idx-1].detach())
-            prev_rot2 = F.normalize(params['cam_unnorm_rots'][..., curr_time_idx-2].detach())
-            new_rot = F.normalize(prev_rot1 + (prev_rot1 - prev_rot2))
-            params['cam_unnorm_rots'][..., curr_time_idx] = new_rot.detach()
-            # Translation
-            prev_tran1 = params['cam_trans'][..., curr_time_idx-1].detach()
-            prev_tran2 = params['cam_trans'][..., curr_time_idx-2].detach()
-            new_tran = prev_tran1 + (prev_tran1 - prev_tran2)
-            params['cam_trans'][..., curr_time_idx] = new_tran.detach()
+        if curr_time_idx > 0 and relative_motion is not None:
+            # Initialize the camera pose for the current frame by moving the previous pose by the relative motion
+            # measured by another sensor (e.g. ARKit)
+            prev_rot = F.normalize(params['cam_unnorm_rots'][..., curr_time_idx-1].detach())
+            prev_tran = params['cam_trans'][..., curr_time_idx-1].detach()
+            new_rot, new_tran = apply_relative_motion(prev_rot, prev_tran, relative_motion)
+            params['cam_unnorm_rots'][..., curr_time_idx] = new_rot
+            params['cam_trans'][..., curr_time_idx] = new_tran
+        elif curr_time_idx > 1 and forward_prop:
+            # Initialize the camera pose for the current frame by extrapolating the motion of the latest poses
+            num_prev_poses = min(curr_time_idx, 3)
+            prev_rots = F.normalize(params['cam_unnorm_rots'][0, :, curr_time_idx-num_prev_poses:curr_time_idx].detach().T)
+            prev_trans = params['cam_trans'][0, :, curr_time_idx-num_prev_poses:curr_time_idx].detach().T
+            new_rot, new_tran = predict_pose(prev_rots, prev_trans, motion_model, damping)
+            params['cam_unnorm_rots'][..., curr_time_idx] = new_rot
+            params['cam_trans'][..., curr_time_idx] = new_tran
         else:
             # Initialize the camera pose for the current frame
             params['cam_unnorm_rots'][..., curr_time_idx] = params['cam_unnorm_rots'][..., curr_time_idx-1].detach()
@@ -462,6 +613,14 @@ def rgbd_slam(config: dict):
         config['tracking']['visualize_tracking_loss'] = False
     if "gaussian_distribution" not in config:
         config['gaussian_distribution'] = "isotropic"
+    if "eval_batch_size" not in config:
+        config['eval_batch_size'] = 8
+    if "eval_save_plots" not in config:
+        config['eval_save_plots'] = True
+    if "eval_async_plots" not in config:
+        config['eval_async_plots'] = False
+    if "eval_rpe_deltas" not in config:
+        config['eval_rpe_deltas'] = [1]
     print(f"{config}")
 
     # Create Output Directories
@@ -495,6 +654,8 @@ def rgbd_slam(config: dict):
         dataset_config["ignore_bad"] = False
     if "use_train_split" not in dataset_config:
         dataset_config["use_train_split"] = True
+    if "device_preprocess" not in dataset_config:
+        dataset_config["device_preprocess"] = False
     if "densification_image_height" not in dataset_config:
         dataset_config["densification_image_height"] = dataset_config["desired_image_height"]
         dataset_config["densification_image_width"] = dataset_config["desired_image_width"]
@@ -529,6 +690,7 @@ def rgbd_slam(config: dict):
         relative_pose=True,
         ignore_bad=dataset_config["ignore_bad"],
         use_train_split=dataset_config["use_train_split"],
+        device_preprocess=dataset_config["device_preprocess"],
     )
     num_frames = dataset_config["num_frames"]
     if num_frames == -1:
@@ -549,6 +711,7 @@ def rgbd_slam(config: dict):
             relative_pose=True,
             ignore_bad=dataset_config["ignore_bad"],
             use_train_split=dataset_config["use_train_split"],
+            device_preprocess=dataset_config["device_preprocess"],
         )
         # Initialize Parameters, Canonical & Densification Camera parameters
         params, variables, intrinsics, first_frame_w2c, cam, \
@@ -579,6 +742,7 @@ def rgbd_slam(config: dict):
             relative_pose=True,
             ignore_bad=dataset_config["ignore_bad"],
             use_train_split=dataset_config["use_train_split"],
+            device_preprocess=dataset_config["device_preprocess"],
         )
         tracking_color, _, tracking_intrinsics, _ = tracking_dataset[0]
         tracking_color = tracking_color.permute(2, 0, 1) / 255 # (H, W, C) -> (C, H, W)
@@ -586,20 +750,31 @@ def rgbd_slam(config: dict):
         tracking_cam = setup_camera(tracking_color.shape[2], tracking_color.shape[1], 
                                     tracking_intrinsics.cpu().numpy(), first_frame_w2c.detach().cpu().numpy())
     
-    # Initialize list to keep track of Keyframes
-    keyframe_list = []
+    # Initialize store to keep track of Keyframes (compressed & offloaded from the device if configured)
+    keyframe_list = build_keyframe_store(config, device, output_dir)
     keyframe_time_indices = []
     
     # Init Variables to keep track of ground truth poses and runtimes
     gt_w2c_all_frames = []
-    tracking_iter_time_sum = 0
-    tracking_iter_time_count = 0
-    mapping_iter_time_sum = 0
-    mapping_iter_time_count = 0
-    tracking_frame_time_sum = 0
-    tracking_frame_time_count = 0
-    mapping_frame_time_sum = 0
-    mapping_frame_time_count = 0
+    profiler = build_profiler(config)
+    gaussian_budget_config = config.get('gaussian_budget', {})
+    merge_config = config.get('gaussian_merge', {})
+    culling_config = config.get('frustum_culling', {})
+    tracking_pyramid = build_tracking_pyramid(config)
+    motion_config = config['tracking'].get('motion_model', {})
+    # The ARKit prior uses the relative motion of the dataset poses, which are the ARKit poses (transform_matrix) only
+    # for NeRFCapture datasets (for any other dataset, they're the ground truth trajectory)
+    if motion_config.get('use_arkit_prior', False) and not isinstance(dataset, NeRFCaptureDataset):
+        print("Warning: use_arkit_prior is only supported for NeRFCapture datasets, ignoring it.")
+        motion_config = {**motion_config, 'use_arkit_prior': False}
+
+    # Running ATE of the tracked trajectory against the ground truth poses (O(1) per frame, used as drift alarm)
+    online_ate_config = config.get('online_ate', {})
+    online_ate = None
+    if online_ate_config.get('enabled', True):
+        online_ate = OnlineATEEstimator(with_scale=online_ate_config.get('with_scale', False),
+                                        drift_threshold=online_ate_config.get('drift_threshold', None),
+                                        min_frames=online_ate_config.get('min_frames', 10))
 
     # Load Checkpoint
     if config['load_checkpoint']:
@@ -622,6 +797,8 @@ def rgbd_slam(config: dict):
             # Process poses
             gt_w2c = torch.linalg.inv(gt_pose)
             gt_w2c_all_frames.append(gt_w2c)
+            if online_ate is not None:
+                online_ate.update(gt_w2c, get_estimated_w2c(params, time_idx))
             # Initialize Keyframe List
             if time_idx in keyframe_time_indices:
                 # Get the estimated rotation & translation
@@ -638,11 +815,15 @@ def rgbd_slam(config: dict):
                 keyframe_list.append(curr_keyframe)
     else:
         checkpoint_time_idx = 0
+
+    # Voxel hash over the Gaussian centers for region queries (kept in sync when Gaussians are added & pruned)
+    variables = build_spatial_index(config, params, variables)
     
     # Iterate over Scan
     for time_idx in tqdm(range(checkpoint_time_idx, num_frames)):
         # Load RGBD frames incrementally instead of all frames
-        color, depth, _, gt_pose = dataset[time_idx]
+        with profiler.span("data_load"):
+            color, depth, _, gt_pose = dataset[time_idx]
         # Process poses
         gt_w2c = torch.linalg.inv(gt_pose)
         # Process RGB-D Data
@@ -671,7 +852,11 @@ def rgbd_slam(config: dict):
         
         # Initialize the camera pose for the current frame
         if time_idx > 0:
-            params = initialize_camera_pose(params, time_idx, forward_prop=config['tracking']['forward_prop'])
+            with profiler.span("pose_init"):
+                relative_motion = get_relative_motion(curr_gt_w2c) if motion_config.get('use_arkit_prior', False) else None
+                params = initialize_camera_pose(params, time_idx, forward_prop=config['tracking']['forward_prop'],
+                                                motion_model=motion_config.get('type', 'constant_velocity'),
+                                                damping=motion_config.get('damping', 1.0), relative_motion=relative_motion)
 
         # Tracking
         tracking_start_time = time.time()
@@ -682,27 +867,55 @@ def rgbd_slam(config: dict):
             candidate_cam_unnorm_rot = params['cam_unnorm_rots'][..., time_idx].detach().clone()
             candidate_cam_tran = params['cam_trans'][..., time_idx].detach().clone()
             current_min_loss = float(1e20)
+            # Cull the Gaussians outside the (expanded) view frustum once for all the tracking iterations
+            if culling_config.get('enabled', False):
+                with profiler.span("cull"):
+                    visible_idx = frustum_cull_gaussians(params, variables, time_idx, tracking_curr_data, culling_config)
+                tracking_curr_data = {**tracking_curr_data, 'visible_idx': visible_idx}
+                profiler.observe("tracking/visible_gaussians", visible_idx.shape[0])
+            # Only evaluate the tracking loss at informative pixels (picked once for all the tracking iterations)
+            depth_loss_thres = config['tracking']['depth_loss_thres']
+            num_tracking_pixels = config['tracking'].get('num_pixels', None)
+            if num_tracking_pixels is not None:
+                with profiler.span("pixel_sampling"):
+                    pixel_idx = sample_tracking_pixels(tracking_curr_data['im'], tracking_curr_data['depth'],
+                                                       num_tracking_pixels)
+                tracking_curr_data = {**tracking_curr_data, 'pixel_idx': pixel_idx}
+                profiler.observe("tracking/loss_pixels", pixel_idx.shape[0])
+                # The depth loss is then summed over the sampled pixels only, so scale its threshold (set for the full image)
+                depth_loss_thres = depth_loss_thres * pixel_idx.shape[0] / tracking_curr_data['depth'][0].numel()
+            # Coarse-to-fine tracking: most of the iterations on the coarse levels of the frame, then refine below
+            if tracking_pyramid is not None:
+                with profiler.span("tracking/pyramid"):
+                    levels_data = tracking_pyramid.build(tracking_curr_data)
+                    params, variables, num_coarse_iters = track_coarse_levels(params, variables, optimizer, levels_data, time_idx,
+                                                                              config['tracking'], tracking_pyramid, profiler)
+                profiler.observe("tracking/coarse_iters_per_frame", num_coarse_iters)
             # Tracking Optimization
             iter = 0
             do_continue_slam = False
-            num_iters_tracking = config['tracking']['num_iters']
+            num_iters_tracking = config['tracking']['num_iters'] if tracking_pyramid is None else tracking_pyramid.fine_iters
             progress_bar = tqdm(range(num_iters_tracking), desc=f"Tracking Time Step: {time_idx}")
             while True:
                 iter_start_time = time.time()
                 # Loss for current frame
-                loss, variables, losses = get_loss(params, tracking_curr_data, variables, iter_time_idx, config['tracking']['loss_weights'],
-                                                   config['tracking']['use_sil_for_loss'], config['tracking']['sil_thres'],
-                                                   config['tracking']['use_l1'], config['tracking']['ignore_outlier_depth_loss'], tracking=True, 
-                                                   plot_dir=eval_dir, visualize_tracking_loss=config['tracking']['visualize_tracking_loss'],
-                                                   tracking_iteration=iter)
+                with profiler.span("tracking/render", detailed=True):
+                    loss, variables, losses = get_loss(params, tracking_curr_data, variables, iter_time_idx, config['tracking']['loss_weights'],
+                                                       config['tracking']['use_sil_for_loss'], config['tracking']['sil_thres'],
+                                                       config['tracking']['use_l1'], config['tracking']['ignore_outlier_depth_loss'], tracking=True,
+                                                       outlier_median_samples=config['tracking'].get('outlier_median_samples', None),
+                                                       plot_dir=eval_dir, visualize_tracking_loss=config['tracking']['visualize_tracking_loss'],
+                                                       tracking_iteration=iter)
                 if config['use_wandb']:
                     # Report Loss
                     wandb_tracking_step = report_loss(losses, wandb_run, wandb_tracking_step, tracking=True)
                 # Backprop
-                loss.backward()
+                with profiler.span("tracking/backward", detailed=True):
+                    loss.backward()
                 # Optimizer Update
-                optimizer.step()
-                optimizer.zero_grad(set_to_none=True)
+                with profiler.span("tracking/optimizer_step", detailed=True):
+                    optimizer.step()
+                    optimizer.zero_grad(set_to_none=True)
                 with torch.no_grad():
                     # Save the best candidate rotation & translation
                     if loss < current_min_loss:
@@ -720,16 +933,16 @@ def rgbd_slam(config: dict):
                         progress_bar.update(1)
                 # Update the runtime numbers
                 iter_end_time = time.time()
-                tracking_iter_time_sum += iter_end_time - iter_start_time
-                tracking_iter_time_count += 1
+                profiler.add_time("tracking/iter", iter_end_time - iter_start_time)
                 # Check if we should stop tracking
                 iter += 1
                 if iter == num_iters_tracking:
-                    if losses['depth'] < config['tracking']['depth_loss_thres'] and config['tracking']['use_depth_loss_thres']:
+                    if losses['depth'] < depth_loss_thres and config['tracking']['use_depth_loss_thres']:
                         break
                     elif config['tracking']['use_depth_loss_thres'] and not do_continue_slam:
                         do_continue_slam = True
                         progress_bar = tqdm(range(num_iters_tracking), desc=f"Tracking Time Step: {time_idx}")
+                        profiler.count("tracking/extra_iters", num_iters_tracking)
                         num_iters_tracking = 2*num_iters_tracking
                         if config['use_wandb']:
                             wandb_run.log({"Tracking/Extra Tracking Iters Frames": time_idx,
@@ -738,6 +951,7 @@ def rgbd_slam(config: dict):
                         break
 
             progress_bar.close()
+            profiler.observe("tracking/iters_per_frame", iter)
             # Copy over the best candidate rotation & translation
             with torch.no_grad():
                 params['cam_unnorm_rots'][..., time_idx] = candidate_cam_unnorm_rot
@@ -754,8 +968,17 @@ def rgbd_slam(config: dict):
                 params['cam_trans'][..., time_idx] = rel_w2c_tran
         # Update the runtime numbers
         tracking_end_time = time.time()
-        tracking_frame_time_sum += tracking_end_time - tracking_start_time
-        tracking_frame_time_count += 1
+        profiler.add_time("tracking/frame", tracking_end_time - tracking_start_time)
+
+        # Update the running ATE with the tracked pose
+        if online_ate is not None:
+            drift_alarm = online_ate.update(curr_gt_w2c[-1], get_estimated_w2c(params, time_idx))
+            if drift_alarm:
+                print(f"\nWarning: Drift detected at Time Step {time_idx}. {online_ate.summary()}")
+            if config['use_wandb']:
+                wandb_run.log({"Tracking/Online ATE RMSE": online_ate.rmse(),
+                               "Tracking/Drift Alarm": int(online_ate.alarm_active),
+                               "Tracking/step": wandb_time_step})
 
         if time_idx == 0 or (time_idx+1) % config['report_global_progress_every'] == 0:
             try:
@@ -789,15 +1012,21 @@ def rgbd_slam(config: dict):
                     densify_curr_data = curr_data
 
                 # Add new Gaussians to the scene based on the Silhouette
-                params, variables = add_new_gaussians(params, variables, densify_curr_data, 
-                                                      config['mapping']['sil_thres'], time_idx,
-                                                      config['mean_sq_dist_method'], config['gaussian_distribution'])
+                pre_num_pts = params['means3D'].shape[0]
+                with profiler.span("densify"):
+                    params, variables = add_new_gaussians(params, variables, densify_curr_data, 
+                                                          config['mapping']['sil_thres'], time_idx,
+                                                          config['mean_sq_dist_method'], config['gaussian_distribution'],
+                                                          cluster_voxel_size=config['mapping'].get('new_gaussian_voxel_size', None),
+                                                          skip_covered=config['mapping'].get('skip_covered_new_gaussians', False))
                 post_num_pts = params['means3D'].shape[0]
+                profiler.count("gaussians/added", post_num_pts - pre_num_pts)
+                profiler.observe("gaussians/added_per_frame", post_num_pts - pre_num_pts)
                 if config['use_wandb']:
                     wandb_run.log({"Mapping/Number of Gaussians": post_num_pts,
                                    "Mapping/step": wandb_time_step})
             
-            with torch.no_grad():
+            with torch.no_grad(), profiler.span("keyframe_select"):
                 # Get the current estimated rotation & translation
                 curr_cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
                 curr_cam_tran = params['cam_trans'][..., time_idx].detach()
@@ -817,6 +1046,8 @@ def rgbd_slam(config: dict):
                 selected_keyframes.append(-1)
                 # Print the selected keyframes
                 print(f"\nSelected Keyframes at Frame {time_idx}: {selected_time_idx}")
+                # Bring the selected keyframes back to the device before the mapping iterations
+                keyframe_list.prefetch(selected_keyframes)
 
             # Reset Optimizer & Learning Rates for Full Map Optimization
             optimizer = initialize_optimizer(params, config['mapping']['lrs'], tracking=False) 
@@ -825,35 +1056,53 @@ def rgbd_slam(config: dict):
             mapping_start_time = time.time()
             if num_iters_mapping > 0:
                 progress_bar = tqdm(range(num_iters_mapping), desc=f"Mapping Time Step: {time_idx}")
+            # Culled Gaussians of every keyframe (culled again once the Gaussians were added or removed)
+            visible_idx_cache, visible_idx_means = {}, None
+            keyframe_sampler = KeyframeSampler(selected_keyframes, batch_size=config['mapping'].get('batch_size', 1),
+                                               policy=config['mapping'].get('keyframe_sampling', None))
             for iter in range(num_iters_mapping):
                 iter_start_time = time.time()
-                # Randomly select a frame until current time step amongst keyframes
-                rand_idx = np.random.randint(0, len(selected_keyframes))
-                selected_rand_keyframe_idx = selected_keyframes[rand_idx]
-                if selected_rand_keyframe_idx == -1:
-                    # Use Current Frame Data
-                    iter_time_idx = time_idx
-                    iter_color = color
-                    iter_depth = depth
-                else:
-                    # Use Keyframe Data
-                    iter_time_idx = keyframe_list[selected_rand_keyframe_idx]['id']
-                    iter_color = keyframe_list[selected_rand_keyframe_idx]['color']
-                    iter_depth = keyframe_list[selected_rand_keyframe_idx]['depth']
-                iter_gt_w2c = gt_w2c_all_frames[:iter_time_idx+1]
-                iter_data = {'cam': cam, 'im': iter_color, 'depth': iter_depth, 'id': iter_time_idx, 
-                             'intrinsics': intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': iter_gt_w2c}
-                # Loss for current frame
-                loss, variables, losses = get_loss(params, iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
-                                                config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
-                                                config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True)
-                if config['use_wandb']:
-                    # Report Loss
-                    wandb_mapping_step = report_loss(losses, wandb_run, wandb_mapping_step, mapping=True)
-                # Backprop
-                loss.backward()
-
-                # Densification Gradients
+                # Select a batch of frames until current time step amongst keyframes
+                batch_keyframe_idx = keyframe_sampler.sample()
+                # Accumulate the gradients of the batch (averaged over its frames)
+                for selected_rand_keyframe_idx in batch_keyframe_idx:
+                    if selected_rand_keyframe_idx == -1:
+                        # Use Current Frame Data
+                        iter_time_idx = time_idx
+                        iter_color = color
+                        iter_depth = depth
+                    else:
+                        # Use Keyframe Data
+                        iter_time_idx = keyframe_list[selected_rand_keyframe_idx]['id']
+                        iter_color = keyframe_list[selected_rand_keyframe_idx]['color']
+                        iter_depth = keyframe_list[selected_rand_keyframe_idx]['depth']
+                    iter_gt_w2c = gt_w2c_all_frames[:iter_time_idx+1]
+                    iter_data = {'cam': cam, 'im': iter_color, 'depth': iter_depth, 'id': iter_time_idx, 
+                                 'intrinsics': intrinsics, 'w2c': first_frame_w2c, 'iter_gt_w2c_list': iter_gt_w2c}
+                    # Only render the Gaussians in the view frustum of the keyframe
+                    if culling_config.get('enabled', False):
+                        if visible_idx_means is not params['means3D']:
+                            visible_idx_cache, visible_idx_means = {}, params['means3D']
+                        if iter_time_idx not in visible_idx_cache:
+                            with profiler.span("cull"):
+                                visible_idx_cache[iter_time_idx] = frustum_cull_gaussians(params, variables, iter_time_idx, iter_data,
+                                                                                          culling_config)
+                        iter_data['visible_idx'] = visible_idx_cache[iter_time_idx]
+                    # Loss for current frame
+                    with profiler.span("mapping/render", detailed=True):
+                        loss, variables, losses = get_loss(params, iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
+                                                        config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
+                                                        config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True,
+                                                        outlier_median_samples=config['mapping'].get('outlier_median_samples', None))
+                    if config['use_wandb']:
+                        # Report Loss
+                        wandb_mapping_step = report_loss(losses, wandb_run, wandb_mapping_step, mapping=True)
+                    # Backprop
+                    with profiler.span("mapping/backward", detailed=True):
+                        (loss / len(batch_keyframe_idx)).backward()
+
+                # Densification Gradients (of the last frame of the batch): with a batch, only w.r.t. means2D, so that
+                # the parameter gradients stay the batch average
                 if config['mapping']['use_gaussian_splatting_densification']:
                     if seperate_densification_res:
                         if selected_rand_keyframe_idx == -1:
@@ -868,25 +1117,36 @@ def rgbd_slam(config: dict):
                         densify_iter_data = iter_data
                     densify_loss, variables, _ = get_loss(params, densify_iter_data, variables, iter_time_idx, config['mapping']['loss_weights'],
                                                     config['mapping']['use_sil_for_loss'], config['mapping']['sil_thres'],
-                                                    config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True)
-                    densify_loss.backward()
+                                                    config['mapping']['use_l1'], config['mapping']['ignore_outlier_depth_loss'], mapping=True,
+                                                    outlier_median_samples=config['mapping'].get('outlier_median_samples', None))
+                    if len(batch_keyframe_idx) > 1:
+                        densify_loss.backward(inputs=[variables['means2D']])
+                    else:
+                        densify_loss.backward()
 
                 with torch.no_grad():
                     # Prune Gaussians
                     if config['mapping']['prune_gaussians']:
-                        params, variables = prune_gaussians(params, variables, optimizer, iter, config['mapping']['pruning_dict'])
+                        pre_num_pts = params['means3D'].shape[0]
+                        with profiler.span("prune"):
+                            params, variables = prune_gaussians(params, variables, optimizer, iter, config['mapping']['pruning_dict'])
+                        profiler.count("gaussians/pruned", pre_num_pts - params['means3D'].shape[0])
                         if config['use_wandb']:
                             wandb_run.log({"Mapping/Number of Gaussians - Pruning": params['means3D'].shape[0],
                                            "Mapping/step": wandb_mapping_step})
                     # Gaussian-Splatting's Gradient-based Densification
                     if config['mapping']['use_gaussian_splatting_densification']:
-                        params, variables = densify(params, variables, optimizer, iter, config['mapping']['densify_dict'])
+                        pre_num_pts = params['means3D'].shape[0]
+                        with profiler.span("gs_densify"):
+                            params, variables = densify(params, variables, optimizer, iter, config['mapping']['densify_dict'])
+                        profiler.count("gaussians/densified", params['means3D'].shape[0] - pre_num_pts)
                         if config['use_wandb']:
                             wandb_run.log({"Mapping/Number of Gaussians - Densification": params['means3D'].shape[0],
                                            "Mapping/step": wandb_mapping_step})
                     # Optimizer Update
-                    optimizer.step()
-                    optimizer.zero_grad(set_to_none=True)
+                    with profiler.span("mapping/optimizer_step", detailed=True):
+                        optimizer.step()
+                        optimizer.zero_grad(set_to_none=True)
                     # Report Progress
                     if config['report_iter_progress']:
                         if config['use_wandb']:
@@ -900,14 +1160,38 @@ def rgbd_slam(config: dict):
                         progress_bar.update(1)
                 # Update the runtime numbers
                 iter_end_time = time.time()
-                mapping_iter_time_sum += iter_end_time - iter_start_time
-                mapping_iter_time_count += 1
+                profiler.add_time("mapping/iter", iter_end_time - iter_start_time)
             if num_iters_mapping > 0:
                 progress_bar.close()
             # Update the runtime numbers
             mapping_end_time = time.time()
-            mapping_frame_time_sum += mapping_end_time - mapping_start_time
-            mapping_frame_time_count += 1
+            profiler.add_time("mapping/frame", mapping_end_time - mapping_start_time)
+
+            # Re-bucket the Gaussians that moved during mapping in the spatial index
+            if 'spatial_index' in variables.keys():
+                with profiler.span("spatial_index"):
+                    variables['spatial_index'].update(params['means3D'])
+
+            # Merge the near-duplicate Gaussians of the map
+            if merge_config.get('enabled', False) and (time_idx+1) % merge_config.get('merge_every', 10) == 0:
+                with profiler.span("merge"):
+                    params, variables, num_merged = merge_duplicate_gaussians(params, variables, optimizer, merge_config)
+                profiler.count("gaussians/merged", num_merged)
+
+            # Evict the lowest contribution Gaussians if the map exceeds its memory budget
+            if gaussian_budget_config.get('enabled', False):
+                with torch.no_grad(), profiler.span("budget"):
+                    params, variables, num_evicted = enforce_gaussian_budget(params, variables, optimizer, time_idx,
+                                                                             gaussian_budget_config)
+                profiler.count("gaussians/evicted", num_evicted)
+                if num_evicted > 0:
+                    print(f"\nEvicted {num_evicted} Gaussians at Time Step {time_idx} to stay within the memory budget.")
+                if config['use_wandb']:
+                    wandb_run.log({"Mapping/Number of Gaussians - Evicted": num_evicted,
+                                   "Mapping/Number of Gaussians": params['means3D'].shape[0],
+                                   "Mapping/step": wandb_time_step})
+
+            profiler.observe("gaussians/num_after_mapping", params['means3D'].shape[0])
 
             if time_idx == 0 or (time_idx+1) % config['report_global_progress_every'] == 0:
                 try:
@@ -945,9 +1229,10 @@ def rgbd_slam(config: dict):
         
         # Checkpoint every iteration
         if time_idx % config["checkpoint_interval"] == 0 and config['save_checkpoints']:
-            ckpt_output_dir = os.path.join(config["workdir"], config["run_name"])
-            save_params_ckpt(params, ckpt_output_dir, time_idx)
-            np.save(os.path.join(ckpt_output_dir, f"keyframe_time_indices{time_idx}.npy"), np.array(keyframe_time_indices))
+            with profiler.span("checkpoint"):
+                ckpt_output_dir = os.path.join(config["workdir"], config["run_name"])
+                save_params_ckpt(params, ckpt_output_dir, time_idx)
+                np.save(os.path.join(ckpt_output_dir, f"keyframe_time_indices{time_idx}.npy"), np.array(keyframe_time_indices))
         
         # Increment WandB Time Step
         if config['use_wandb']:
@@ -956,20 +1241,16 @@ def rgbd_slam(config: dict):
         torch.cuda.empty_cache()
 
     # Compute Average Runtimes
-    if tracking_iter_time_count == 0:
-        tracking_iter_time_count = 1
-        tracking_frame_time_count = 1
-    if mapping_iter_time_count == 0:
-        mapping_iter_time_count = 1
-        mapping_frame_time_count = 1
-    tracking_iter_time_avg = tracking_iter_time_sum / tracking_iter_time_count
-    tracking_frame_time_avg = tracking_frame_time_sum / tracking_frame_time_count
-    mapping_iter_time_avg = mapping_iter_time_sum / mapping_iter_time_count
-    mapping_frame_time_avg = mapping_frame_time_sum / mapping_frame_time_count
+    tracking_iter_time_avg = profiler.mean("tracking/iter")
+    tracking_frame_time_avg = profiler.mean("tracking/frame")
+    mapping_iter_time_avg = profiler.mean("mapping/iter")
+    mapping_frame_time_avg = profiler.mean("mapping/frame")
     print(f"\nAverage Tracking/Iteration Time: {tracking_iter_time_avg*1000} ms")
     print(f"Average Tracking/Frame Time: {tracking_frame_time_avg} s")
     print(f"Average Mapping/Iteration Time: {mapping_iter_time_avg*1000} ms")
     print(f"Average Mapping/Frame Time: {mapping_frame_time_avg} s")
+    if online_ate is not None:
+        print(online_ate.summary())
     if config['use_wandb']:
         wandb_run.log({"Final Stats/Average Tracking Iteration Time (ms)": tracking_iter_time_avg*1000,
                        "Final Stats/Average Tracking Frame Time (s)": tracking_frame_time_avg,
@@ -978,16 +1259,20 @@ def rgbd_slam(config: dict):
                        "Final Stats/step": 1})
     
     # Evaluate Final Parameters
-    with torch.no_grad():
+    with torch.no_grad(), profiler.span("eval"):
         if config['use_wandb']:
             eval(dataset, params, num_frames, eval_dir, sil_thres=config['mapping']['sil_thres'],
                  wandb_run=wandb_run, wandb_save_qual=config['wandb']['eval_save_qual'],
                  mapping_iters=config['mapping']['num_iters'], add_new_gaussians=config['mapping']['add_new_gaussians'],
-                 eval_every=config['eval_every'])
+                 eval_every=config['eval_every'], eval_batch_size=config['eval_batch_size'],
+                 save_plots=config['eval_save_plots'], async_plots=config['eval_async_plots'],
+                 rpe_deltas=config['eval_rpe_deltas'])
         else:
             eval(dataset, params, num_frames, eval_dir, sil_thres=config['mapping']['sil_thres'],
                  mapping_iters=config['mapping']['num_iters'], add_new_gaussians=config['mapping']['add_new_gaussians'],
-                 eval_every=config['eval_every'])
+                 eval_every=config['eval_every'], eval_batch_size=config['eval_batch_size'],
+                 save_plots=config['eval_save_plots'], async_plots=config['eval_async_plots'],
+                 rpe_deltas=config['eval_rpe_deltas'])
 
     # Add Camera Parameters to Save them
     params['timestep'] = variables['timestep']
@@ -1004,6 +1289,11 @@ def rgbd_slam(config: dict):
     # Save Parameters
     save_params(params, output_dir)
 
+    # Save the Runtime Profile
+    if profiler.enabled:
+        print(f"\n{profiler.summary()}")
+        profiler.save(output_dir)
+
     # Close WandB Run
     if config['use_wandb']:
         wandb.finish()
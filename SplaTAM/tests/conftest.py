@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The tests import the repo's packages (utils, datasets, ...) like the scripts do
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _BASE_DIR not in sys.path:
+    sys.path.insert(0, _BASE_DIR)
@@ -0,0 +1,93 @@
+"""masked_l1_loss & approx_median of utils/slam_helpers.py against the boolean indexing & torch.median they replace."""
+
+import math
+
+import pytest
+import torch
+
+from utils.slam_helpers import approx_median, masked_l1_loss
+
+
+def _reference_l1(x, y, mask, reduction):
+    masked = torch.abs(x - y)[mask.expand_as(x)]
+    return masked.sum() if reduction == 'sum' else masked.mean()
+
+
+def _loss_and_grads(loss_fn, x, y, mask, reduction):
+    x = x.clone().requires_grad_(True)
+    y = y.clone().requires_grad_(True)
+    loss = loss_fn(x, y, mask, reduction)
+    loss.backward()
+    return loss.detach(), x.grad, y.grad
+
+
+@pytest.mark.parametrize("reduction", ['sum', 'mean'])
+@pytest.mark.parametrize("shape, mask_shape", [((1, 24, 32), (1, 24, 32)), ((3, 24, 32), (1, 24, 32))])
+def test_masked_l1_loss_matches_boolean_indexing(shape, mask_shape, reduction):
+    generator = torch.Generator().manual_seed(0)
+    x = torch.rand(shape, generator=generator, dtype=torch.float64)
+    y = torch.rand(shape, generator=generator, dtype=torch.float64)
+    # A (1, H, W) mask is broadcast over the color channels, like the silhouette mask of the tracking color loss
+    mask = torch.rand(mask_shape, generator=generator) > 0.4
+    loss, x_grad, y_grad = _loss_and_grads(masked_l1_loss, x, y, mask, reduction)
+    ref_loss, ref_x_grad, ref_y_grad = _loss_and_grads(_reference_l1, x, y, mask, reduction)
+    torch.testing.assert_close(loss, ref_loss)
+    torch.testing.assert_close(x_grad, ref_x_grad)
+    torch.testing.assert_close(y_grad, ref_y_grad)
+
+
+@pytest.mark.parametrize("reduction", ['sum', 'mean'])
+def test_masked_l1_loss_ignores_nan_outside_mask(reduction):
+    generator = torch.Generator().manual_seed(1)
+    gt_depth = torch.rand((1, 16, 16), generator=generator)
+    gt_depth[0, :4] = float('nan')
+    depth = torch.rand((1, 16, 16), generator=generator)
+    mask = ~torch.isnan(gt_depth)
+    loss, _, grad = _loss_and_grads(masked_l1_loss, gt_depth, depth, mask, reduction)
+    ref_loss, _, ref_grad = _loss_and_grads(_reference_l1, gt_depth, depth, mask, reduction)
+    assert torch.isfinite(loss)
+    assert torch.isfinite(grad).all()
+    torch.testing.assert_close(loss, ref_loss)
+    torch.testing.assert_close(grad, ref_grad)
+
+
+def test_masked_l1_loss_empty_mask():
+    x = torch.rand((3, 8, 8))
+    y = torch.rand((3, 8, 8))
+    mask = torch.zeros((1, 8, 8), dtype=torch.bool)
+    loss, _, grad = _loss_and_grads(masked_l1_loss, x, y, mask, 'sum')
+    assert loss.item() == 0.0
+    assert (grad == 0).all()
+    # Mean of no elements is NaN, like the mean of the empty boolean selection
+    mean_loss = masked_l1_loss(x, y, mask, reduction='mean')
+    torch.testing.assert_close(mean_loss, _reference_l1(x, y, mask, 'mean'), equal_nan=True)
+    assert torch.isnan(mean_loss)
+
+
+def test_masked_l1_loss_unknown_reduction():
+    x = torch.rand((1, 4, 4))
+    with pytest.raises(ValueError):
+        masked_l1_loss(x, x, x > 0.5, reduction='max')
+
+
+@pytest.mark.parametrize("numel", [1, 2, 7, 100, 1001])
+def test_approx_median_matches_torch_median(numel):
+    generator = torch.Generator().manual_seed(numel)
+    x = torch.randn((numel,), generator=generator)
+    # Lower median for an even number of elements, like torch.median
+    assert approx_median(x).item() == torch.median(x).item()
+    # Any shape is flattened
+    depth = torch.rand((1, 12, 9), generator=generator)
+    assert approx_median(depth).item() == torch.median(depth).item()
+
+
+@pytest.mark.parametrize("numel, max_samples", [(1000, 100), (1001, 100), (1000, 333), (50, 100)])
+def test_approx_median_with_max_samples(numel, max_samples):
+    generator = torch.Generator().manual_seed(0)
+    x = torch.rand((numel,), generator=generator)
+    stride = math.ceil(numel / max_samples) if numel > max_samples else 1
+    subset = x[::stride]
+    assert subset.numel() <= max_samples
+    assert approx_median(x, max_samples=max_samples).item() == torch.median(subset).item()
+    # No subsampling if there are at most max_samples elements
+    assert approx_median(x, max_samples=numel).item() == torch.median(x).item()
@@ -0,0 +1,65 @@
+"""Parity of the separable SSIM of utils/slam_external.py with the 2D window SSIM of utils/gs_external.py."""
+
+import pytest
+import torch
+
+from utils import gs_external, slam_external
+
+# Both windows are built in float32 (the 2D window of gs_external is the float32 outer product of the 1D window), so
+# the float64 SSIMs only agree up to the rounding of the window
+TOLERANCES = {
+    torch.float32: dict(rtol=1e-4, atol=1e-6),
+    torch.float64: dict(rtol=1e-7, atol=1e-9),
+}
+
+
+def _images(shape, dtype, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    img1 = torch.rand(shape, generator=generator, dtype=dtype)
+    # Correlated second image, so that the SSIM isn't close to 0
+    img2 = (0.7 * img1 + 0.3 * torch.rand(shape, generator=generator, dtype=dtype)).clamp(0, 1)
+    return img1, img2
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+@pytest.mark.parametrize("shape", [(3, 32, 48), (1, 17, 23), (2, 3, 40, 31)])
+@pytest.mark.parametrize("window_size", [11, 7])
+def test_ssim_matches_2d_window(shape, dtype, window_size):
+    img1, img2 = _images(shape, dtype)
+    ref = gs_external.calc_ssim(img1, img2, window_size=window_size)
+    ssim = slam_external.calc_ssim(img1, img2, window_size=window_size)
+    assert ssim.dtype == dtype
+    torch.testing.assert_close(ssim, ref, **TOLERANCES[dtype])
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+def test_ssim_per_image_matches_2d_window(dtype):
+    img1, img2 = _images((4, 3, 24, 20), dtype, seed=1)
+    ref = gs_external.calc_ssim(img1, img2, size_average=False)
+    ssim = slam_external.calc_ssim(img1, img2, size_average=False)
+    assert ssim.shape == (4,)
+    torch.testing.assert_close(ssim, ref, **TOLERANCES[dtype])
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+@pytest.mark.parametrize("shape", [(3, 32, 48), (1, 17, 23)])
+def test_ssim_gradients_match_2d_window(shape, dtype):
+    img1, img2 = _images(shape, dtype, seed=2)
+    grads = []
+    for calc_ssim in [gs_external.calc_ssim, slam_external.calc_ssim]:
+        im = img1.clone().requires_grad_(True)
+        gt_im = img2.clone().requires_grad_(True)
+        # Photometric mapping loss of get_loss
+        loss = 0.8 * torch.abs(gt_im - im).mean() + 0.2 * (1.0 - calc_ssim(im, gt_im))
+        loss.backward()
+        grads.append((im.grad, gt_im.grad))
+    for grad, ref in zip(grads[1], grads[0]):
+        torch.testing.assert_close(grad, ref, **TOLERANCES[dtype])
+
+
+def test_separable_windows_are_cached_per_dtype():
+    window_f32 = slam_external.get_separable_window(11, 15, 'cpu', torch.float32)
+    assert slam_external.get_separable_window(11, 15, 'cpu', torch.float32) is window_f32
+    window_f64 = slam_external.get_separable_window(11, 15, 'cpu', torch.float64)
+    assert window_f64[0].dtype == torch.float64
+    torch.testing.assert_close(window_f64[0].float(), window_f32[0])
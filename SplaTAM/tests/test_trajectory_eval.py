@@ -0,0 +1,197 @@
+"""Trajectory alignment, ATE & RPE of utils/trajectory_eval.py on synthetic trajectories with known errors."""
+
+import numpy as np
+import pytest
+import torch
+
+from utils.trajectory_eval import (
+    OnlineATEEstimator, compute_ate, compute_rpe, evaluate_trajectory, invert_poses, umeyama_alignment
+)
+
+
+def _rotation(axis_angle):
+    """Rotation matrix of an axis-angle vector (Rodrigues' formula)."""
+    angle = np.linalg.norm(axis_angle)
+    if angle == 0:
+        return np.eye(3)
+    k = axis_angle / angle
+    K = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * K @ K
+
+
+def _pose(axis_angle, trans):
+    pose = np.eye(4)
+    pose[:3, :3] = _rotation(np.asarray(axis_angle, dtype=np.float64))
+    pose[:3, 3] = trans
+    return pose
+
+
+def _trajectory(num_frames, seed=0):
+    """(N, 4, 4) camera-to-world poses along a smooth random path."""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(scale=0.05, size=(num_frames, 6))
+    poses = [np.eye(4)]
+    for step in steps[1:]:
+        poses.append(poses[-1] @ _pose(step[:3], step[3:]))
+    return np.stack(poses)
+
+
+def test_umeyama_recovers_se3():
+    rng = np.random.default_rng(0)
+    model = rng.normal(size=(50, 3))
+    rot = _rotation(np.array([0.3, -1.2, 0.5]))
+    trans = np.array([1.0, -2.0, 0.5])
+    data = model @ rot.T + trans
+    est_rot, est_trans, scale = umeyama_alignment(model, data)
+    np.testing.assert_allclose(est_rot, rot, atol=1e-10)
+    np.testing.assert_allclose(est_trans, trans, atol=1e-10)
+    assert scale == 1.0
+
+
+def test_umeyama_recovers_sim3():
+    rng = np.random.default_rng(1)
+    model = rng.normal(size=(50, 3))
+    rot = _rotation(np.array([-2.0, 0.1, 0.7]))
+    trans = np.array([0.2, 0.3, -4.0])
+    data = 2.5 * model @ rot.T + trans
+    est_rot, est_trans, scale = umeyama_alignment(model, data, with_scale=True)
+    np.testing.assert_allclose(est_rot, rot, atol=1e-10)
+    np.testing.assert_allclose(est_trans, trans, atol=1e-10)
+    assert scale == pytest.approx(2.5)
+
+
+def test_umeyama_returns_proper_rotation_for_reflections():
+    rng = np.random.default_rng(2)
+    model = rng.normal(size=(30, 3))
+    # A reflected point set can't be aligned by a rotation, but the result must still be a rotation
+    data = model * np.array([1.0, 1.0, -1.0])
+    rot, _, _ = umeyama_alignment(model, data)
+    np.testing.assert_allclose(rot @ rot.T, np.eye(3), atol=1e-10)
+    assert np.linalg.det(rot) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("with_scale", [False, True])
+def test_ate_and_rpe_vanish_for_transformed_trajectory(with_scale):
+    gt_poses = _trajectory(40)
+    # Same trajectory expressed in another world frame (and at another scale for Sim(3))
+    transform = _pose([0.4, 0.2, -0.9], [3.0, -1.0, 2.0])
+    est_poses = transform @ gt_poses
+    if with_scale:
+        est_poses[:, :3, 3] *= 0.5
+    metrics = evaluate_trajectory(gt_poses, est_poses, rpe_deltas=(1, 5), with_scale=with_scale)
+    assert metrics['ate']['rmse'] == pytest.approx(0.0, abs=1e-9)
+    assert metrics['ate']['max'] == pytest.approx(0.0, abs=1e-9)
+    if with_scale:
+        assert metrics['alignment']['scale'] == pytest.approx(2.0)
+    for delta in [1, 5]:
+        assert metrics['rpe'][delta]['trans']['max'] == pytest.approx(0.0, abs=1e-9)
+        assert metrics['rpe'][delta]['rot']['max'] == pytest.approx(0.0, abs=1e-5)
+        assert metrics['rpe_errors'][delta]['trans'].shape == (40 - delta,)
+
+
+def test_rpe_of_perturbed_trajectory():
+    gt_poses = _trajectory(20, seed=3)
+    est_poses = gt_poses.copy()
+    # Offset of 2 cm (in the camera frame) of a single pose
+    offset = np.array([0.0, 0.02, 0.0])
+    est_poses[10] = est_poses[10] @ _pose([0.0, 0.0, 0.0], offset)
+    trans_errors, rot_errors = compute_rpe(gt_poses, est_poses, delta=1)
+    # Only the relative motions into & out of the perturbed pose are off, by the norm of the offset
+    expected = np.zeros(19)
+    expected[[9, 10]] = 0.02
+    np.testing.assert_allclose(trans_errors, expected, atol=1e-10)
+    np.testing.assert_allclose(rot_errors, 0.0, atol=1e-5)
+    # The motion over 2 frames skips the perturbed pose when starting right before it
+    trans_errors, _ = compute_rpe(gt_poses, est_poses, delta=2)
+    expected = np.zeros(18)
+    expected[[8, 10]] = 0.02
+    np.testing.assert_allclose(trans_errors, expected, atol=1e-10)
+
+
+def test_rpe_of_rotated_pose():
+    gt_poses = _trajectory(10, seed=4)
+    est_poses = gt_poses.copy()
+    est_poses[5] = est_poses[5] @ _pose([0.0, 0.0, np.radians(3.0)], [0.0, 0.0, 0.0])
+    _, rot_errors = compute_rpe(gt_poses, est_poses, delta=1)
+    np.testing.assert_allclose(rot_errors[[4, 5]], 3.0, atol=1e-6)
+    np.testing.assert_allclose(np.delete(rot_errors, [4, 5]), 0.0, atol=1e-5)
+
+
+def test_rpe_out_of_range_delta():
+    poses = _trajectory(5)
+    for delta in [0, 5, 10]:
+        trans_errors, rot_errors = compute_rpe(poses, poses, delta=delta)
+        assert trans_errors.shape == (0,) and rot_errors.shape == (0,)
+    metrics = evaluate_trajectory(poses, poses, rpe_deltas=(10,))
+    assert np.isnan(metrics['rpe'][10]['trans']['rmse'])
+
+
+def test_evaluate_trajectory_shape_mismatch():
+    with pytest.raises(ValueError):
+        evaluate_trajectory(_trajectory(5), _trajectory(6))
+
+
+def _noisy_trajectory(num_frames, seed):
+    gt_c2ws = _trajectory(num_frames, seed=seed)
+    rng = np.random.default_rng(seed + 100)
+    est_c2ws = _pose([0.1, -0.3, 0.2], [0.5, 0.1, -0.2]) @ gt_c2ws
+    est_c2ws[:, :3, 3] += rng.normal(scale=0.01, size=(num_frames, 3))
+    return gt_c2ws, est_c2ws
+
+
+@pytest.mark.parametrize("with_scale", [False, True])
+def test_online_ate_matches_batch_ate(with_scale):
+    gt_c2ws, est_c2ws = _noisy_trajectory(60, seed=5)
+    if with_scale:
+        est_c2ws[:, :3, 3] *= 1.7
+    gt_w2cs, est_w2cs = invert_poses(gt_c2ws), invert_poses(est_c2ws)
+    estimator = OnlineATEEstimator(with_scale=with_scale)
+    for idx in range(60):
+        estimator.update(gt_w2cs[idx], est_w2cs[idx])
+        if idx + 1 in [3, 10, 30, 60]:
+            errors, alignment = compute_ate(gt_c2ws[:idx + 1], est_c2ws[:idx + 1], with_scale=with_scale)
+            assert estimator.rmse() == pytest.approx(np.sqrt(np.mean(errors ** 2)), rel=1e-6, abs=1e-10)
+            assert estimator.last_error() == pytest.approx(errors[-1], rel=1e-6, abs=1e-10)
+            rot, trans, scale, _ = estimator.alignment()
+            np.testing.assert_allclose(rot, alignment['rot'], atol=1e-8)
+            np.testing.assert_allclose(trans, alignment['trans'], atol=1e-8)
+            assert scale == pytest.approx(alignment['scale'])
+
+
+def test_online_ate_accepts_tensors_and_skips_invalid_poses():
+    gt_c2ws, est_c2ws = _noisy_trajectory(20, seed=6)
+    gt_w2cs, est_w2cs = invert_poses(gt_c2ws), invert_poses(est_c2ws)
+    estimator = OnlineATEEstimator()
+    assert np.isnan(estimator.rmse())
+    valid = np.ones(20, dtype=bool)
+    valid[[4, 11]] = False
+    for idx in range(20):
+        gt_w2c = torch.from_numpy(gt_w2cs[idx]).float()
+        if idx == 4:
+            # Invalid ground truth pose (like the -inf poses of ScanNet)
+            gt_w2c = torch.full((4, 4), -float('inf'))
+        est_w2c = torch.from_numpy(est_w2cs[idx]).float()
+        if idx == 11:
+            est_w2c[0, 3] = float('nan')
+        assert estimator.update(gt_w2c, est_w2c) is False
+        if idx == 0:
+            assert np.isnan(estimator.rmse())
+            assert "n/a" in estimator.summary()
+    assert estimator.num_frames == 18
+    assert estimator.num_skipped == 2
+    errors, _ = compute_ate(gt_c2ws[valid], est_c2ws[valid])
+    assert estimator.rmse() == pytest.approx(np.sqrt(np.mean(errors ** 2)), rel=1e-4)
+    assert "Skipped 2 frames" in estimator.summary()
+
+
+def test_online_ate_drift_alarm():
+    gt_c2ws = _trajectory(40, seed=7)
+    est_c2ws = gt_c2ws.copy()
+    # Estimate drifting away from frame 20 on
+    est_c2ws[20:, :3, 3] += np.linspace(0, 1.0, 20)[:, None] * np.array([1.0, 0.0, 0.0])
+    estimator = OnlineATEEstimator(drift_threshold=0.05, min_frames=5)
+    alarms = [estimator.update(gt, est) for gt, est in zip(invert_poses(gt_c2ws), invert_poses(est_c2ws))]
+    assert not any(alarms[:20])
+    # Raised once when the RMSE crosses the threshold, not again while it stays above it
+    assert sum(alarms) == 1
+    assert estimator.num_alarms == 1 and estimator.alarm_active
@@ -1,10 +1,12 @@
 import cv2
 import os
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import torch.nn.functional as F
 from tqdm import tqdm
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 from datasets.gradslam_datasets.geometryutils import relative_transformation
 from utils.recon_helpers import setup_camera
@@ -13,13 +15,13 @@ from utils.slam_helpers import (
     transform_to_frame, transformed_params2rendervar, transformed_params2depthplussilhouette,
     quat_mult, matrix_to_quaternion
 )
+from utils.metrics import get_metric
+from utils.trajectory_eval import (
+    umeyama_alignment, evaluate_trajectory, print_trajectory_metrics, save_trajectory_metrics
+)
 
 from diff_gaussian_rasterization import GaussianRasterizer as Renderer
 
-from pytorch_msssim import ms_ssim
-from torchmetrics.image.lpip import LearnedPerceptualImagePatchSimilarity
-loss_fn_alex = LearnedPerceptualImagePatchSimilarity(net_type='alex', normalize=True).cuda()
-
 def align(model, data):
     """Align two trajectories using the method of Horn (closed-form).
 
@@ -33,26 +35,13 @@ def align(model, data):
         trans_error -- translational error per point (1xn)
 
     """
-    np.set_printoptions(precision=3, suppress=True)
-    model_zerocentered = model - model.mean(1).reshape((3,-1))
-    data_zerocentered = data - data.mean(1).reshape((3,-1))
-
-    W = np.zeros((3, 3))
-    for column in range(model.shape[1]):
-        W += np.outer(model_zerocentered[:,
-                         column], data_zerocentered[:, column])
-    U, d, Vh = np.linalg.linalg.svd(W.transpose())
-    S = np.matrix(np.identity(3))
-    if (np.linalg.det(U) * np.linalg.det(Vh) < 0):
-        S[2, 2] = -1
-    rot = U*S*Vh
-    trans = data.mean(1).reshape((3,-1)) - rot * model.mean(1).reshape((3,-1))
-
-    model_aligned = rot * model + trans
+    rot, trans, _ = umeyama_alignment(model.T, data.T)
+    trans = trans.reshape((3,-1))
+
+    model_aligned = rot @ model + trans
     alignment_error = model_aligned - data
 
-    trans_error = np.sqrt(np.sum(np.multiply(
-        alignment_error, alignment_error), 0)).A[0]
+    trans_error = np.linalg.norm(alignment_error, axis=0)
 
     return rot, trans, trans_error
 
@@ -60,15 +49,17 @@ def align(model, data):
 def evaluate_ate(gt_traj, est_traj):
     """
     Input : 
-        gt_traj: list of 4x4 matrices 
-        est_traj: list of 4x4 matrices
+        gt_traj: list of 4x4 matrices (or stacked Nx4x4 tensor)
+        est_traj: list of 4x4 matrices (or stacked Nx4x4 tensor)
         len(gt_traj) == len(est_traj)
     """
-    gt_traj_pts = [gt_traj[idx][:3,3] for idx in range(len(gt_traj))]
-    est_traj_pts = [est_traj[idx][:3,3] for idx in range(len(est_traj))]
+    if isinstance(gt_traj, (list, tuple)):
+        gt_traj = torch.stack(gt_traj)
+    if isinstance(est_traj, (list, tuple)):
+        est_traj = torch.stack(est_traj)
 
-    gt_traj_pts  = torch.stack(gt_traj_pts).detach().cpu().numpy().T
-    est_traj_pts = torch.stack(est_traj_pts).detach().cpu().numpy().T
+    gt_traj_pts  = gt_traj[:, :3, 3].detach().cpu().numpy().T
+    est_traj_pts = est_traj[:, :3, 3].detach().cpu().numpy().T
 
     _, _, trans_error = align(gt_traj_pts, est_traj_pts)
 
@@ -77,6 +68,31 @@ def evaluate_ate(gt_traj, est_traj):
     return avg_trans_error
 
 
+def get_trajectory_w2cs(params, num_frames):
+    """
+    Build the estimated world-to-camera poses of the first num_frames time steps at once.
+
+    Returns:
+        w2cs: (num_frames, 4, 4) tensor
+    """
+    cam_rots = F.normalize(params['cam_unnorm_rots'][0, :, :num_frames].detach().T)
+    cam_trans = params['cam_trans'][0, :, :num_frames].detach().T
+    w2cs = torch.eye(4, device=cam_rots.device).float().repeat(num_frames, 1, 1)
+    w2cs[:, :3, :3] = build_rotation(cam_rots)
+    w2cs[:, :3, 3] = cam_trans
+    return w2cs
+
+
+def get_estimated_w2c(params, time_idx):
+    """Estimated 4x4 world-to-camera pose of a single time step."""
+    cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
+    cam_tran = params['cam_trans'][..., time_idx].detach()
+    w2c = torch.eye(4, device=cam_rot.device).float()
+    w2c[:3, :3] = build_rotation(cam_rot)
+    w2c[:3, 3] = cam_tran
+    return w2c
+
+
 def report_loss(losses, wandb_run, wandb_step, tracking=False, mapping=False):
     # Update loss dict
     loss_dict = {'Loss': losses['loss'].item(),
@@ -106,16 +122,16 @@ def report_loss(losses, wandb_run, wandb_step, tracking=False, mapping=False):
     return wandb_step
         
 
-def plot_rgbd_silhouette(color, depth, rastered_color, rastered_depth, presence_sil_mask, diff_depth_l1,
-                         psnr, depth_l1, fig_title, plot_dir=None, plot_name=None, 
-                         save_plot=False, wandb_run=None, wandb_step=None, wandb_title=None, diff_rgb=None):
+def draw_rgbd_silhouette(fig, color, depth, rastered_color, rastered_depth, presence_sil_mask, diff_depth_l1,
+                         psnr, depth_l1, fig_title, diff_rgb=None):
     # Determine Plot Aspect Ratio
     aspect_ratio = color.shape[2] / color.shape[1]
     fig_height = 8
     fig_width = 14/1.55
     fig_width = fig_width * aspect_ratio
     # Plot the Ground Truth and Rasterized RGB & Depth, along with Diff Depth & Silhouette
-    fig, axs = plt.subplots(2, 3, figsize=(fig_width, fig_height))
+    fig.set_size_inches(fig_width, fig_height)
+    axs = fig.subplots(2, 3)
     axs[0, 0].imshow(color.cpu().permute(1, 2, 0))
     axs[0, 0].set_title("Ground Truth RGB")
     axs[0, 1].imshow(depth[0, :, :].cpu(), cmap='jet', vmin=0, vmax=6)
@@ -138,15 +154,60 @@ def plot_rgbd_silhouette(color, depth, rastered_color, rastered_depth, presence_
         ax.axis('off')
     fig.suptitle(fig_title, y=0.95, fontsize=16)
     fig.tight_layout()
+
+
+def plot_rgbd_silhouette(color, depth, rastered_color, rastered_depth, presence_sil_mask, diff_depth_l1,
+                         psnr, depth_l1, fig_title, plot_dir=None, plot_name=None, 
+                         save_plot=False, wandb_run=None, wandb_step=None, wandb_title=None, diff_rgb=None):
+    fig = plt.figure()
+    draw_rgbd_silhouette(fig, color, depth, rastered_color, rastered_depth, presence_sil_mask, diff_depth_l1,
+                         psnr, depth_l1, fig_title, diff_rgb=diff_rgb)
     if save_plot:
         save_path = os.path.join(plot_dir, f"{plot_name}.png")
-        plt.savefig(save_path, bbox_inches='tight')
+        fig.savefig(save_path, bbox_inches='tight')
     if wandb_run is not None:
         if wandb_step is None:
             wandb_run.log({wandb_title: fig})
         else:
             wandb_run.log({wandb_title: fig}, step=wandb_step)
-    plt.close()
+    plt.close(fig)
+
+
+def save_rgbd_silhouette_plot(save_path, color, depth, rastered_color, rastered_depth, presence_sil_mask, diff_depth_l1,
+                              psnr, depth_l1, fig_title):
+    """
+    Thread-safe variant of plot_rgbd_silhouette for saving plots in the background.
+    Uses the matplotlib Figure API directly instead of the (global state) pyplot interface.
+    """
+    fig = Figure()
+    draw_rgbd_silhouette(fig, color, depth, rastered_color, rastered_depth, presence_sil_mask, diff_depth_l1,
+                         psnr, depth_l1, fig_title)
+    fig.savefig(save_path, bbox_inches='tight')
+
+
+def compute_image_metrics(ims, gt_ims):
+    """
+    Compute PSNR, MS-SSIM & LPIPS for a batch of rendered & ground truth images on their device.
+
+    Args:
+        ims (torch.Tensor): Rendered images of shape (B, 3, H, W)
+        gt_ims (torch.Tensor): Ground truth images of shape (B, 3, H, W)
+
+    Returns:
+        psnr (torch.Tensor): PSNR of every image of shape (B,)
+        ssim (torch.Tensor): MS-SSIM of every image of shape (B,)
+        lpips (torch.Tensor): LPIPS of every image of shape (B,)
+    """
+    ms_ssim = get_metric('ms_ssim')
+    loss_fn_alex = get_metric('lpips_per_image')
+    num_ims = ims.shape[0]
+    # PSNR is averaged over the channels of each image (as calc_psnr does for a single (3, H, W) image)
+    psnr = calc_psnr(ims.flatten(0, 1), gt_ims.flatten(0, 1)).view(num_ims, -1).mean(1)
+    ssim = ms_ssim(ims, gt_ims, data_range=1.0, size_average=False)
+    # Per-image LPIPS scores (instead of the batch mean of the torchmetrics metric), inputs in [0, 1]
+    with torch.no_grad():
+        lpips = loss_fn_alex(torch.clamp(ims, 0.0, 1.0), torch.clamp(gt_ims, 0.0, 1.0), normalize=True)
+    return psnr, ssim, lpips.view(num_ims)
 
 
 def report_progress(params, data, i, progress_bar, iter_time_idx, sil_thres, every_i=1, qual_every_i=1, 
@@ -406,7 +467,17 @@ def eval_online(dataset, all_params, num_frames, eval_online_dir, sil_thres,
 
 
 def eval(dataset, final_params, num_frames, eval_dir, sil_thres, 
-         mapping_iters, add_new_gaussians, wandb_run=None, wandb_save_qual=False, eval_every=1, save_frames=False):
+         mapping_iters, add_new_gaussians, wandb_run=None, wandb_save_qual=False, eval_every=1, save_frames=False,
+         eval_batch_size=8, save_plots=True, async_plots=False, rpe_deltas=(1,)):
+    """
+    Evaluate the final parameters on every eval_every-th frame of the dataset.
+
+    Frames are rendered one at a time, but the image metrics are computed for batches of eval_batch_size frames.
+    All per-frame metrics stay on the device & are only copied to the CPU once at the end.
+    Per-frame plots are skipped if save_plots is False (unless logged to wandb), and are saved by a
+    background thread if async_plots is True.
+    The trajectory is evaluated with the ATE & the RPE over every frame offset in rpe_deltas.
+    """
     print("Evaluating Final Parameters ...")
     psnr_list = []
     rmse_list = []
@@ -415,6 +486,7 @@ def eval(dataset, final_params, num_frames, eval_dir, sil_thres,
     ssim_list = []
     plot_dir = os.path.join(eval_dir, "plots")
     os.makedirs(plot_dir, exist_ok=True)
+    plot_executor = ThreadPoolExecutor(max_workers=1) if (save_plots and async_plots) else None
     if save_frames:
         render_rgb_dir = os.path.join(eval_dir, "rendered_rgb")
         os.makedirs(render_rgb_dir, exist_ok=True)
@@ -425,6 +497,33 @@ def eval(dataset, final_params, num_frames, eval_dir, sil_thres,
         depth_dir = os.path.join(eval_dir, "depth")
         os.makedirs(depth_dir, exist_ok=True)
 
+    # Rendered & ground truth images (and data for plotting) waiting for their metrics to be computed
+    batch_ims, batch_gt_ims, batch_plots = [], [], []
+
+    def flush_batch():
+        # Compute the image metrics for the current batch of frames on the device
+        psnr, ssim, lpips_score = compute_image_metrics(torch.stack(batch_ims), torch.stack(batch_gt_ims))
+        psnr_list.append(psnr)
+        ssim_list.append(ssim)
+        lpips_list.append(lpips_score)
+        # Plot the Ground Truth and Rasterized RGB & Depth, along with Silhouette
+        for plot_idx, plot_data in enumerate(batch_plots):
+            fig_title = "Time Step: {}".format(plot_data['time_idx'])
+            plot_name = "%04d" % plot_data['time_idx']
+            plot_args = [plot_data[k].detach().cpu() for k in ['color', 'depth', 'im', 'rastered_depth_viz']]
+            plot_args += [plot_data['presence_sil_mask'].detach().cpu().numpy(), plot_data['diff_depth_l1'].detach().cpu(),
+                          psnr[plot_data['batch_idx']].item(), plot_data['depth_l1'].item(), fig_title]
+            if wandb_run is not None:
+                plot_rgbd_silhouette(*plot_args, plot_dir, plot_name=plot_name, save_plot=True,
+                                     wandb_run=wandb_run, wandb_step=None, wandb_title="Eval/Qual Viz")
+            elif plot_executor is not None:
+                plot_executor.submit(save_rgbd_silhouette_plot, os.path.join(plot_dir, f"{plot_name}.png"), *plot_args)
+            else:
+                plot_rgbd_silhouette(*plot_args, plot_dir, plot_name=plot_name, save_plot=True)
+        batch_ims.clear()
+        batch_gt_ims.clear()
+        batch_plots.clear()
+
     gt_w2c_list = []
     for time_idx in tqdm(range(num_frames)):
          # Get RGB-D Data & Camera Parameters
@@ -478,15 +577,8 @@ def eval(dataset, final_params, num_frames, eval_dir, sil_thres,
         else:
             weighted_im = im * valid_depth_mask
             weighted_gt_im = curr_data['im'] * valid_depth_mask
-        psnr = calc_psnr(weighted_im, weighted_gt_im).mean()
-        ssim = ms_ssim(weighted_im.unsqueeze(0).cpu(), weighted_gt_im.unsqueeze(0).cpu(), 
-                        data_range=1.0, size_average=True)
-        lpips_score = loss_fn_alex(torch.clamp(weighted_im.unsqueeze(0), 0.0, 1.0),
-                                    torch.clamp(weighted_gt_im.unsqueeze(0), 0.0, 1.0)).item()
-
-        psnr_list.append(psnr.cpu().numpy())
-        ssim_list.append(ssim.cpu().numpy())
-        lpips_list.append(lpips_score)
+        batch_ims.append(weighted_im)
+        batch_gt_ims.append(weighted_gt_im)
 
         # Compute Depth RMSE
         if mapping_iters==0 and not add_new_gaussians:
@@ -503,8 +595,8 @@ def eval(dataset, final_params, num_frames, eval_dir, sil_thres,
             diff_depth_l1 = torch.abs((rastered_depth - curr_data['depth']))
             diff_depth_l1 = diff_depth_l1 * valid_depth_mask
             depth_l1 = diff_depth_l1.sum() / valid_depth_mask.sum()
-        rmse_list.append(rmse.cpu().numpy())
-        l1_list.append(depth_l1.cpu().numpy())
+        rmse_list.append(rmse)
+        l1_list.append(depth_l1)
 
         if save_frames:
             # Save Rendered RGB and Depth
@@ -526,53 +618,67 @@ def eval(dataset, final_params, num_frames, eval_dir, sil_thres,
             depth_colormap = cv2.applyColorMap((normalized_depth * 255).astype(np.uint8), cv2.COLORMAP_JET)
             cv2.imwrite(os.path.join(rgb_dir, "gt_{:04d}.png".format(time_idx)), cv2.cvtColor(viz_gt_im*255, cv2.COLOR_RGB2BGR))
             cv2.imwrite(os.path.join(depth_dir, "gt_{:04d}.png".format(time_idx)), depth_colormap)
-        
-        # Plot the Ground Truth and Rasterized RGB & Depth, along with Silhouette
-        fig_title = "Time Step: {}".format(time_idx)
-        plot_name = "%04d" % time_idx
-        presence_sil_mask = presence_sil_mask.detach().cpu().numpy()
-        if wandb_run is None:
-            plot_rgbd_silhouette(color, depth, im, rastered_depth_viz, presence_sil_mask, diff_depth_l1,
-                                 psnr, depth_l1, fig_title, plot_dir, 
-                                 plot_name=plot_name, save_plot=True)
-        elif wandb_save_qual:
-            plot_rgbd_silhouette(color, depth, im, rastered_depth_viz, presence_sil_mask, diff_depth_l1,
-                                 psnr, depth_l1, fig_title, plot_dir, 
-                                 plot_name=plot_name, save_plot=True,
-                                 wandb_run=wandb_run, wandb_step=None, 
-                                 wandb_title="Eval/Qual Viz")
+
+        # Keep the data for plotting until the metrics of the batch are computed
+        if (wandb_run is None and save_plots) or (wandb_run is not None and wandb_save_qual):
+            batch_plots.append({'time_idx': time_idx, 'batch_idx': len(batch_ims)-1, 'color': color, 'depth': depth,
+                                'im': im, 'rastered_depth_viz': rastered_depth_viz,
+                                'presence_sil_mask': presence_sil_mask, 'diff_depth_l1': diff_depth_l1,
+                                'depth_l1': depth_l1})
+
+        if len(batch_ims) == eval_batch_size:
+            flush_batch()
+
+    if len(batch_ims) > 0:
+        flush_batch()
+    if plot_executor is not None:
+        plot_executor.shutdown(wait=True)
+
+    # Copy all the per-frame metrics to the CPU at once
+    psnr_list = torch.cat(psnr_list).cpu().numpy()
+    ssim_list = torch.cat(ssim_list).cpu().numpy()
+    lpips_list = torch.cat(lpips_list).cpu().numpy()
+    rmse_list = torch.stack(rmse_list).cpu().numpy()
+    l1_list = torch.stack(l1_list).cpu().numpy()
 
     try:
         # Compute the final ATE RMSE
         # Get the final camera trajectory
-        num_frames = final_params['cam_unnorm_rots'].shape[-1]
-        latest_est_w2c = first_frame_w2c
-        latest_est_w2c_list = []
-        latest_est_w2c_list.append(latest_est_w2c)
-        valid_gt_w2c_list = []
-        valid_gt_w2c_list.append(gt_w2c_list[0])
-        for idx in range(1, num_frames):
-            # Check if gt pose is not nan for this time step
-            if torch.isnan(gt_w2c_list[idx]).sum() > 0:
-                continue
-            interm_cam_rot = F.normalize(final_params['cam_unnorm_rots'][..., idx].detach())
-            interm_cam_trans = final_params['cam_trans'][..., idx].detach()
-            intermrel_w2c = torch.eye(4).cuda().float()
-            intermrel_w2c[:3, :3] = build_rotation(interm_cam_rot)
-            intermrel_w2c[:3, 3] = interm_cam_trans
-            latest_est_w2c = intermrel_w2c
-            latest_est_w2c_list.append(latest_est_w2c)
-            valid_gt_w2c_list.append(gt_w2c_list[idx])
-        gt_w2c_list = valid_gt_w2c_list
+        num_frames = min(final_params['cam_unnorm_rots'].shape[-1], len(gt_w2c_list))
+        est_w2cs = get_trajectory_w2cs(final_params, num_frames)
+        est_w2cs[0] = first_frame_w2c
+        gt_w2cs = torch.stack(gt_w2c_list[:num_frames]).to(est_w2cs.device)
+        # Skip the time steps where the gt pose is nan
+        valid_mask = ~torch.isnan(gt_w2cs).flatten(1).any(dim=1)
+        valid_mask[0] = True
+        gt_w2cs = gt_w2cs[valid_mask]
+        est_w2cs = est_w2cs[valid_mask]
         # Calculate ATE RMSE
-        ate_rmse = evaluate_ate(gt_w2c_list, latest_est_w2c_list)
+        ate_rmse = evaluate_ate(gt_w2cs, est_w2cs)
         print("Final Average ATE RMSE: {:.2f} cm".format(ate_rmse*100))
         if wandb_run is not None:
             wandb_run.log({"Final Stats/Avg ATE RMSE": ate_rmse,
                         "Final Stats/step": 1})
     except:
         ate_rmse = 100.0
+        gt_w2cs = None
         print('Failed to evaluate trajectory with alignment.')
+
+    # The ATE statistics & RPE are reported separately, so that a failure there doesn't discard the ATE RMSE
+    if gt_w2cs is not None:
+        try:
+            # Calculate the ATE statistics & RPE on the camera-to-world poses
+            traj_metrics = evaluate_trajectory(torch.linalg.inv(gt_w2cs).cpu().numpy(),
+                                               torch.linalg.inv(est_w2cs).cpu().numpy(), rpe_deltas=rpe_deltas)
+            print_trajectory_metrics(traj_metrics)
+            save_trajectory_metrics(traj_metrics, eval_dir)
+            if wandb_run is not None:
+                wandb_run.log({"Final Stats/ATE RMSE": traj_metrics['ate']['rmse'],
+                            "Final Stats/ATE Median": traj_metrics['ate']['median'],
+                            "Final Stats/ATE Max": traj_metrics['ate']['max'],
+                            "Final Stats/step": 1})
+        except Exception as e:
+            print(f'Failed to evaluate the trajectory statistics & RPE: {e}')
     
     # Compute Average Metrics
     psnr_list = np.array(psnr_list)
@@ -626,6 +732,8 @@ def eval(dataset, final_params, num_frames, eval_dir, sil_thres,
 def eval_nvs(dataset, final_params, num_frames, eval_dir, sil_thres, 
          mapping_iters, add_new_gaussians, wandb_run=None, wandb_save_qual=False, eval_every=1, save_frames=False):
     print("Evaluating Final Parameters for Novel View Synthesis ...")
+    ms_ssim = get_metric('ms_ssim')
+    loss_fn_alex = get_metric('lpips')
     psnr_list = []
     rmse_list = []
     l1_list = []
@@ -0,0 +1,99 @@
+"""
+Memory budget for the number of Gaussians in the map.
+
+The map only grows through densification, so long captures eventually run out of GPU memory. When the map exceeds
+its budget (a maximum number of Gaussians and/or bytes), the Gaussians with the lowest contribution are evicted until
+the map is back at target_fraction of the budget (so that eviction doesn't have to run after every frame). With the
+'merge' policy, the near-duplicate Gaussians are first merged (see utils.gaussian_merge, with the settings of the
+budget's merge dict) & only the Gaussians still over the target are evicted.
+
+The contribution of a Gaussian is scored as opacity x projected area x recency:
+    - opacity: sigmoid of the logit opacity
+    - projected area: square of the max 2D radius (pixels) during the latest mapping (at least one pixel, since
+      Gaussians that were not rendered since the last densification have a radius of 0)
+    - recency: 0.5 ** (age / recency_half_life), with the age in frames since the Gaussian was added (timestep)
+"""
+
+import torch
+
+from utils.gaussian_merge import merge_duplicate_gaussians
+from utils.slam_external import remove_points
+
+# Bytes of optimizer state per parameter element (Adam keeps exp_avg & exp_avg_sq) plus the gradient
+_STATE_COPIES_PER_PARAM = 3
+
+
+def gaussian_memory_bytes(params, variables):
+    """Memory (bytes) used per Gaussian by its parameters, gradients, Adam state & per-Gaussian variables."""
+    num_pts = params['means3D'].shape[0]
+    num_bytes = 0
+    for k, v in params.items():
+        if k in ['cam_unnorm_rots', 'cam_trans']:
+            continue
+        num_bytes += (1 + _STATE_COPIES_PER_PARAM) * v[0].numel() * v.element_size()
+    for v in variables.values():
+        if torch.is_tensor(v) and v.dim() > 0 and v.shape[0] == num_pts:
+            num_bytes += v[0].numel() * v.element_size()
+    return num_bytes
+
+
+def get_max_gaussians(params, variables, budget_dict):
+    """Max number of Gaussians allowed by the budget (None if there is no limit)."""
+    max_gaussians = budget_dict.get('max_gaussians', None)
+    max_bytes = budget_dict.get('max_bytes', None)
+    if max_bytes is not None:
+        max_gaussians_from_bytes = int(max_bytes // gaussian_memory_bytes(params, variables))
+        max_gaussians = max_gaussians_from_bytes if max_gaussians is None else min(max_gaussians,
+                                                                                   max_gaussians_from_bytes)
+    return max_gaussians
+
+
+def contribution_scores(params, variables, time_idx, recency_half_life):
+    """Contribution score (opacity x projected area x recency) of every Gaussian."""
+    opacities = torch.sigmoid(params['logit_opacities'].detach()).squeeze(-1)
+    projected_areas = torch.clamp(variables['max_2D_radius'], min=1.0) ** 2
+    scores = opacities * projected_areas
+    if 'timestep' in variables.keys() and recency_half_life is not None:
+        ages = torch.clamp(time_idx - variables['timestep'], min=0)
+        scores = scores * torch.pow(0.5, ages / recency_half_life)
+    return scores
+
+
+def enforce_gaussian_budget(params, variables, optimizer, time_idx, budget_dict):
+    """
+    Evict the lowest contribution Gaussians if the map exceeds its budget.
+
+    Args:
+        params: dict of parameters.
+        variables: dict of per-Gaussian variables (max_2D_radius, timestep, ...).
+        optimizer: optimizer of the params (its state is pruned along with the Gaussians).
+        time_idx: current time step.
+        budget_dict: budget config with max_gaussians and/or max_bytes, policy ('drop' or 'merge'), target_fraction,
+                     recency_half_life & merge (settings of the merge policy).
+
+    Returns:
+        params, variables: updated parameters & variables.
+        num_evicted: number of evicted (or merged) Gaussians.
+    """
+    policy = budget_dict.get('policy', 'drop')
+    if policy not in ['drop', 'merge']:
+        raise ValueError(f"Unknown Gaussian budget policy {policy}")
+    max_gaussians = get_max_gaussians(params, variables, budget_dict)
+    num_pts = params['means3D'].shape[0]
+    if max_gaussians is None or num_pts <= max_gaussians:
+        return params, variables, 0
+
+    num_to_keep = int(max_gaussians * budget_dict.get('target_fraction', 0.9))
+    num_merged = 0
+    if policy == 'merge':
+        params, variables, num_merged = merge_duplicate_gaussians(params, variables, optimizer,
+                                                                  budget_dict.get('merge', {}))
+        num_pts = params['means3D'].shape[0]
+        if num_pts <= num_to_keep:
+            return params, variables, num_merged
+    scores = contribution_scores(params, variables, time_idx, budget_dict.get('recency_half_life', 100))
+    evict_idx = torch.topk(scores, num_pts - num_to_keep, largest=False, sorted=False).indices
+    to_remove = torch.zeros(num_pts, dtype=torch.bool, device=scores.device)
+    to_remove[evict_idx] = True
+    params, variables = remove_points(to_remove, params, variables, optimizer)
+    return params, variables, num_merged + int(evict_idx.shape[0])
@@ -0,0 +1,287 @@
+"""
+Level-of-detail (LOD) hierarchy of a Gaussian map.
+
+The bounding cube of the map is split into an octree of max_depth levels (level 0 is the whole cube, the cells of level
+d have an edge of size / 2^d). Every occupied cell is a node that stores the aggregate of the Gaussians it contains,
+from the opacity-weighted moments of the mixture (like utils.gaussian_merge):
+    - mean & covariance of the mixture (refit to an anisotropic Gaussian)
+    - opacity-weighted color
+    - opacity: sum(opacity^2) / sum(opacity), i.e. the opacity-weighted mean opacity (the nodes of a surface keep its
+      opacity instead of saturating like the opacity of a union)
+    - radius: of the bounding sphere of the 3-sigma ellipsoids of its Gaussians around the center of its cell
+    - spread: max distance of the centers of its Gaussians to the center of its cell (the detail lost by the aggregate)
+The nodes only keep sums of these moments, keyed by their Morton code, so that Gaussians can be inserted incrementally
+(new Gaussians outside the bounding cube are assigned to its boundary cells & only make their nodes' radius larger).
+Since the Gaussians are sorted by Morton code, the Gaussians of any node are contiguous.
+
+A cut for a camera is found top-down: a node is kept once its spread projects to at most pixel_error pixels (its
+aggregate is then indistinguishable from its Gaussians), refined into its children otherwise & replaced by its
+Gaussians at the deepest level. Nodes whose bounding sphere is outside the view frustum are skipped. The cut can be rendered like params.npz:
+    lod = GaussianLOD.from_params(dict(np.load("params.npz")), max_depth=12)
+    cut = lod.cut(w2c, intrinsics, height, width, pixel_error=1.0) # means3D, rgb_colors, unnorm_rotations, ...
+"""
+
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from utils.gaussian_merge import covariances_to_gaussians, gaussian_covariances
+from utils.spatial_hash import points_in_frustum
+
+# Up to 20 levels: the Morton codes of the deepest cells (3 bits per level) & the end of their ranges fit in an int64
+MAX_LOD_DEPTH = 20
+
+_GAUSSIAN_KEYS = ['means3D', 'rgb_colors', 'unnorm_rotations', 'logit_opacities', 'log_scales']
+# Sums of the moments of the nodes (weighted by opacity)
+_STAT_KEYS = ['w', 'ww', 'wx', 'wxx', 'wc']
+
+
+def morton_codes(coords, num_bits):
+    """(N,) int64 Morton codes of (N, 3) non-negative integer coordinates of num_bits bits (x is the highest bit)."""
+    coords = coords.long()
+    codes = torch.zeros(coords.shape[0], dtype=torch.long, device=coords.device)
+    for bit in range(num_bits):
+        for axis in range(3):
+            codes |= ((coords[:, axis] >> bit) & 1) << (3 * bit + 2 - axis)
+    return codes
+
+
+def morton_decode(codes, num_bits):
+    """(N, 3) integer coordinates of (N,) Morton codes of num_bits bits."""
+    coords = torch.zeros((codes.shape[0], 3), dtype=torch.long, device=codes.device)
+    for bit in range(num_bits):
+        for axis in range(3):
+            coords[:, axis] |= ((codes >> (3 * bit + 2 - axis)) & 1) << bit
+    return coords
+
+
+class GaussianLOD:
+    """
+    Octree of aggregated Gaussians over a map.
+
+    Args:
+        origin: (3,) min corner of the bounding cube.
+        size: edge length of the bounding cube.
+        max_depth: number of levels below the root (the deepest cells have an edge of size / 2^max_depth).
+        device: device of the hierarchy.
+    """
+    def __init__(self, origin, size, max_depth=12, device="cuda"):
+        if not 1 <= max_depth <= MAX_LOD_DEPTH:
+            raise ValueError(f"The LOD depth must be between 1 & {MAX_LOD_DEPTH}, got {max_depth}")
+        self.device = torch.device(device)
+        self.origin = torch.as_tensor(origin, dtype=torch.float, device=self.device)
+        self.size = float(size)
+        self.max_depth = max_depth
+        # Gaussians sorted by Morton code (anisotropic log scales) & their codes at the deepest level
+        self.gaussians = {k: torch.zeros((0, n), device=self.device)
+                          for k, n in zip(_GAUSSIAN_KEYS, [3, 3, 4, 1, 3])}
+        self.codes = torch.zeros(0, dtype=torch.long, device=self.device)
+        # Per level: sorted Morton codes of the nodes, sums of their moments & radii
+        self.levels = [self._empty_level() for _ in range(max_depth + 1)]
+        # Per level: aggregated Gaussians of the nodes (computed from the moments after every insert)
+        self.nodes = [None] * (max_depth + 1)
+
+    @classmethod
+    def from_params(cls, params, max_depth=12, padding=0.05, device="cuda"):
+        """Build the hierarchy of the Gaussians of a params dict (e.g. loaded from params.npz)."""
+        means = torch.as_tensor(np.asarray(params['means3D']), dtype=torch.float, device=device)
+        min_corner, max_corner = means.min(dim=0).values, means.max(dim=0).values
+        size = float((max_corner - min_corner).max()) * (1 + 2 * padding) + 1e-6
+        origin = (min_corner + max_corner) / 2 - size / 2
+        return cls(origin, size, max_depth=max_depth, device=device).insert(params)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @property
+    def num_nodes(self):
+        return sum(level['codes'].shape[0] for level in self.levels)
+
+    def _empty_level(self):
+        return {'codes': torch.zeros(0, dtype=torch.long, device=self.device),
+                'w': torch.zeros(0, device=self.device),
+                'ww': torch.zeros(0, device=self.device),
+                'wx': torch.zeros((0, 3), device=self.device),
+                'wxx': torch.zeros((0, 3, 3), device=self.device),
+                'wc': torch.zeros((0, 3), device=self.device),
+                'radius': torch.zeros(0, device=self.device),
+                'spread': torch.zeros(0, device=self.device)}
+
+    def cell_size(self, level):
+        return self.size / (2 ** level)
+
+    def cell_centers(self, codes, level):
+        """(N, 3) centers of the cells of Morton codes at a level."""
+        return self.origin + (morton_decode(codes, level).float() + 0.5) * self.cell_size(level)
+
+    def insert(self, params):
+        """Add the Gaussians of a params dict (means3D, rgb_colors, unnorm_rotations, logit_opacities & log_scales)."""
+        new = {k: torch.as_tensor(np.asarray(params[k]) if not torch.is_tensor(params[k]) else params[k].detach(),
+                                  dtype=torch.float, device=self.device) for k in _GAUSSIAN_KEYS}
+        if new['means3D'].shape[0] == 0:
+            return self
+        new['unnorm_rotations'] = F.normalize(new['unnorm_rotations'])
+        new['log_scales'] = new['log_scales'].expand(-1, 3).contiguous()
+        means = new['means3D']
+        coords = torch.floor((means - self.origin) / self.cell_size(self.max_depth)).long()
+        coords = coords.clamp(0, 2 ** self.max_depth - 1)
+        codes = morton_codes(coords, self.max_depth)
+
+        # Moments of the new Gaussians
+        opacities = torch.sigmoid(new['logit_opacities']).squeeze(-1).clamp(min=1e-6)
+        covs = gaussian_covariances(new['unnorm_rotations'], new['log_scales'])
+        stats = {'w': opacities,
+                 'ww': opacities ** 2,
+                 'wx': opacities[:, None] * means,
+                 'wxx': opacities[:, None, None] * (covs + means[:, :, None] * means[:, None, :]),
+                 'wc': opacities[:, None] * new['rgb_colors']}
+        extents = 3 * torch.exp(new['log_scales']).max(dim=1).values
+
+        for level in range(self.max_depth + 1):
+            level_codes = codes >> (3 * (self.max_depth - level))
+            old = self.levels[level]
+            num_old = old['codes'].shape[0]
+            merged_codes, inverse = torch.unique(torch.cat((old['codes'], level_codes)), return_inverse=True)
+            old_idx, new_idx = inverse[:num_old], inverse[num_old:]
+            updated = {'codes': merged_codes}
+            for k in _STAT_KEYS:
+                sums = torch.zeros((merged_codes.shape[0],) + stats[k].shape[1:], device=self.device)
+                sums.index_add_(0, old_idx, old[k])
+                updated[k] = sums.index_add_(0, new_idx, stats[k])
+            offsets = torch.norm(means - self.cell_centers(level_codes, level), dim=1)
+            for k, v in [('radius', offsets + extents), ('spread', offsets)]:
+                values = torch.zeros(merged_codes.shape[0], device=self.device).index_copy_(0, old_idx, old[k])
+                updated[k] = values.scatter_reduce_(0, new_idx, v, reduce="amax")
+            self.levels[level] = updated
+            self.nodes[level] = self._aggregate(updated)
+
+        # Keep the Gaussians sorted by Morton code
+        all_codes = torch.cat((self.codes, codes))
+        order = torch.argsort(all_codes, stable=True)
+        self.codes = all_codes[order]
+        self.gaussians = {k: torch.cat((self.gaussians[k], new[k]))[order] for k in _GAUSSIAN_KEYS}
+        return self
+
+    def _aggregate(self, level):
+        """Aggregated Gaussians of the nodes of a level from the sums of their moments."""
+        w = level['w']
+        means = level['wx'] / w[:, None]
+        covs = level['wxx'] / w[:, None, None] - means[:, :, None] * means[:, None, :]
+        covs = 0.5 * (covs + covs.transpose(1, 2))
+        rots, log_scales = covariances_to_gaussians(covs)
+        opacities = (level['ww'] / w).clamp(1e-4, 0.99)
+        return {'means3D': means,
+                'rgb_colors': level['wc'] / w[:, None],
+                'unnorm_rotations': rots,
+                'logit_opacities': torch.log(opacities / (1 - opacities))[:, None],
+                'log_scales': log_scales,
+                'covariances': covs}
+
+    def level_params(self, level):
+        """Aggregated Gaussians of all the nodes of a level (a uniform LOD, e.g. for export)."""
+        return {k: self.nodes[level][k] for k in _GAUSSIAN_KEYS}
+
+    def _children(self, codes, level):
+        """Indices (in level + 1) of the children of the nodes of codes at a level."""
+        child_codes = self.levels[level + 1]['codes']
+        starts = torch.searchsorted(child_codes, codes << 3)
+        ends = torch.searchsorted(child_codes, (codes + 1) << 3)
+        return _expand_ranges(starts, ends)
+
+    def _gaussians_of(self, codes, level):
+        """Indices (in the sorted Gaussians) of the Gaussians of the nodes of codes at a level."""
+        shift = 3 * (self.max_depth - level)
+        starts = torch.searchsorted(self.codes, codes << shift)
+        ends = torch.searchsorted(self.codes, (codes + 1) << shift)
+        return _expand_ranges(starts, ends)
+
+    def cut(self, w2c, intrinsics, height, width, pixel_error=1.0, near=0.01, far=100.0):
+        """
+        Aggregated Gaussians of the coarsest cut of the hierarchy with a projected error of at most pixel_error.
+
+        Args:
+            w2c: (4, 4) world-to-camera pose.
+            intrinsics: (3, 3) camera intrinsics.
+            height, width: image size.
+            pixel_error: max projected spread (pixels) of a node rendered as its aggregate.
+            near, far: depth range of the frustum.
+
+        Returns:
+            cut: dict of means3D, rgb_colors, unnorm_rotations, logit_opacities & log_scales (anisotropic) of the cut.
+        """
+        w2c = torch.as_tensor(w2c, dtype=torch.float, device=self.device)
+        intrinsics = torch.as_tensor(intrinsics, dtype=torch.float, device=self.device)[:3, :3]
+        focal = torch.max(intrinsics[0, 0], intrinsics[1, 1])
+        parts = {k: [] for k in _GAUSSIAN_KEYS}
+        active = torch.arange(self.levels[0]['codes'].shape[0], device=self.device)
+        for level in range(self.max_depth + 1):
+            if active.shape[0] == 0:
+                break
+            codes = self.levels[level]['codes'][active]
+            radius = self.levels[level]['radius'][active]
+            centers = self.cell_centers(codes, level)
+            visible = points_in_frustum(centers, w2c, intrinsics, height, width, near=near, far=far, margin=radius)
+            active, codes, centers, radius = active[visible], codes[visible], centers[visible], radius[visible]
+            spread = self.levels[level]['spread'][active]
+            # Closest depth of the Gaussians of the nodes (the nodes around the camera are always refined)
+            depths = centers @ w2c[2, :3] + w2c[2, 3] - spread
+            accepted = (depths > near) & (focal * spread <= pixel_error * depths)
+            for k in _GAUSSIAN_KEYS:
+                parts[k].append(self.nodes[level][k][active[accepted]])
+            if level == self.max_depth:
+                gaussian_idx = self._gaussians_of(codes[~accepted], level)
+                for k in _GAUSSIAN_KEYS:
+                    parts[k].append(self.gaussians[k][gaussian_idx])
+            else:
+                active = self._children(codes[~accepted], level)
+        return {k: torch.cat(v) for k, v in parts.items()}
+
+    def save(self, path):
+        """Save the hierarchy (the Gaussians & the moments of the nodes) to an npz file."""
+        data = {'origin': self.origin.cpu().numpy(), 'size': self.size, 'max_depth': self.max_depth,
+                'codes': self.codes.cpu().numpy()}
+        data.update({k: v.cpu().numpy() for k, v in self.gaussians.items()})
+        for level_idx, level in enumerate(self.levels):
+            data.update({f'level_{level_idx}_{k}': v.cpu().numpy() for k, v in level.items()})
+        np.savez(path, **data)
+
+    @classmethod
+    def load(cls, path, device="cuda"):
+        """Load a hierarchy saved with save."""
+        data = np.load(path)
+        lod = cls(data['origin'], float(data['size']), max_depth=int(data['max_depth']), device=device)
+        lod.codes = torch.from_numpy(data['codes']).to(lod.device)
+        lod.gaussians = {k: torch.from_numpy(data[k]).to(lod.device) for k in _GAUSSIAN_KEYS}
+        for level_idx in range(lod.max_depth + 1):
+            lod.levels[level_idx] = {k: torch.from_numpy(data[f'level_{level_idx}_{k}']).to(lod.device)
+                                     for k in lod.levels[level_idx].keys()}
+            lod.nodes[level_idx] = lod._aggregate(lod.levels[level_idx])
+        return lod
+
+
+def _expand_ranges(starts, ends):
+    """Concatenation of the index ranges [starts[i], ends[i])."""
+    counts = ends - starts
+    offsets = torch.cumsum(counts, dim=0) - counts
+    idx = torch.arange(int(counts.sum().item()), device=starts.device)
+    return idx + torch.repeat_interleave(starts - offsets, counts)
+
+
+def build_lod(params_path, lod_config, device="cuda"):
+    """
+    Build (or load) the LOD hierarchy of a params.npz from the `lod` section of a config (max_depth & padding).
+
+    The hierarchy is cached next to params.npz (as params_lod.npz) & rebuilt if params.npz is newer or the depth changed.
+    """
+    max_depth = lod_config.get('max_depth', 12)
+    lod_path = os.path.splitext(params_path)[0] + "_lod.npz"
+    if os.path.exists(lod_path) and os.path.getmtime(lod_path) >= os.path.getmtime(params_path):
+        lod = GaussianLOD.load(lod_path, device=device)
+        if lod.max_depth == max_depth:
+            return lod
+    lod = GaussianLOD.from_params(dict(np.load(params_path, allow_pickle=True)), max_depth=max_depth,
+                                  padding=lod_config.get('padding', 0.05), device=device)
+    lod.save(lod_path)
+    return lod
@@ -0,0 +1,180 @@
+"""
+Consolidation of near-duplicate Gaussians.
+
+The same surface seen from several keyframes gets new Gaussians every time it falls below the silhouette threshold,
+which leaves overlapping Gaussians with nearly the same center & color. The merge pass finds them with a voxel hash
+grid over the centers & merges them:
+    - duplicates: pairs of Gaussians closer than dist_ratio x the smaller of their scales, whose colors differ by less
+      than color_thres (L2 distance in RGB)
+    - clusters: every Gaussian is merged into its lowest index duplicate that isn't merged into another one itself (star
+      clusters around a root, so that chains of duplicates along a surface don't collapse into a single Gaussian)
+    - merge: the root gets the opacity-weighted moments of its cluster (mean & covariance of the mixture, refit to the
+      isotropic or anisotropic parametrization of the map), the opacity of the union of the cluster
+      1 - prod(1 - opacity) & the opacity-weighted color. Its Adam moments are the opacity-weighted moments of the
+      cluster, and the other Gaussians of the cluster are removed along with their optimizer state.
+
+Everything is vectorized in PyTorch & runs on the device of the Gaussians (CPU or CUDA).
+"""
+
+import torch
+import torch.nn.functional as F
+
+from utils.slam_external import build_rotation, inverse_sigmoid, remove_points
+from utils.slam_helpers import matrix_to_quaternion
+from utils.spatial_hash import VoxelHashGrid
+
+
+def find_duplicate_pairs(means, scales, colors, dist_ratio=0.5, color_thres=0.1, max_radius=None):
+    """
+    Pairs of near-duplicate Gaussians.
+
+    Args:
+        means: (N, 3) centers.
+        scales: (N,) largest scale of every Gaussian.
+        colors: (N, 3) RGB colors.
+        dist_ratio: max center distance of duplicates, relative to the smaller of their scales.
+        color_thres: max RGB distance of duplicates.
+        max_radius: max center distance of duplicates (defaults to dist_ratio x the 90th percentile of the scales, the
+                    duplicates of larger Gaussians are missed past it).
+
+    Returns:
+        idx_a, idx_b: (P,) indices of the Gaussians of every pair (idx_a < idx_b).
+    """
+    num_pts = means.shape[0]
+    empty = torch.zeros(0, dtype=torch.long, device=means.device)
+    if num_pts < 2:
+        return empty, empty
+    radius = dist_ratio * torch.kthvalue(scales, max(int(0.9 * num_pts), 1)).values.item()
+    if max_radius is not None:
+        radius = min(radius, max_radius)
+    if radius <= 0:
+        return empty, empty
+    # Voxels of twice the radius: the 2^3 voxels around the closest voxel corner of a query contain its neighbors
+    grid = VoxelHashGrid(2 * radius, device=means.device).insert(means)
+    idx_a, idx_b, dists = grid.radius_query(means, radius)
+    keep = idx_a < idx_b
+    keep &= dists < dist_ratio * torch.minimum(scales[idx_a], scales[idx_b])
+    keep &= torch.norm(colors[idx_a] - colors[idx_b], dim=-1) < color_thres
+    keep = keep.nonzero().squeeze(1)
+    return idx_a[keep], idx_b[keep]
+
+
+def cluster_duplicates(num_pts, idx_a, idx_b):
+    """
+    Star clusters of duplicate pairs: every Gaussian joins its lowest index duplicate if that one is a root (i.e. it
+    has no lower index duplicate itself).
+
+    Returns:
+        roots: (N,) index of the root of the cluster of every Gaussian (itself for roots & unmerged Gaussians).
+    """
+    device = idx_a.device
+    targets = torch.arange(num_pts, device=device)
+    targets.scatter_reduce_(0, idx_b, idx_a, reduce="amin")
+    is_root = targets == torch.arange(num_pts, device=device)
+    return torch.where(is_root[targets], targets, torch.arange(num_pts, device=device))
+
+
+def gaussian_covariances(unnorm_rotations, log_scales):
+    """(N, 3, 3) covariances of Gaussians from their rotations (N, 4) & isotropic (N, 1) or anisotropic (N, 3) scales."""
+    rots = build_rotation(F.normalize(unnorm_rotations))
+    scales = torch.exp(log_scales).expand(-1, 3)
+    return rots @ torch.diag_embed(scales ** 2) @ rots.transpose(1, 2)
+
+
+def covariances_to_gaussians(covs):
+    """Unit quaternions (N, 4) & log scales (N, 3) of the anisotropic Gaussians of (N, 3, 3) covariances."""
+    eigvals, eigvecs = torch.linalg.eigh(covs)
+    # Proper rotation (det +1) for the quaternion
+    eigvecs[:, :, 2] *= torch.sign(torch.linalg.det(eigvecs))[:, None]
+    return F.normalize(matrix_to_quaternion(eigvecs)), 0.5 * torch.log(eigvals.clamp(min=1e-12))
+
+
+def _weighted_sum(values, weights, roots, num_pts):
+    """Sum of the weighted values of every cluster (indexed by root)."""
+    sums = torch.zeros((num_pts,) + values.shape[1:], device=values.device, dtype=values.dtype)
+    return sums.index_add_(0, roots, values * weights.view(-1, *([1] * (values.dim() - 1))))
+
+
+def merge_duplicate_gaussians(params, variables, optimizer, merge_dict):
+    """
+    Merge the near-duplicate Gaussians of the map.
+
+    Args:
+        params: dict of parameters.
+        variables: dict of per-Gaussian variables (max_2D_radius, timestep, ...).
+        optimizer: optimizer of the params (its state is merged along with the Gaussians).
+        merge_dict: merge config with dist_ratio, color_thres & max_radius.
+
+    Returns:
+        params, variables: updated parameters & variables.
+        num_merged: number of Gaussians merged into another one (& removed).
+    """
+    num_pts = params['means3D'].shape[0]
+    with torch.no_grad():
+        means = params['means3D'].detach()
+        log_scales = params['log_scales'].detach()
+        colors = params['rgb_colors'].detach()
+        scales = torch.exp(log_scales).max(dim=1).values
+        idx_a, idx_b = find_duplicate_pairs(means, scales, colors,
+                                            dist_ratio=merge_dict.get('dist_ratio', 0.5),
+                                            color_thres=merge_dict.get('color_thres', 0.1),
+                                            max_radius=merge_dict.get('max_radius', None))
+        if idx_a.shape[0] == 0:
+            return params, variables, 0
+        roots = cluster_duplicates(num_pts, idx_a, idx_b)
+        merged = roots != torch.arange(num_pts, device=roots.device)
+        # Only the Gaussians of the clusters (merged Gaussians & their roots) are refit
+        in_cluster = merged.clone()
+        in_cluster[roots[merged]] = True
+        members = in_cluster.nonzero().squeeze(1)
+        member_roots = roots[members]
+        cluster_roots = torch.unique(member_roots)
+
+        opacities = torch.sigmoid(params['logit_opacities'].detach()[members]).squeeze(-1)
+        weights = opacities.clamp(min=1e-6)
+        weight_sums = torch.zeros(num_pts, device=weights.device).index_add_(0, member_roots, weights)
+        norm_weights = weights / weight_sums[member_roots]
+
+        # Moments of the mixture: mean & covariance (covariance of every Gaussian + spread of the centers)
+        member_means = means[members]
+        new_means = _weighted_sum(member_means, norm_weights, member_roots, num_pts)
+        member_covs = gaussian_covariances(params['unnorm_rotations'].detach()[members], log_scales[members])
+        offsets = member_means - new_means[member_roots]
+        member_covs = member_covs + offsets[:, :, None] * offsets[:, None, :]
+        new_covs = _weighted_sum(member_covs, norm_weights, member_roots, num_pts)[cluster_roots]
+        if log_scales.shape[1] == 1:
+            new_log_scales = 0.5 * torch.log(torch.diagonal(new_covs, dim1=1, dim2=2).sum(dim=1, keepdim=True) / 3)
+            new_rots = params['unnorm_rotations'].detach()[cluster_roots]
+        else:
+            new_rots, new_log_scales = covariances_to_gaussians(new_covs)
+        # Opacity of the union of the cluster
+        log_transmittance = torch.zeros(num_pts, device=weights.device).index_add_(
+            0, member_roots, torch.log1p(-opacities.clamp(max=0.99)))
+        new_opacities = (1 - torch.exp(log_transmittance[cluster_roots])).clamp(1e-4, 0.99)[:, None]
+        new_colors = _weighted_sum(colors[members], norm_weights, member_roots, num_pts)[cluster_roots]
+
+        new_values = {
+            'means3D': new_means[cluster_roots],
+            'rgb_colors': new_colors,
+            'unnorm_rotations': new_rots,
+            'logit_opacities': inverse_sigmoid(new_opacities),
+            'log_scales': new_log_scales,
+        }
+        for k, v in new_values.items():
+            params[k][cluster_roots] = v.to(params[k].dtype)
+            group = [g for g in optimizer.param_groups if g['name'] == k][0]
+            stored_state = optimizer.state.get(group['params'][0], None)
+            if stored_state is not None:
+                for moment in ["exp_avg", "exp_avg_sq"]:
+                    merged_moment = _weighted_sum(stored_state[moment][members], norm_weights, member_roots, num_pts)
+                    stored_state[moment][cluster_roots] = merged_moment[cluster_roots]
+
+        # The root keeps the largest footprint & the earliest timestep of its cluster
+        variables['max_2D_radius'].scatter_reduce_(0, member_roots, variables['max_2D_radius'][members], reduce="amax")
+        if 'timestep' in variables.keys():
+            variables['timestep'].scatter_reduce_(0, member_roots, variables['timestep'][members], reduce="amin")
+
+    params, variables = remove_points(merged, params, variables, optimizer)
+    if 'spatial_index' in variables.keys():
+        variables['spatial_index'].update(params['means3D'])
+    return params, variables, int(merged.sum().item())
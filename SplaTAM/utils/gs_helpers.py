@@ -7,14 +7,12 @@ import matplotlib.pyplot as plt
 from tqdm import tqdm
 
 from utils.recon_helpers import setup_camera
+from utils.metrics import get_metric
 from utils.slam_external import build_rotation,calc_psnr
+from utils.trajectory_eval import umeyama_alignment
 
 from diff_gaussian_rasterization import GaussianRasterizer as Renderer
 
-from pytorch_msssim import ms_ssim
-from torchmetrics.image.lpip import LearnedPerceptualImagePatchSimilarity
-loss_fn_alex = LearnedPerceptualImagePatchSimilarity(net_type='alex', normalize=True).cuda()
-
 def l1_loss_v1(x, y):
     return torch.abs((x - y)).mean()
 
@@ -44,26 +42,13 @@ def align(model, data):
         trans_error -- translational error per point (1xn)
 
     """
-    np.set_printoptions(precision=3, suppress=True)
-    model_zerocentered = model - model.mean(1).reshape((3,-1))
-    data_zerocentered = data - data.mean(1).reshape((3,-1))
-
-    W = np.zeros((3, 3))
-    for column in range(model.shape[1]):
-        W += np.outer(model_zerocentered[:,
-                         column], data_zerocentered[:, column])
-    U, d, Vh = np.linalg.linalg.svd(W.transpose())
-    S = np.matrix(np.identity(3))
-    if (np.linalg.det(U) * np.linalg.det(Vh) < 0):
-        S[2, 2] = -1
-    rot = U*S*Vh
-    trans = data.mean(1).reshape((3,-1)) - rot * model.mean(1).reshape((3,-1))
-
-    model_aligned = rot * model + trans
+    rot, trans, _ = umeyama_alignment(model.T, data.T)
+    trans = trans.reshape((3,-1))
+
+    model_aligned = rot @ model + trans
     alignment_error = model_aligned - data
 
-    trans_error = np.sqrt(np.sum(np.multiply(
-        alignment_error, alignment_error), 0)).A[0]
+    trans_error = np.linalg.norm(alignment_error, axis=0)
 
     return rot, trans, trans_error
 
@@ -71,15 +56,17 @@ def align(model, data):
 def evaluate_ate(gt_traj, est_traj):
     """
     Input : 
-        gt_traj: list of 4x4 matrices 
-        est_traj: list of 4x4 matrices
+        gt_traj: list of 4x4 matrices (or stacked Nx4x4 tensor)
+        est_traj: list of 4x4 matrices (or stacked Nx4x4 tensor)
         len(gt_traj) == len(est_traj)
     """
-    gt_traj_pts = [gt_traj[idx][:3,3] for idx in range(len(gt_traj))]
-    est_traj_pts = [est_traj[idx][:3,3] for idx in range(len(est_traj))]
+    if isinstance(gt_traj, (list, tuple)):
+        gt_traj = torch.stack(gt_traj)
+    if isinstance(est_traj, (list, tuple)):
+        est_traj = torch.stack(est_traj)
 
-    gt_traj_pts  = torch.stack(gt_traj_pts).detach().cpu().numpy().T
-    est_traj_pts = torch.stack(est_traj_pts).detach().cpu().numpy().T
+    gt_traj_pts  = gt_traj[:, :3, 3].detach().cpu().numpy().T
+    est_traj_pts = est_traj[:, :3, 3].detach().cpu().numpy().T
 
     _, _, trans_error = align(gt_traj_pts, est_traj_pts)
 
@@ -462,6 +449,8 @@ def report_progress(params, data, i, progress_bar, iter_time_idx, sil_thres, eve
 
 def eval(dataset, final_params, num_frames, eval_dir, sil_thres, mapping_iters, add_new_gaussians, wandb_run=None, wandb_save_qual=False):
     print("Evaluating Final Parameters ...")
+    ms_ssim = get_metric('ms_ssim')
+    loss_fn_alex = get_metric('lpips')
     psnr_list = []
     rmse_list = []
     lpips_list = []
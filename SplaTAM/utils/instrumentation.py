@@ -0,0 +1,178 @@
+"""
+Lightweight instrumentation of the SLAM loops: named timing spans, counters & histograms.
+
+Usage:
+    profiler = Profiler(enabled=True, detailed=False)
+    with profiler.span("tracking/iter"):
+        ...
+    with profiler.span("tracking/backward", detailed=True): # Only timed if the profiler is detailed
+        loss.backward()
+    profiler.count("gaussians/added", num_new_gaussians)
+    profiler.observe("tracking/iters_per_frame", num_iters)
+    profiler.save(output_dir) # profile.json & profile.csv
+
+When the profiler (or a detailed span of a non-detailed profiler) is disabled, span returns a shared no-op context
+manager and count/observe return immediately, so instrumented code only pays for an attribute lookup & a call.
+"""
+
+import csv
+import json
+import os
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+_NULL_SPAN = nullcontext()
+
+
+def _cuda_synchronize():
+    import torch
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        torch.cuda.synchronize()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start_time")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        if self.profiler.cuda_sync:
+            _cuda_synchronize()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler.cuda_sync:
+            _cuda_synchronize()
+        self.profiler.add_time(self.name, time.perf_counter() - self.start_time)
+        return False
+
+
+class Profiler:
+    """
+    Collects the durations of named spans, counters & histograms of a run.
+
+    Args:
+        enabled: Record anything at all.
+        detailed: Also record the spans marked as detailed (e.g. the render/backward/step of every iteration).
+        cuda_sync: Synchronize CUDA at the start & end of every span, so that spans measure the GPU work they
+                   launch instead of only the time to queue it (slows down the run).
+    """
+    def __init__(self, enabled=True, detailed=False, cuda_sync=False):
+        self.enabled = enabled
+        self.detailed = detailed
+        self.cuda_sync = cuda_sync
+        # name -> [count, total, min, max] (seconds)
+        self.spans = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def span(self, name, detailed=False):
+        """Context manager timing the enclosed block as one occurrence of span `name`."""
+        if not self.enabled or (detailed and not self.detailed):
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def add_time(self, name, seconds):
+        """Record one occurrence of span `name` measured elsewhere."""
+        if not self.enabled:
+            return
+        stats = self.spans.get(name)
+        if stats is None:
+            self.spans[name] = [1, seconds, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = min(stats[2], seconds)
+            stats[3] = max(stats[3], seconds)
+
+    def count(self, name, value=1):
+        """Increment counter `name` by value."""
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Add a sample to histogram `name`."""
+        if not self.enabled:
+            return
+        self.histograms.setdefault(name, []).append(float(value))
+
+    def total(self, name):
+        """Total time (s) spent in span `name`."""
+        stats = self.spans.get(name)
+        return 0.0 if stats is None else stats[1]
+
+    def mean(self, name):
+        """Average time (s) of span `name` (0 if it never occurred)."""
+        stats = self.spans.get(name)
+        return 0.0 if stats is None else stats[1] / stats[0]
+
+    def num_calls(self, name):
+        stats = self.spans.get(name)
+        return 0 if stats is None else stats[0]
+
+    def to_dict(self):
+        spans = {name: {'count': count, 'total': total, 'mean': total / count, 'min': min_time, 'max': max_time}
+                 for name, (count, total, min_time, max_time) in self.spans.items()}
+        histograms = {}
+        for name, values in self.histograms.items():
+            values = np.asarray(values)
+            histograms[name] = {
+                'count': int(values.size),
+                'mean': float(values.mean()),
+                'min': float(values.min()),
+                'max': float(values.max()),
+                'p50': float(np.percentile(values, 50)),
+                'p90': float(np.percentile(values, 90)),
+                'p99': float(np.percentile(values, 99)),
+            }
+        return {'spans': spans, 'counters': dict(self.counters), 'histograms': histograms}
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def save_csv(self, path):
+        """Save one row per span, counter & histogram."""
+        profile = self.to_dict()
+        fields = ['type', 'name', 'count', 'total', 'mean', 'min', 'max', 'p50', 'p90', 'p99']
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for name, stats in profile['spans'].items():
+                writer.writerow({'type': 'span', 'name': name, **stats})
+            for name, value in profile['counters'].items():
+                writer.writerow({'type': 'counter', 'name': name, 'total': value})
+            for name, stats in profile['histograms'].items():
+                writer.writerow({'type': 'histogram', 'name': name, **stats})
+
+    def save(self, output_dir, name="profile"):
+        """Save the profile of the run as <name>.json & <name>.csv in output_dir."""
+        if not self.enabled:
+            return
+        os.makedirs(output_dir, exist_ok=True)
+        self.save_json(os.path.join(output_dir, f"{name}.json"))
+        self.save_csv(os.path.join(output_dir, f"{name}.csv"))
+
+    def summary(self):
+        """Table of the recorded spans (sorted by total time) & counters."""
+        lines = [f"{'Span':<32}{'Count':>10}{'Total (s)':>12}{'Mean (ms)':>12}{'Max (ms)':>12}"]
+        for name, (count, total, _, max_time) in sorted(self.spans.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<32}{count:>10}{total:>12.2f}{total / count * 1000:>12.2f}{max_time * 1000:>12.2f}")
+        for name, value in self.counters.items():
+            lines.append(f"{name:<32}{value:>10}")
+        return "\n".join(lines)
+
+
+def build_profiler(config):
+    """Build the profiler of a run from the optional `profiling` section of its config."""
+    profiling_config = config.get('profiling', {})
+    return Profiler(enabled=profiling_config.get('enabled', True),
+                    detailed=profiling_config.get('detailed', False),
+                    cuda_sync=profiling_config.get('cuda_sync', False))
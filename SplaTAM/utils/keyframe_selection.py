@@ -26,7 +26,7 @@ def get_pointcloud(depth, intrinsics, w2c, sampled_indices):
 
     # Remove points at camera origin
     A = torch.abs(torch.round(pts, decimals=4))
-    B = torch.zeros((1, 3)).cuda().float()
+    B = torch.zeros((1, 3), device=pts.device).float()
     _, idx, counts = torch.cat([A, B], dim=0).unique(
         dim=0, return_inverse=True, return_counts=True)
     mask = torch.isin(idx, torch.where(counts.gt(1))[0])
@@ -93,4 +93,39 @@ def keyframe_selection_overlap(gt_depth, w2c, intrinsics, keyframe_list, k, pixe
         selected_keyframe_list = list(np.random.permutation(
             np.array(selected_keyframe_list))[:k])
 
-        return selected_keyframe_list
\ No newline at end of file
+        return selected_keyframe_list
+
+class KeyframeSampler:
+    """
+    Samples the batch of frames of the mapping window rendered at every mapping iteration.
+
+    Args:
+        window (list): frames of the mapping window (e.g. the selected keyframe indices, with -1 for the current frame).
+        batch_size (int): number of frames per batch.
+        policy (str): 'uniform' draws every frame independently & uniformly from the window (with replacement), while
+            'shuffle' draws the frames from random permutations of the window (without replacement), so every frame
+            of the window is rendered once every ceil(len(window) / batch_size) iterations. Defaults (None) to 'shuffle'
+            for batches & to 'uniform' (the original single frame sampling) for batch_size 1.
+    """
+    def __init__(self, window, batch_size=1, policy=None):
+        if policy is None:
+            policy = 'shuffle' if batch_size > 1 else 'uniform'
+        if policy not in ['uniform', 'shuffle']:
+            raise ValueError(f"Unknown keyframe sampling policy {policy}")
+        self.window = list(window)
+        self.batch_size = batch_size
+        self.policy = policy
+        self._queue = []
+
+    def sample(self):
+        """Frames of the next batch."""
+        if self.policy == 'uniform':
+            return [self.window[idx] for idx in np.random.randint(0, len(self.window), size=self.batch_size)]
+        batch = []
+        while len(batch) < self.batch_size:
+            if len(self._queue) == 0:
+                self._queue = [self.window[idx] for idx in np.random.permutation(len(self.window))]
+            # A frame is never repeated in a batch (unless the batch is larger than the window)
+            frame_idx = next((i for i, frame in enumerate(self._queue) if frame not in batch), 0)
+            batch.append(self._queue.pop(frame_idx))
+        return batch
@@ -0,0 +1,236 @@
+"""
+Compact storage of the mapping keyframes.
+
+Every keyframe is kept for the whole run, so storing them as full resolution float32 device tensors grows without
+bound (a 1920x1440 RGB-D keyframe is 44 MB). The KeyframeStore keeps the color as uint8 & the depth as float16 (11 MB
+for the same keyframe, the color round trip is exact since the images are uint8 to begin with), and only keeps the
+max_device_keyframes most recently used keyframes on the device. Colder keyframes are offloaded to host memory (pinned
+when CUDA is available, so they can be copied back asynchronously) or to memory-mapped files in offload_dir.
+
+The store can be used like the keyframe list it replaces:
+    keyframe_list = KeyframeStore(device, max_device_keyframes=64)
+    keyframe_list.append({'id': time_idx, 'est_w2c': curr_w2c, 'color': color, 'depth': depth})
+    selected_keyframes = keyframe_selection_overlap(depth, curr_w2c, intrinsics, keyframe_list[:-1], num_keyframes)
+    keyframe_list.prefetch(selected_keyframes) # Copy the selected keyframes back to the device before mapping
+    iter_color = keyframe_list[selected_keyframes[0]]['color'] # (3, H, W) float color in [0, 1] on the device
+
+Indexing returns a read-only view of the keyframe: its 'id' & 'est_w2c' are free to access, while its 'color' &
+'depth' are decompressed on access (once per prefetch for the prefetched keyframes).
+"""
+
+import os
+from collections.abc import Mapping
+
+import numpy as np
+import torch
+
+
+class _KeyframeRecord:
+    __slots__ = ("id", "est_w2c", "color", "depth", "location", "decoded")
+
+    def __init__(self, keyframe_id, est_w2c, color, depth):
+        self.id = keyframe_id
+        self.est_w2c = est_w2c
+        self.color = color # (3, H, W) uint8 (or float if the store doesn't compress)
+        self.depth = depth # (1, H, W) float16 (or float32 if the store doesn't compress)
+        self.location = "device" # "device", "host" or "disk"
+        self.decoded = None # (color, depth) decompressed on the device while the keyframe is prefetched
+
+
+class KeyframeView(Mapping):
+    """Read-only dict-like view of a keyframe of a KeyframeStore (keys: id, est_w2c, color & depth)."""
+    _KEYS = ('id', 'est_w2c', 'color', 'depth')
+
+    def __init__(self, store, record):
+        self._store = store
+        self._record = record
+
+    def __getitem__(self, key):
+        if key == 'id':
+            return self._record.id
+        if key == 'est_w2c':
+            return self._record.est_w2c
+        if key == 'color':
+            return self._store._decode(self._record)[0]
+        if key == 'depth':
+            return self._store._decode(self._record)[1]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+
+class KeyframeStore:
+    """
+    List-like store of the mapping keyframes.
+
+    Args:
+        device: device of the keyframes used for mapping.
+        compress: store the color as uint8 & the depth as float16 (otherwise the keyframes are stored as given).
+        max_device_keyframes: max number of keyframes kept on the device (None to keep all of them on the device).
+        offload: where keyframes evicted from the device are kept: "host" (pinned host memory if CUDA is available)
+                 or "disk" (memory-mapped files in offload_dir).
+        offload_dir: directory of the offloaded keyframes (required for the "disk" offload).
+    """
+    def __init__(self, device="cuda", compress=True, max_device_keyframes=None, offload="host", offload_dir=None):
+        if offload not in ["host", "disk"]:
+            raise ValueError(f"Unknown keyframe offload {offload}")
+        if offload == "disk" and offload_dir is None:
+            raise ValueError("The disk keyframe offload requires an offload_dir")
+        self.device = torch.device(device)
+        self.compress = compress
+        self.max_device_keyframes = max_device_keyframes
+        self.offload = offload
+        self.offload_dir = offload_dir
+        self.pin_memory = torch.cuda.is_available()
+        self._records = []
+        # Keyframes on the device, least recently used first
+        self._device_records = []
+        self._prefetched = []
+        if offload == "disk":
+            os.makedirs(offload_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [KeyframeView(self, record) for record in self._records[index]]
+        return KeyframeView(self, self._records[index])
+
+    def __iter__(self):
+        for record in self._records:
+            yield KeyframeView(self, record)
+
+    def append(self, keyframe):
+        """Add a keyframe dict with id, est_w2c, (3, H, W) float color in [0, 1] & (1, H, W) depth."""
+        color, depth = keyframe['color'].detach(), keyframe['depth'].detach()
+        if self.compress:
+            color = (color * 255).round().clamp(0, 255).to(torch.uint8)
+            depth = depth.to(torch.float16)
+        record = _KeyframeRecord(keyframe['id'], keyframe['est_w2c'].detach().to(self.device),
+                                 color.to(self.device), depth.to(self.device))
+        self._records.append(record)
+        self._touch(record)
+
+    def pop(self, index=-1):
+        """Remove the keyframe at index (returns its id)."""
+        record = self._records.pop(index)
+        if record in self._device_records:
+            self._device_records.remove(record)
+        if record in self._prefetched:
+            self._prefetched.remove(record)
+        if record.location == "disk":
+            for path in self._disk_paths(record):
+                if os.path.exists(path):
+                    os.remove(path)
+        return record.id
+
+    def prefetch(self, indices):
+        """
+        Copy the keyframes at indices back to the device & decompress them ahead of the mapping iterations.
+
+        Keyframes prefetched earlier (and not in indices) go back to their compressed form. Indices that aren't valid
+        keyframe indices (e.g. -1 for the current frame of the selection) are ignored.
+        """
+        records = [self._records[index] for index in indices if 0 <= index < len(self._records)]
+        for record in self._prefetched:
+            if record not in records:
+                record.decoded = None
+        self._prefetched = list(dict.fromkeys(records))
+        # Issue all the (asynchronous from pinned memory) copies before decompressing
+        for record in self._prefetched:
+            self._touch(record)
+        for record in self._prefetched:
+            self._decode(record, cache=True)
+
+    def memory_usage(self):
+        """Bytes of keyframe color & depth on the device, in host memory & on disk."""
+        usage = {"device": 0, "host": 0, "disk": 0}
+        for record in self._records:
+            usage[record.location] += record.color.nbytes + record.depth.nbytes
+        return usage
+
+    def _decode(self, record, cache=False):
+        if record.decoded is not None:
+            return record.decoded
+        self._touch(record)
+        color, depth = record.color, record.depth
+        if self.compress:
+            color = color.float() / 255
+            depth = depth.float()
+        if cache:
+            record.decoded = (color, depth)
+        return color, depth
+
+    def _touch(self, record):
+        """Move a keyframe to the device (as its most recently used keyframe) & offload the least recently used ones."""
+        if record.location == "device":
+            if record in self._device_records:
+                self._device_records.remove(record)
+        else:
+            if record.location == "disk":
+                record.color = torch.from_numpy(np.array(record.color)).to(self.device)
+                record.depth = torch.from_numpy(np.array(record.depth)).to(self.device)
+                for path in self._disk_paths(record):
+                    os.remove(path)
+            else:
+                record.color = record.color.to(self.device, non_blocking=self.pin_memory)
+                record.depth = record.depth.to(self.device, non_blocking=self.pin_memory)
+            record.location = "device"
+        self._device_records.append(record)
+        if self.max_device_keyframes is None:
+            return
+        # Offload the least recently used keyframes (never the prefetched ones, which are about to be used)
+        num_to_offload = len(self._device_records) - self.max_device_keyframes
+        for lru_record in list(self._device_records):
+            if num_to_offload <= 0:
+                break
+            if lru_record is record or lru_record in self._prefetched:
+                continue
+            self._offload(lru_record)
+            num_to_offload -= 1
+
+    def _offload(self, record):
+        self._device_records.remove(record)
+        record.decoded = None
+        if self.offload == "host":
+            record.color = record.color.to("cpu")
+            record.depth = record.depth.to("cpu")
+            if self.pin_memory:
+                record.color = record.color.pin_memory()
+                record.depth = record.depth.pin_memory()
+            record.location = "host"
+        else:
+            color_path, depth_path = self._disk_paths(record)
+            np.save(color_path, record.color.cpu().numpy())
+            np.save(depth_path, record.depth.cpu().numpy())
+            # Memory-mapped (read-only) arrays, only paged in when the keyframe is moved back to the device
+            record.color = np.load(color_path, mmap_mode="r")
+            record.depth = np.load(depth_path, mmap_mode="r")
+            record.location = "disk"
+
+    def _disk_paths(self, record):
+        return (os.path.join(self.offload_dir, f"keyframe_{record.id:06d}_color.npy"),
+                os.path.join(self.offload_dir, f"keyframe_{record.id:06d}_depth.npy"))
+
+
+def build_keyframe_store(config, device="cuda", output_dir=None):
+    """
+    Build the keyframe store of a run from the optional `keyframe_store` section of its config.
+
+    Without the section the keyframes are stored as given & kept on the device (like a plain list). The disk offload
+    defaults to a keyframes directory in output_dir.
+    """
+    store_config = config.get('keyframe_store', {})
+    offload_dir = store_config.get('offload_dir', None)
+    if offload_dir is None and output_dir is not None:
+        offload_dir = os.path.join(output_dir, "keyframes")
+    return KeyframeStore(device=device,
+                         compress=store_config.get('compress', False),
+                         max_device_keyframes=store_config.get('max_device_keyframes', None),
+                         offload=store_config.get('offload', 'host'),
+                         offload_dir=offload_dir)
@@ -0,0 +1,51 @@
+"""
+Lazy registry of the image metric backends used for evaluation.
+
+Importing torchmetrics, loading the LPIPS (AlexNet) weights & creating a CUDA context is expensive, so the
+backends are only imported & instantiated the first time they are requested with get_metric.
+"""
+
+_METRIC_FACTORIES = {}
+_METRICS = {}
+
+
+def register_metric(name, factory):
+    """
+    Register a metric backend.
+
+    Args:
+        name: Name used to request the metric with get_metric.
+        factory: Function without arguments that imports & builds the metric. Only called on first use.
+    """
+    _METRIC_FACTORIES[name] = factory
+    _METRICS.pop(name, None)
+
+
+def get_metric(name):
+    """Return the metric backend registered as `name`, building it on first use."""
+    if name not in _METRICS:
+        if name not in _METRIC_FACTORIES:
+            raise ValueError(f"Unknown metric {name}. Registered metrics: {sorted(_METRIC_FACTORIES.keys())}")
+        _METRICS[name] = _METRIC_FACTORIES[name]()
+    return _METRICS[name]
+
+
+def build_lpips():
+    from torchmetrics.image.lpip import LearnedPerceptualImagePatchSimilarity
+    return LearnedPerceptualImagePatchSimilarity(net_type='alex', normalize=True).cuda()
+
+
+def build_lpips_per_image():
+    # Same AlexNet LPIPS as the torchmetrics metric, but returns the score of every image of a batch (B, 1, 1, 1)
+    import lpips
+    return lpips.LPIPS(net='alex', verbose=False).cuda().eval()
+
+
+def build_ms_ssim():
+    from pytorch_msssim import ms_ssim
+    return ms_ssim
+
+
+register_metric('lpips', build_lpips)
+register_metric('lpips_per_image', build_lpips_per_image)
+register_metric('ms_ssim', build_ms_ssim)
@@ -0,0 +1,119 @@
+"""
+Motion models predicting the camera pose of a new frame (the initialization of tracking).
+
+The camera poses are world-to-camera rotations (unnormalized wxyz quaternions) & translations. The predictors
+extrapolate the relative motion of the camera in SE(3):
+    - 'constant_velocity': the camera repeats its latest relative motion (new_w2c = delta @ w2c_1, with
+      delta = w2c_1 @ inv(w2c_2)), which is exact for motions with constant linear & angular velocity (e.g. circles).
+    - 'constant_acceleration': the relative motion also keeps its latest change (delta @ inv(prev_delta) @ delta).
+    - 'linear': linear extrapolation of the quaternions & translations (normalized afterwards), which is inaccurate for
+      fast rotations (kept for comparison).
+The relative motion is scaled by damping (1 keeps the full motion, 0 keeps the previous pose), slerping its rotation
+from the identity & scaling its translation.
+
+A relative motion measured by another sensor (e.g. the ARKit poses of an iPhone capture) can be used as a prior instead
+of the extrapolated motion: the new pose is the previous estimated pose moved by the relative motion of the sensor.
+"""
+
+import torch
+import torch.nn.functional as F
+
+from utils.slam_external import build_rotation
+from utils.slam_helpers import matrix_to_quaternion, quat_mult
+
+MOTION_MODELS = ['constant_velocity', 'constant_acceleration', 'linear']
+
+
+def quat_slerp(q0, q1, t):
+    """Spherical linear interpolation from q0 (t = 0) to q1 (t = 1) of (N, 4) unit quaternions."""
+    dot = (q0 * q1).sum(dim=-1, keepdim=True)
+    # Interpolate along the shortest arc
+    q1 = torch.where(dot < 0, -q1, q1)
+    dot = dot.abs().clamp(max=1.0)
+    theta = torch.acos(dot)
+    sin_theta = torch.sin(theta)
+    small_angle = sin_theta < 1e-6
+    safe_sin_theta = torch.where(small_angle, torch.ones_like(sin_theta), sin_theta)
+    w0 = torch.where(small_angle, 1.0 - t, torch.sin((1.0 - t) * theta) / safe_sin_theta)
+    w1 = torch.where(small_angle, torch.full_like(theta, t), torch.sin(t * theta) / safe_sin_theta)
+    return F.normalize(w0 * q0 + w1 * q1, dim=-1)
+
+
+def camera_centers(rots, trans):
+    """Camera centers (N, 3) of world-to-camera poses with unit quaternion rotations (N, 4) & translations (N, 3)."""
+    return -(build_rotation(rots).transpose(1, 2) @ trans[..., None])[..., 0]
+
+
+def poses_to_w2c(rots, trans):
+    """(N, 4, 4) world-to-camera matrices of unit quaternion rotations (N, 4) & translations (N, 3)."""
+    w2cs = torch.eye(4, device=rots.device, dtype=rots.dtype).repeat(rots.shape[0], 1, 1)
+    w2cs[:, :3, :3] = build_rotation(rots)
+    w2cs[:, :3, 3] = trans
+    return w2cs
+
+
+def predict_pose(rots, trans, motion_model='constant_velocity', damping=1.0):
+    """
+    Extrapolate the next world-to-camera pose from the latest poses.
+
+    Args:
+        rots: (K, 4) unit quaternions of the latest poses, most recent last (K >= 2, K >= 3 for constant_acceleration).
+        trans: (K, 3) translations of the latest poses, most recent last.
+        motion_model: 'constant_velocity', 'constant_acceleration' or 'linear'.
+        damping: fraction of the extrapolated motion applied to the latest pose.
+
+    Returns:
+        rot: (1, 4) unit quaternion of the predicted pose.
+        tran: (1, 3) translation of the predicted pose.
+    """
+    if motion_model not in MOTION_MODELS:
+        raise ValueError(f"Unknown motion model {motion_model}")
+    rot1, rot2 = rots[-1:], rots[-2:-1]
+    if motion_model == 'linear':
+        rot = F.normalize(rot1 + damping * (rot1 - rot2))
+        tran = trans[-1:] + damping * (trans[-1:] - trans[-2:-1])
+        return rot, tran
+
+    w2cs = poses_to_w2c(rots, trans)
+    # Relative motion between the latest poses (from the camera of the previous pose to the camera of the latest one)
+    delta = w2cs[-1] @ torch.linalg.inv(w2cs[-2])
+    if motion_model == 'constant_acceleration' and rots.shape[0] >= 3:
+        prev_delta = w2cs[-2] @ torch.linalg.inv(w2cs[-3])
+        delta = delta @ torch.linalg.inv(prev_delta) @ delta
+    delta_rot = F.normalize(matrix_to_quaternion(delta[None, :3, :3]))
+    if damping != 1.0:
+        identity = torch.tensor([[1.0, 0.0, 0.0, 0.0]], device=rots.device, dtype=rots.dtype)
+        delta_rot = quat_slerp(identity, delta_rot, damping)
+    rot = F.normalize(quat_mult(delta_rot, rot1))
+    tran = (build_rotation(delta_rot) @ trans[-1:, :, None])[..., 0] + damping * delta[None, :3, 3]
+    return rot, tran
+
+
+def apply_relative_motion(rot, tran, relative_motion):
+    """
+    Move a world-to-camera pose by a relative camera motion.
+
+    Args:
+        rot: (1, 4) unit quaternion of the pose.
+        tran: (1, 3) translation of the pose.
+        relative_motion: (4, 4) motion from the camera of the pose to the new camera (new_w2c @ inv(prev_w2c) of
+                         the poses of another sensor).
+
+    Returns:
+        rot, tran: the moved pose.
+    """
+    w2c = torch.eye(4, device=rot.device, dtype=rot.dtype)
+    w2c[:3, :3] = build_rotation(rot)[0]
+    w2c[:3, 3] = tran[0]
+    new_w2c = relative_motion.to(w2c) @ w2c
+    return F.normalize(matrix_to_quaternion(new_w2c[:3, :3].unsqueeze(0))), new_w2c[:3, 3].unsqueeze(0)
+
+
+def get_relative_motion(w2cs):
+    """Relative motion between the last two poses of a list of (4, 4) world-to-camera poses (None if not finite)."""
+    if len(w2cs) < 2:
+        return None
+    relative_motion = w2cs[-1] @ torch.linalg.inv(w2cs[-2])
+    if not torch.isfinite(relative_motion).all():
+        return None
+    return relative_motion
@@ -1,9 +1,51 @@
-import faiss
-import faiss.contrib.torch_utils
+import math
+
 import torch
 
+from utils.spatial_hash import VoxelHashGrid, pack_voxel_keys
+
+try:
+    import faiss
+    import faiss.contrib.torch_utils
+except ImportError:
+    # faiss is optional: L2 neighbors fall back to the voxel hash grid
+    faiss = None
+
+
+def grid_3d_knn(pts, num_knn, voxel_size, max_ring=3, query_pts=None, index=None):
+    """
+    k nearest neighbors (squared L2 distances) using a voxel hash grid (no faiss required, runs on CPU & CUDA).
+
+    Args:
+        pts: (N, 3) points to search (ignored if index is given).
+        num_knn: number of neighbors.
+        voxel_size: voxel size of the grid (ideally a few times the typical point spacing).
+        max_ring: max half size (in voxels) of the searched block.
+        query_pts: (Q, 3) query points (None to query pts against themselves, excluding every point itself).
+        index: existing VoxelHashGrid to search instead of building one over pts.
+
+    Returns:
+        distances: (Q, num_knn) squared distances (inf if fewer than num_knn neighbors within max_ring voxels).
+        indices: (Q, num_knn) indices of the neighbors (-1 if missing).
+    """
+    if index is None:
+        index = VoxelHashGrid(voxel_size, device=pts.device).insert(pts)
+    if query_pts is None:
+        query_indices = torch.arange(len(index), device=index.points.device)
+        return index.knn(index.points, num_knn, max_ring=max_ring, query_indices=query_indices)
+    return index.knn(query_pts, num_knn, max_ring=max_ring)
+
+
+def torch_3d_knn(pts, num_knn, method="l2", voxel_size=None):
+    if faiss is None:
+        if method != "l2" or voxel_size is None:
+            raise ImportError(f"faiss is required for {method} neighbors without a voxel_size for the grid search")
+        # Every point is its own nearest neighbor with faiss, so keep that convention
+        distances, indices = grid_3d_knn(pts, num_knn - 1, voxel_size)
+        self_indices = torch.arange(pts.shape[0], device=pts.device)[:, None]
+        return (torch.cat((torch.zeros_like(self_indices, dtype=distances.dtype), distances), dim=1),
+                torch.cat((self_indices, indices), dim=1))
 
-def torch_3d_knn(pts, num_knn, method="l2"):
     # Initialize FAISS index
     if method == "l2":
         index = faiss.IndexFlatL2(pts.shape[1])
@@ -21,7 +63,85 @@ def torch_3d_knn(pts, num_knn, method="l2"):
     index.add(pts)
     distances, indices = index.search(pts, num_knn)
     return distances, indices
-    
+
+
+def knn_mean_sq_dist(pts, voxel_size, num_knn=3, max_ring=2, min_occupancy=8, map_pts=None):
+    """
+    Mean squared distance of every point to its num_knn nearest neighbors (used to initialize the scale of new
+    Gaussians like 3D Gaussian Splatting).
+
+    Args:
+        pts: (N, 3) points.
+        voxel_size: initial voxel size of the grid over pts (e.g. a few pixel footprints for the points of a frame).
+        num_knn: number of neighbors.
+        max_ring: max half size (in voxels) of the searched block.
+        min_occupancy: min average number of points per occupied voxel (the voxels are grown to reach it).
+        map_pts: (M, 3) existing Gaussian centers, which also count as neighbors of the new points.
+
+    Returns:
+        mean3_sq_dist: (N,) mean squared distance to the nearest neighbors.
+    """
+    index = VoxelHashGrid(voxel_size, device=pts.device).insert(pts)
+    # Depth noise spreads the points of a frame around the surfaces, which leaves most voxels nearly empty & most
+    # queries with a second ring to search, so grow the voxels (assuming the points lie on surfaces) if needed
+    occupancy = len(index) / max(index.num_voxels, 1)
+    if occupancy < min_occupancy:
+        voxel_size = voxel_size * math.sqrt(min_occupancy / occupancy)
+        index = VoxelHashGrid(voxel_size, device=pts.device).insert(pts)
+    sq_dists, _ = grid_3d_knn(None, num_knn, voxel_size, max_ring=max_ring, index=index)
+    max_dist = (max_ring - 0.5) * voxel_size
+    if map_pts is not None:
+        # Only the existing Gaussians within the search distance of the bounding box of the points can be neighbors
+        map_pts = map_pts.detach()
+        min_corner, max_corner = pts.min(dim=0).values - max_dist, pts.max(dim=0).values + max_dist
+        map_pts = map_pts[((map_pts >= min_corner) & (map_pts <= max_corner)).all(dim=1)]
+    if map_pts is not None and map_pts.shape[0] > 0:
+        map_sq_dists, _ = grid_3d_knn(map_pts, num_knn, voxel_size, max_ring=max_ring, query_pts=pts)
+        sq_dists = torch.topk(torch.cat((sq_dists, map_sq_dists), dim=1), num_knn, dim=1, largest=False).values
+    # Neighbors that were not found within max_ring voxels count as being at the search distance
+    sq_dists = torch.clamp(sq_dists, max=max_dist ** 2)
+    return sq_dists.mean(dim=1)
+
+
+def voxel_cluster_points(point_cld, mean3_sq_dist, voxel_size):
+    """
+    Merge the points of every voxel into a single point (to add one Gaussian per voxel instead of one per pixel).
+
+    Args:
+        point_cld: (N, 6) points (xyz & rgb).
+        mean3_sq_dist: (N,) squared scale of the Gaussian of every point.
+        voxel_size: edge length of the voxels.
+
+    Returns:
+        merged_pt_cld: (M, 6) mean position & color of the points of every occupied voxel.
+        merged_mean3_sq_dist: (M,) squared scale of the merged Gaussians, the mean squared scale of the points plus
+                              their spread around the mean position (so a merged Gaussian covers its points).
+    """
+    keys = pack_voxel_keys(torch.floor(point_cld[:, :3] / voxel_size))
+    _, cluster_idx, counts = torch.unique(keys, return_inverse=True, return_counts=True)
+    num_clusters, counts = counts.shape[0], counts.float()
+    merged_pt_cld = torch.zeros((num_clusters, point_cld.shape[1]), device=point_cld.device, dtype=point_cld.dtype)
+    merged_pt_cld.index_add_(0, cluster_idx, point_cld)
+    merged_pt_cld /= counts[:, None]
+    # Mean squared distance of the points to the mean position of their voxel
+    offsets = point_cld[:, :3] - merged_pt_cld.index_select(0, cluster_idx)[:, :3]
+    spread = torch.zeros(num_clusters, device=point_cld.device, dtype=point_cld.dtype)
+    spread.index_add_(0, cluster_idx, (offsets * offsets).sum(dim=1))
+    merged_mean3_sq_dist = torch.zeros(num_clusters, device=point_cld.device, dtype=mean3_sq_dist.dtype)
+    merged_mean3_sq_dist.index_add_(0, cluster_idx, mean3_sq_dist)
+    merged_mean3_sq_dist = (merged_mean3_sq_dist + spread) / counts
+    return merged_pt_cld, merged_mean3_sq_dist
+
+
+def covered_points(pts, index, radius):
+    """(N,) mask of the points with a point of a VoxelHashGrid index (e.g. the existing Gaussians) within radius."""
+    covered = torch.zeros(pts.shape[0], dtype=torch.bool, device=pts.device)
+    if len(index) == 0 or pts.shape[0] == 0:
+        return covered
+    query_idx, _, _ = index.radius_query(pts, radius)
+    covered[query_idx.to(pts.device)] = True
+    return covered
+
 
 def calculate_neighbors(params, variables, time_idx, num_knn=20):
     if time_idx is None:
@@ -33,4 +153,4 @@ def calculate_neighbors(params, variables, time_idx, num_knn=20):
     variables["neighbor_indices"] = neighbor_indices.long().contiguous()
     variables["neighbor_weight"] = neighbor_weight.float().contiguous()
     variables["neighbor_dist"] = neighbor_dist.float().contiguous()
-    return variables
\ No newline at end of file
+    return variables
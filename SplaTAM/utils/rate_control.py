@@ -0,0 +1,151 @@
+"""
+Rate control for the live SLAM consumer (iPhone demo).
+
+When tracking & mapping take longer than the phone's frame interval, processing every received frame makes the
+reconstruction fall further and further behind. The rate controller measures the per-frame SLAM latency and the
+end-to-end lag, and decides for every incoming frame whether to track & map it, only track it or only persist it
+(all frames are always saved to disk for offline refinement).
+"""
+
+import math
+
+import numpy as np
+
+PERSIST = "persist" # Only save the frame to disk
+TRACK = "track" # Save & track the frame (no densification/mapping)
+TRACK_AND_MAP = "track_and_map" # Save, track & map the frame
+
+
+def pose_delta(prev_c2w, curr_c2w):
+    """
+    Compute the translation (in meters) and rotation angle (in radians) between two camera-to-world poses.
+
+    Args:
+        prev_c2w: 4x4 camera-to-world pose of the reference frame.
+        curr_c2w: 4x4 camera-to-world pose of the current frame.
+
+    Returns:
+        trans_delta: norm of the relative translation.
+        rot_delta: angle of the relative rotation.
+    """
+    rel = np.linalg.inv(prev_c2w) @ curr_c2w
+    trans_delta = float(np.linalg.norm(rel[:3, 3]))
+    cos_angle = (np.trace(rel[:3, :3]) - 1.0) / 2.0
+    rot_delta = float(np.arccos(np.clip(cos_angle, -1.0, 1.0)))
+    return trans_delta, rot_delta
+
+
+def estimate_overlap(trans_delta, rot_delta, fov, scene_depth):
+    """
+    Coarse estimate of the image overlap between two views from the camera motion between them.
+    Rotation shifts the view by rot_delta / fov of the image, while translation shifts it by
+    trans_delta relative to the footprint of the image at the typical scene depth.
+
+    Args:
+        trans_delta: translation between the views (m).
+        rot_delta: rotation angle between the views (rad).
+        fov: (smallest) field of view of the camera (rad).
+        scene_depth: typical (median) depth of the scene (m).
+
+    Returns:
+        overlap: estimated overlap fraction in [0, 1].
+    """
+    rot_overlap = max(0.0, 1.0 - rot_delta / fov)
+    footprint = 2.0 * max(scene_depth, 1e-3) * math.tan(fov / 2.0)
+    trans_overlap = max(0.0, 1.0 - trans_delta / footprint)
+    return rot_overlap * trans_overlap
+
+
+class RateController:
+    """
+    Decides which incoming frames to track, map or only persist to keep the end-to-end lag bounded.
+
+    The lag of a frame is the time between its capture and the start of its processing, measured relative
+    to the first frame (so that the phone and host clocks don't need to be synchronized). Frames are dropped
+    from SLAM (persisted only) while the lag is above max_lag, unless the camera moved so much since the last
+    tracked frame that the estimated overlap falls below min_overlap (tracking would otherwise be lost) or
+    max_skipped_frames consecutive frames have been skipped. Mapping is skipped when the predicted lag after
+    mapping would exceed max_lag, but never for more than max_frames_without_map consecutive tracked frames.
+    """
+    def __init__(self, max_lag=1.0, min_overlap=0.8, max_skipped_frames=10, max_frames_without_map=5,
+                 latency_ema=0.2):
+        self.max_lag = max_lag
+        self.min_overlap = min_overlap
+        self.max_skipped_frames = max_skipped_frames
+        self.max_frames_without_map = max_frames_without_map
+        self.latency_ema = latency_ema
+
+        self.first_timestamp = None
+        self.first_receive_time = None
+        self.last_tracked_c2w = None
+        self.num_skipped_frames = 0
+        self.num_frames_without_map = 0
+        # Exponential moving averages of the per-frame SLAM latency (seconds)
+        self.latency = {TRACK: None, TRACK_AND_MAP: None}
+        self.counts = {PERSIST: 0, TRACK: 0, TRACK_AND_MAP: 0}
+        self.lag = 0.0
+
+    def get_lag(self, timestamp, receive_time):
+        """Lag of a frame captured at timestamp (phone clock) & processed at receive_time (host clock)."""
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+            self.first_receive_time = receive_time
+            return 0.0
+        return max(0.0, (receive_time - self.first_receive_time) - (timestamp - self.first_timestamp))
+
+    def decide(self, c2w, timestamp, receive_time, fov, scene_depth):
+        """
+        Decide what to do with an incoming frame.
+
+        Args:
+            c2w: 4x4 ARKit camera-to-world pose of the frame.
+            timestamp: capture timestamp of the frame (s, phone clock).
+            receive_time: host time at which the frame is about to be processed (s).
+            fov: (smallest) field of view of the camera (rad).
+            scene_depth: median depth of the frame (m).
+
+        Returns:
+            decision: one of PERSIST, TRACK or TRACK_AND_MAP.
+        """
+        self.lag = self.get_lag(timestamp, receive_time)
+        if self.last_tracked_c2w is None:
+            decision = TRACK_AND_MAP
+        else:
+            trans_delta, rot_delta = pose_delta(self.last_tracked_c2w, c2w)
+            overlap = estimate_overlap(trans_delta, rot_delta, fov, scene_depth)
+            must_track = (overlap < self.min_overlap) or (self.num_skipped_frames >= self.max_skipped_frames)
+            if self.lag > self.max_lag and not must_track:
+                decision = PERSIST
+            else:
+                full_latency = self.latency[TRACK_AND_MAP] or 0.0
+                if self.num_frames_without_map >= self.max_frames_without_map or \
+                        self.lag + full_latency <= self.max_lag:
+                    decision = TRACK_AND_MAP
+                else:
+                    decision = TRACK
+
+        # Update the controller state
+        self.counts[decision] += 1
+        if decision == PERSIST:
+            self.num_skipped_frames += 1
+        else:
+            self.num_skipped_frames = 0
+            self.last_tracked_c2w = np.asarray(c2w, dtype=np.float64)
+            if decision == TRACK_AND_MAP:
+                self.num_frames_without_map = 0
+            else:
+                self.num_frames_without_map += 1
+        return decision
+
+    def update_latency(self, decision, seconds):
+        """Update the moving average of the per-frame SLAM latency for the given decision."""
+        if decision == PERSIST:
+            return
+        if self.latency[decision] is None:
+            self.latency[decision] = seconds
+        else:
+            self.latency[decision] = (1 - self.latency_ema) * self.latency[decision] + self.latency_ema * seconds
+
+    def summary(self):
+        return (f"Rate Control: {self.counts[TRACK_AND_MAP]} tracked & mapped, {self.counts[TRACK]} tracked, "
+                f"{self.counts[PERSIST]} persisted only | Last Lag: {self.lag:.3f} s")
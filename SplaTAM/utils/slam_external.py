@@ -18,14 +18,13 @@
 import numpy as np
 import torch
 import torch.nn.functional as func
-from torch.autograd import Variable
 from math import exp
 
 
 def build_rotation(q):
     norm = torch.sqrt(q[:, 0] * q[:, 0] + q[:, 1] * q[:, 1] + q[:, 2] * q[:, 2] + q[:, 3] * q[:, 3])
     q = q / norm[:, None]
-    rot = torch.zeros((q.size(0), 3, 3), device='cuda')
+    rot = torch.zeros((q.size(0), 3, 3), device=q.device)
     r = q[:, 0]
     x = q[:, 1]
     y = q[:, 2]
@@ -56,35 +55,43 @@ def gaussian(window_size, sigma):
     return gauss / gauss.sum()
 
 
-def create_window(window_size, channel):
-    _1D_window = gaussian(window_size, 1.5).unsqueeze(1)
-    _2D_window = _1D_window.mm(_1D_window.t()).float().unsqueeze(0).unsqueeze(0)
-    window = Variable(_2D_window.expand(channel, 1, window_size, window_size).contiguous())
-    return window
+# (window_size, channel, device, dtype) -> horizontal & vertical 1D Gaussian windows of the separable SSIM
+_separable_windows = {}
 
 
-def calc_ssim(img1, img2, window_size=11, size_average=True):
-    channel = img1.size(-3)
-    window = create_window(window_size, channel)
+def get_separable_window(window_size, channel, device, dtype):
+    """Cached (channel, 1, 1, window_size) & (channel, 1, window_size, 1) windows of the separable SSIM."""
+    key = (window_size, channel, torch.device(device), dtype)
+    if key not in _separable_windows:
+        window = gaussian(window_size, 1.5).to(device=device, dtype=dtype)
+        _separable_windows[key] = (window.view(1, 1, 1, window_size).expand(channel, 1, 1, window_size).contiguous(),
+                                   window.view(1, 1, window_size, 1).expand(channel, 1, window_size, 1).contiguous())
+    return _separable_windows[key]
 
-    if img1.is_cuda:
-        window = window.cuda(img1.get_device())
-    window = window.type_as(img1)
 
-    return _ssim(img1, img2, window, window_size, channel, size_average)
+def calc_ssim(img1, img2, window_size=11, size_average=True):
+    return _ssim_separable(img1, img2, window_size, size_average)
 
 
-def _ssim(img1, img2, window, window_size, channel, size_average=True):
-    mu1 = func.conv2d(img1, window, padding=window_size // 2, groups=channel)
-    mu2 = func.conv2d(img2, window, padding=window_size // 2, groups=channel)
+def _ssim_separable(img1, img2, window_size=11, size_average=True):
+    """
+    SSIM with the 2D Gaussian window applied as two 1D passes (the window is separable, so this matches the SSIM with
+    the 2D window of utils/gs_external.py up to rounding). The five local statistics are filtered together by a single
+    grouped convolution per pass.
+    """
+    channel = img1.size(-3)
+    window_h, window_v = get_separable_window(window_size, 5 * channel, img1.device, img1.dtype)
+    stats = torch.cat([img1, img2, img1 * img1, img2 * img2, img1 * img2], dim=-3)
+    stats = func.conv2d(stats, window_h, padding=(0, window_size // 2), groups=5 * channel)
+    stats = func.conv2d(stats, window_v, padding=(window_size // 2, 0), groups=5 * channel)
+    mu1, mu2, img1_sq, img2_sq, img12 = torch.split(stats, channel, dim=-3)
 
     mu1_sq = mu1.pow(2)
     mu2_sq = mu2.pow(2)
     mu1_mu2 = mu1 * mu2
-
-    sigma1_sq = func.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
-    sigma2_sq = func.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
-    sigma12 = func.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
+    sigma1_sq = img1_sq - mu1_sq
+    sigma2_sq = img2_sq - mu2_sq
+    sigma12 = img12 - mu1_mu2
 
     c1 = 0.01 ** 2
     c2 = 0.03 ** 2
@@ -157,6 +164,8 @@ def remove_points(to_remove, params, variables, optimizer):
     variables['max_2D_radius'] = variables['max_2D_radius'][to_keep]
     if 'timestep' in variables.keys():
         variables['timestep'] = variables['timestep'][to_keep]
+    if 'spatial_index' in variables.keys():
+        variables['spatial_index'].remove(to_remove)
     return params, variables
 
 
@@ -199,9 +208,13 @@ def densify(params, variables, optimizer, iter, densify_dict):
                         torch.max(torch.exp(params['log_scales']), dim=1).values <= 0.01 * variables['scene_radius']))
             new_params = {k: v[to_clone] for k, v in params.items() if k not in ['cam_unnorm_rots', 'cam_trans']}
             params = cat_params_to_optimizer(new_params, params, optimizer)
+            if 'timestep' in variables.keys():
+                variables['timestep'] = torch.cat((variables['timestep'], variables['timestep'][to_clone]))
+            if 'spatial_index' in variables.keys():
+                variables['spatial_index'].insert(new_params['means3D'])
             num_pts = params['means3D'].shape[0]
 
-            padded_grad = torch.zeros(num_pts, device="cuda")
+            padded_grad = torch.zeros(num_pts, device=grads.device)
             padded_grad[:grads.shape[0]] = grads
             to_split = torch.logical_and(padded_grad >= grad_thresh,
                                          torch.max(torch.exp(params['log_scales']), dim=1).values > 0.01 * variables[
@@ -209,18 +222,22 @@ def densify(params, variables, optimizer, iter, densify_dict):
             n = densify_dict['num_to_split_into']  # number to split into
             new_params = {k: v[to_split].repeat(n, 1) for k, v in params.items() if k not in ['cam_unnorm_rots', 'cam_trans']}
             stds = torch.exp(params['log_scales'])[to_split].repeat(n, 3)
-            means = torch.zeros((stds.size(0), 3), device="cuda")
+            means = torch.zeros((stds.size(0), 3), device=stds.device)
             samples = torch.normal(mean=means, std=stds)
             rots = build_rotation(params['unnorm_rotations'][to_split]).repeat(n, 1, 1)
             new_params['means3D'] += torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1)
             new_params['log_scales'] = torch.log(torch.exp(new_params['log_scales']) / (0.8 * n))
             params = cat_params_to_optimizer(new_params, params, optimizer)
+            if 'timestep' in variables.keys():
+                variables['timestep'] = torch.cat((variables['timestep'], variables['timestep'][to_split].repeat(n)))
+            if 'spatial_index' in variables.keys():
+                variables['spatial_index'].insert(new_params['means3D'])
             num_pts = params['means3D'].shape[0]
 
-            variables['means2D_gradient_accum'] = torch.zeros(num_pts, device="cuda")
-            variables['denom'] = torch.zeros(num_pts, device="cuda")
-            variables['max_2D_radius'] = torch.zeros(num_pts, device="cuda")
-            to_remove = torch.cat((to_split, torch.zeros(n * to_split.sum(), dtype=torch.bool, device="cuda")))
+            variables['means2D_gradient_accum'] = torch.zeros(num_pts, device=grads.device)
+            variables['denom'] = torch.zeros(num_pts, device=grads.device)
+            variables['max_2D_radius'] = torch.zeros(num_pts, device=grads.device)
+            to_remove = torch.cat((to_split, torch.zeros(n * to_split.sum(), dtype=torch.bool, device=grads.device)))
             params, variables = remove_points(to_remove, params, variables, optimizer)
 
             if iter == densify_dict['stop_after']:
@@ -1,6 +1,7 @@
 import torch
 import torch.nn.functional as F
 from utils.slam_external import build_rotation
+from utils.spatial_hash import points_in_frustum
 
 def l1_loss_v1(x, y):
     return torch.abs((x - y)).mean()
@@ -18,6 +19,34 @@ def weighted_l2_loss_v2(x, y, w):
     return torch.sqrt(((x - y) ** 2).sum(-1) * w + 1e-20).mean()
 
 
+def masked_l1_loss(x, y, mask, reduction='sum'):
+    """
+    L1 loss over the elements of a boolean mask (broadcast against x & y, e.g. a (1, H, W) mask of (3, H, W) images).
+
+    Same value & gradients as torch.abs(x - y)[mask].sum() (or .mean()), but reduces in place of gathering the masked
+    elements. torch.where is used rather than multiplying by a float mask, so that NaNs outside the mask are ignored.
+    """
+    abs_diff = torch.abs(x - y)
+    masked_sum = torch.where(mask, abs_diff, abs_diff.new_zeros(())).sum()
+    if reduction == 'sum':
+        return masked_sum
+    elif reduction == 'mean':
+        return masked_sum / mask.expand_as(abs_diff).sum()
+    raise ValueError(f"Unknown reduction {reduction}")
+
+
+def approx_median(x, max_samples=None):
+    """
+    Median of the elements of x (the lower one for an even number of elements, like torch.median), found by selection.
+
+    If max_samples is set, the median of a strided subset of at most max_samples elements is returned instead.
+    """
+    x = x.flatten()
+    if max_samples is not None and x.numel() > max_samples:
+        x = x[::-(-x.numel() // max_samples)]
+    return x.kthvalue((x.numel() + 1) // 2).values
+
+
 def quat_mult(q1, q2):
     w1, x1, y1, z1 = q1.T
     w2, x2, y2, z2 = q2.T
@@ -205,7 +234,7 @@ def get_depth_and_silhouette(pts_3D, w2c):
     depth_z_sq = torch.square(depth_z) # [num_gaussians, 1]
 
     # Depth and Silhouette
-    depth_silhouette = torch.zeros((pts_3D.shape[0], 3)).cuda().float()
+    depth_silhouette = torch.zeros((pts_3D.shape[0], 3), device=pts_3D.device).float()
     depth_silhouette[:, 0] = depth_z.squeeze(-1)
     depth_silhouette[:, 1] = 1.0
     depth_silhouette[:, 2] = depth_z_sq.squeeze(-1)
@@ -269,7 +298,7 @@ def transform_to_frame(params, time_idx, gaussians_grad, camera_grad):
     else:
         cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
         cam_tran = params['cam_trans'][..., time_idx].detach()
-    rel_w2c = torch.eye(4).cuda().float()
+    rel_w2c = torch.eye(4, device=cam_rot.device).float()
     rel_w2c[:3, :3] = build_rotation(cam_rot)
     rel_w2c[:3, 3] = cam_tran
 
@@ -289,7 +318,7 @@ def transform_to_frame(params, time_idx, gaussians_grad, camera_grad):
     
     transformed_gaussians = {}
     # Transform Centers of Gaussians to Camera Frame
-    pts_ones = torch.ones(pts.shape[0], 1).cuda().float()
+    pts_ones = torch.ones(pts.shape[0], 1, device=pts.device).float()
     pts4 = torch.cat((pts, pts_ones), dim=1)
     transformed_pts = (rel_w2c @ pts4.T).T[:, :3]
     transformed_gaussians['means3D'] = transformed_pts
@@ -301,4 +330,89 @@ def transform_to_frame(params, time_idx, gaussians_grad, camera_grad):
     else:
         transformed_gaussians['unnorm_rotations'] = unnorm_rots
 
-    return transformed_gaussians
\ No newline at end of file
+    return transformed_gaussians
+
+
+def frustum_cull_gaussians(params, variables, time_idx, curr_data, culling_dict):
+    """
+    Function to get the indices of the Gaussians that can be visible from the camera of a frame.
+
+    A Gaussian is kept if the sphere of radius 3x its largest scale around its center intersects the view frustum,
+    expanded by culling_dict['expand'] (fraction of the image size on every side) so that the subset stays valid while
+    the camera pose is optimized. The voxel hash grid (variables['spatial_index']) is used to skip the Gaussians of the
+    voxels outside the frustum if available.
+
+    Args:
+        params: dict of parameters
+        variables: dict of variables
+        time_idx: time index of the camera pose
+        curr_data: frame data (im, intrinsics & w2c of the canonical camera)
+        culling_dict: dict with expand, near & far
+
+    Returns:
+        visible_idx: Sorted indices of the Gaussians to render
+    """
+    with torch.no_grad():
+        # World-to-camera pose of the frame (canonical camera composed with the estimated camera pose)
+        cam_rot = F.normalize(params['cam_unnorm_rots'][..., time_idx].detach())
+        rel_w2c = torch.eye(4, device=cam_rot.device).float()
+        rel_w2c[:3, :3] = build_rotation(cam_rot)
+        rel_w2c[:3, 3] = params['cam_trans'][..., time_idx].detach()
+        w2c = curr_data['w2c'].to(rel_w2c.device).float() @ rel_w2c
+
+        # Expand the image plane on every side
+        height, width = curr_data['im'].shape[1], curr_data['im'].shape[2]
+        expand = culling_dict.get('expand', 0.1)
+        intrinsics = curr_data['intrinsics'][:3, :3].clone().float()
+        intrinsics[0, 2] += expand * width
+        intrinsics[1, 2] += expand * height
+        height, width = (1 + 2 * expand) * height, (1 + 2 * expand) * width
+        near, far = culling_dict.get('near', 0.01), culling_dict.get('far', 100.0)
+
+        extents = 3 * torch.exp(params['log_scales'].detach()).max(dim=1).values
+        if 'spatial_index' in variables.keys():
+            candidates = variables['spatial_index'].frustum_query(w2c, intrinsics, height, width, near, far,
+                                                                  margin=extents.max().item())
+        else:
+            candidates = torch.arange(params['means3D'].shape[0], device=extents.device)
+        visible = points_in_frustum(params['means3D'].detach()[candidates], w2c, intrinsics, height, width, near, far,
+                                    margin=extents[candidates])
+    return candidates[visible]
+
+
+def sample_tracking_pixels(color, depth, num_pixels):
+    """
+    Function to pick the pixels of a frame used for the tracking loss.
+
+    The image is split into a grid of about num_pixels cells & the pixel with the largest color gradient amongst the
+    pixels with valid depth is picked in every cell, so that the samples are informative for the pose while covering
+    the whole image (cells without valid depth are skipped).
+
+    Args:
+        color: (3, H, W) color image
+        depth: (1, H, W) depth image
+        num_pixels: number of pixels to sample (approximately)
+
+    Returns:
+        pixel_idx: Sorted flat indices (into H * W) of the sampled pixels
+    """
+    with torch.no_grad():
+        height, width = color.shape[1], color.shape[2]
+        cell_size = max(int(round((height * width / num_pixels) ** 0.5)), 1)
+        # Color gradient magnitude (central differences of the gray image), -1 where the depth is invalid
+        gray = color.mean(dim=0)
+        grad_x = F.pad(gray[:, 2:] - gray[:, :-2], (1, 1))
+        grad_y = F.pad(gray[2:, :] - gray[:-2, :], (0, 0, 1, 1))
+        scores = torch.where(depth[0] > 0, torch.sqrt(grad_x ** 2 + grad_y ** 2), torch.full_like(gray, -1.0))
+        # Best pixel of every cell (the pixels beyond the last full cell are padded with invalid scores)
+        pad_h, pad_w = (-height) % cell_size, (-width) % cell_size
+        scores = F.pad(scores, (0, pad_w, 0, pad_h), value=-1.0)
+        num_cells_y, num_cells_x = scores.shape[0] // cell_size, scores.shape[1] // cell_size
+        cells = scores.reshape(num_cells_y, cell_size, num_cells_x, cell_size).permute(0, 2, 1, 3)
+        cell_scores, cell_argmax = cells.reshape(num_cells_y, num_cells_x, -1).max(dim=-1)
+        cell_y, cell_x = torch.meshgrid(torch.arange(num_cells_y, device=color.device),
+                                        torch.arange(num_cells_x, device=color.device), indexing="ij")
+        pixel_y = cell_y * cell_size + cell_argmax // cell_size
+        pixel_x = cell_x * cell_size + cell_argmax % cell_size
+        pixel_idx = (pixel_y * width + pixel_x)[cell_scores >= 0]
+    return torch.sort(pixel_idx).values
@@ -0,0 +1,368 @@
+"""
+Voxel hash grid over the Gaussian centers for fast region queries (radius, kNN & frustum).
+
+The grid keeps the voxel key of every Gaussian in the same order as params['means3D'], so it is kept in sync by
+appending the keys of new Gaussians (insert) & applying the same mask as remove_points (remove). The keys are packed
+into a single int64 per voxel and the sorted (CSR) layout used by the queries is rebuilt lazily with one argsort the
+first time the grid is queried after a change, so that add/prune stay O(new points) during mapping.
+
+Since the Gaussians move during mapping, update(means3D) re-buckets all the Gaussians (e.g. once per frame). Queries
+always use the positions of the Gaussians at the last insert/update.
+
+Everything is vectorized in PyTorch & runs on the device of the Gaussians (CPU or CUDA).
+"""
+
+import math
+
+import torch
+
+# Voxel coordinates are packed into 21 bits per axis (offset to be non-negative)
+_KEY_BITS = 21
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+_KEY_MASK = (1 << _KEY_BITS) - 1
+
+
+def pack_voxel_keys(coords):
+    """Pack (N, 3) integer voxel coordinates into (N,) int64 keys."""
+    coords = coords.long() + _KEY_OFFSET
+    return (coords[:, 0] << (2 * _KEY_BITS)) | (coords[:, 1] << _KEY_BITS) | coords[:, 2]
+
+
+def unpack_voxel_keys(keys):
+    """Unpack (N,) int64 keys into (N, 3) integer voxel coordinates."""
+    coords = torch.stack([(keys >> (2 * _KEY_BITS)) & _KEY_MASK,
+                          (keys >> _KEY_BITS) & _KEY_MASK,
+                          keys & _KEY_MASK], dim=-1)
+    return coords - _KEY_OFFSET
+
+
+def _block_offsets(ring, device):
+    """(M, 3) voxel offsets of a block of (2 * ring)^3 voxels (relative to its voxel at offset (0, 0, 0))."""
+    steps = torch.arange(-ring + 1, ring + 1, device=device)
+    return torch.stack(torch.meshgrid(steps, steps, steps, indexing="ij"), dim=-1).reshape(-1, 3)
+
+
+def _pair_sq_dists(points_t, queries_t, query_idx, point_pos):
+    """Squared distances of (query, point) pairs, from the (3, N) transposed points & (3, Q) transposed queries
+    (gathering one coordinate at a time is much faster than gathering (P, 3) rows on CPU)."""
+    sq_dists = torch.zeros(point_pos.shape[0], device=point_pos.device)
+    for axis in range(3):
+        diff = points_t[axis].index_select(0, point_pos)
+        diff.sub_(queries_t[axis].index_select(0, query_idx))
+        sq_dists.addcmul_(diff, diff)
+    return sq_dists
+
+
+def points_in_frustum(pts, w2c, intrinsics, height, width, near=0.01, far=100.0, margin=0.0):
+    """
+    Mask of the points (optionally inflated into spheres of radius margin) that intersect the view frustum of a camera.
+
+    Args:
+        pts: (N, 3) points in the world frame.
+        w2c: (4, 4) world-to-camera pose.
+        intrinsics: (3, 3) camera intrinsics.
+        height, width: image size.
+        near, far: depth range of the frustum.
+        margin: radius of the spheres around the points (0 for the points themselves), a scalar or (N,) radii.
+
+    Returns:
+        mask: (N,) bool mask of the visible points.
+    """
+    pts_cam = pts @ w2c[:3, :3].T + w2c[:3, 3]
+    fx, fy, cx, cy = intrinsics[0, 0], intrinsics[1, 1], intrinsics[0, 2], intrinsics[1, 2]
+    # Inward normals of the left, right, top & bottom planes of the frustum (all through the camera center)
+    normals = torch.stack([
+        torch.stack([fx, torch.zeros_like(fx), cx]),
+        torch.stack([-fx, torch.zeros_like(fx), width - cx]),
+        torch.stack([torch.zeros_like(fy), fy, cy]),
+        torch.stack([torch.zeros_like(fy), -fy, height - cy]),
+    ]).to(pts_cam.dtype)
+    normals = normals / torch.linalg.norm(normals, dim=-1, keepdim=True)
+    margin = torch.as_tensor(margin, dtype=pts_cam.dtype, device=pts_cam.device)
+    in_sides = ((pts_cam @ normals.T) >= -(margin[:, None] if margin.dim() > 0 else margin)).all(dim=-1)
+    in_depth = (pts_cam[:, 2] >= near - margin) & (pts_cam[:, 2] <= far + margin)
+    return in_sides & in_depth
+
+
+class VoxelHashGrid:
+    """
+    Incremental voxel hash over a set of 3D points (the Gaussian centers).
+
+    Args:
+        voxel_size: edge length of the voxels (in scene units, meters for the iPhone captures).
+        device: device of the grid (defaults to the device of the first inserted points).
+        chunk_size: number of queries processed at once (bounds the memory of radius & kNN queries).
+    """
+    def __init__(self, voxel_size, device=None, chunk_size=65536):
+        self.voxel_size = float(voxel_size)
+        self.chunk_size = chunk_size
+        self.device = device
+        self.points = torch.zeros((0, 3), device=device)
+        self.keys = torch.zeros(0, dtype=torch.long, device=device)
+        self._dirty = True
+        self._sorted_idx = None
+        self._sorted_points_t = None
+        self._sorted_rank = None
+        self._voxel_keys = None
+        self._voxel_starts = None
+        self._voxel_counts = None
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    @property
+    def num_voxels(self):
+        self._build()
+        return self._voxel_keys.shape[0]
+
+    def voxel_coords(self, pts):
+        return torch.floor(pts / self.voxel_size).long()
+
+    def insert(self, pts):
+        """Append points (in the order of the Gaussians appended to means3D)."""
+        pts = pts.detach().float()
+        if self.device is None or len(self) == 0:
+            self.device = pts.device
+            self.points = self.points.to(pts.device)
+            self.keys = self.keys.to(pts.device)
+        self.points = torch.cat((self.points, pts), dim=0)
+        self.keys = torch.cat((self.keys, pack_voxel_keys(self.voxel_coords(pts))), dim=0)
+        self._dirty = True
+        return self
+
+    def remove(self, to_remove):
+        """Remove the points of a (N,) bool mask (the to_remove mask of remove_points)."""
+        to_keep = ~to_remove.to(self.points.device)
+        self.points = self.points[to_keep]
+        self.keys = self.keys[to_keep]
+        self._dirty = True
+        return self
+
+    def update(self, pts):
+        """Re-bucket all the points after they moved (pts must be in the same order as the grid)."""
+        pts = pts.detach().float()
+        keys = pack_voxel_keys(self.voxel_coords(pts))
+        # The sorted layout only has to be rebuilt if some point changed voxel
+        if keys.shape != self.keys.shape or not torch.equal(keys, self.keys):
+            self.keys = keys
+            self._dirty = True
+        self.points = pts.clone()
+        self._sorted_points_t = None
+        return self
+
+    def _build(self):
+        """Sort the points by voxel key & compute the start & count of every occupied voxel."""
+        if not self._dirty:
+            return
+        sorted_keys, self._sorted_idx = torch.sort(self.keys)
+        self._voxel_keys, self._voxel_counts = torch.unique_consecutive(sorted_keys, return_counts=True)
+        self._voxel_starts = torch.cumsum(self._voxel_counts, dim=0) - self._voxel_counts
+        self._sorted_points_t = None
+        self._sorted_rank = None
+        self._dirty = False
+
+    def _get_sorted_points_t(self):
+        """(3, N) coordinates of the points in sorted order (the candidates of a voxel are contiguous, which makes
+        gathering them cache friendly)."""
+        if self._sorted_points_t is None:
+            self._sorted_points_t = self.points.index_select(0, self._sorted_idx).T.contiguous()
+        return self._sorted_points_t
+
+    def _get_sorted_rank(self):
+        """Position of every point in sorted order."""
+        if self._sorted_rank is None:
+            self._sorted_rank = torch.empty_like(self._sorted_idx)
+            self._sorted_rank[self._sorted_idx] = torch.arange(len(self), device=self._sorted_idx.device)
+        return self._sorted_rank
+
+    def _lookup(self, keys):
+        """Start (in the sorted points) & number of points of the voxels of keys (count 0 for empty voxels)."""
+        if self._voxel_keys.shape[0] == 0:
+            return torch.zeros_like(keys), torch.zeros_like(keys)
+        pos = torch.clamp(torch.searchsorted(self._voxel_keys, keys), max=self._voxel_keys.shape[0] - 1)
+        found = self._voxel_keys.index_select(0, pos) == keys
+        starts = torch.where(found, self._voxel_starts.index_select(0, pos), torch.zeros_like(pos))
+        counts = torch.where(found, self._voxel_counts.index_select(0, pos), torch.zeros_like(pos))
+        return starts, counts
+
+    def _candidates(self, queries, ring):
+        """
+        All the (query, point) pairs whose point lies in the block of (2 * ring)^3 voxels centered on the closest
+        voxel corner to the query, which contains every point within (ring - 0.5) * voxel_size of the query.
+
+        Returns:
+            query_idx: (P,) index of the query of every pair.
+            sorted_pos: (P,) position of the point of every pair in sorted order (self._sorted_idx maps it to the
+                        index of the point).
+        """
+        num_queries = queries.shape[0]
+        offsets = _block_offsets(ring, queries.device)
+        # Voxel of the block that is on the lower side of the closest voxel corner along every axis
+        neighbor_coords = self.voxel_coords(queries - 0.5 * self.voxel_size)[:, None, :] + offsets[None, :, :]
+        starts, counts = self._lookup(pack_voxel_keys(neighbor_coords.reshape(-1, 3)))
+        # The pairs are grouped by query, then by voxel
+        query_idx = torch.repeat_interleave(torch.arange(num_queries, device=queries.device),
+                                            counts.view(num_queries, -1).sum(dim=1))
+        # Position of every pair in the sorted points: start of its voxel + rank within the voxel, where the rank is
+        # the pair index minus the index of the first pair of the voxel
+        pair_offsets = torch.cumsum(counts, dim=0) - counts
+        sorted_pos = torch.arange(query_idx.shape[0], device=queries.device)
+        sorted_pos += torch.repeat_interleave(starts - pair_offsets, counts)
+        return query_idx, sorted_pos
+
+    def radius_query(self, queries, radius):
+        """
+        All the points within radius of the queries.
+
+        Args:
+            queries: (Q, 3) query points.
+            radius: search radius.
+
+        Returns:
+            query_idx: (P,) index of the query of every neighbor.
+            point_idx: (P,) index of every neighbor in the grid (i.e. in means3D).
+            dists: (P,) distance between the query & the neighbor.
+        """
+        self._build()
+        queries = queries.detach().float().to(self.points.device)
+        ring = max(int(math.ceil(radius / self.voxel_size + 0.5)), 1)
+        points_t = self._get_sorted_points_t()
+        all_query_idx, all_point_idx, all_dists = [], [], []
+        for chunk_start in range(0, queries.shape[0], self.chunk_size):
+            chunk = queries[chunk_start:chunk_start + self.chunk_size]
+            query_idx, sorted_pos = self._candidates(chunk, ring)
+            dists = torch.sqrt(_pair_sq_dists(points_t, chunk.T.contiguous(), query_idx, sorted_pos))
+            in_radius = (dists <= radius).nonzero().squeeze(1)
+            all_query_idx.append(query_idx.index_select(0, in_radius) + chunk_start)
+            all_point_idx.append(self._sorted_idx.index_select(0, sorted_pos.index_select(0, in_radius)))
+            all_dists.append(dists.index_select(0, in_radius))
+        if len(all_query_idx) == 0:
+            empty = torch.zeros(0, dtype=torch.long, device=self.points.device)
+            return empty, empty, torch.zeros(0, device=self.points.device)
+        return torch.cat(all_query_idx), torch.cat(all_point_idx), torch.cat(all_dists)
+
+    def _knn_chunk(self, queries, k, ring, query_ranks, max_sq_dist=None):
+        query_idx, sorted_pos = self._candidates(queries, ring)
+        sq_dists = _pair_sq_dists(self._get_sorted_points_t(), queries.T.contiguous(), query_idx, sorted_pos)
+        keep = None
+        if query_ranks is not None:
+            keep = sorted_pos != query_ranks.index_select(0, query_idx)
+        if max_sq_dist is not None:
+            # Farther pairs can't be part of a result that is guaranteed exact at this ring
+            keep = sq_dists <= max_sq_dist if keep is None else keep & (sq_dists <= max_sq_dist)
+        if keep is not None:
+            keep = keep.nonzero().squeeze(1)
+            query_idx, sorted_pos = query_idx.index_select(0, keep), sorted_pos.index_select(0, keep)
+            sq_dists = sq_dists.index_select(0, keep)
+        # Select the k closest pairs of every query with k segmented min reductions (k is small, so this is cheaper
+        # than sorting all the pairs)
+        num_queries, num_pairs = queries.shape[0], query_idx.shape[0]
+        knn_sq_dists = torch.full((num_queries, k), float("inf"), device=queries.device)
+        knn_indices = torch.full((num_queries, k), -1, dtype=torch.long, device=queries.device)
+        for neighbor_idx in range(k):
+            min_sq_dists = torch.full((num_queries,), float("inf"), device=queries.device)
+            min_sq_dists.scatter_reduce_(0, query_idx, sq_dists, reduce="amin")
+            # First pair reaching the min of every query (ties are broken by pair order)
+            min_pair_ids = (sq_dists == min_sq_dists.index_select(0, query_idx)).nonzero().squeeze(1)
+            min_pairs = torch.full((num_queries,), num_pairs, dtype=torch.long, device=queries.device)
+            min_pairs.scatter_reduce_(0, query_idx.index_select(0, min_pair_ids), min_pair_ids, reduce="amin")
+            found = ((min_pairs < num_pairs) & torch.isfinite(min_sq_dists)).nonzero().squeeze(1)
+            min_pairs = min_pairs.index_select(0, found)
+            knn_sq_dists[found, neighbor_idx] = sq_dists.index_select(0, min_pairs)
+            knn_indices[found, neighbor_idx] = self._sorted_idx.index_select(0, sorted_pos.index_select(0, min_pairs))
+            sq_dists[min_pairs] = float("inf")
+        return knn_sq_dists, knn_indices
+
+    def knn(self, queries, k, max_ring=3, query_indices=None):
+        """
+        k nearest neighbors of the queries.
+
+        The search starts in the 2^3 voxels around the closest voxel corner to every query & grows the block for the
+        queries whose k-th neighbor is farther than the distance covered by the block (so the result is exact for
+        neighbors within (max_ring - 0.5) voxels).
+
+        Args:
+            queries: (Q, 3) query points.
+            k: number of neighbors.
+            max_ring: max half size (in voxels) of the searched block.
+            query_indices: (Q,) indices of the queries in the grid when querying the grid's own points, to exclude
+                           every query from its own neighbors.
+
+        Returns:
+            sq_dists: (Q, k) squared distances to the neighbors (sorted, inf if fewer than k neighbors were found).
+            indices: (Q, k) indices of the neighbors in the grid (-1 if fewer than k neighbors were found).
+        """
+        self._build()
+        queries = queries.detach().float().to(self.points.device)
+        query_ranks = None
+        if query_indices is not None:
+            query_ranks = self._get_sorted_rank().index_select(0, query_indices.to(self.points.device))
+        num_queries = queries.shape[0]
+        sq_dists = torch.full((num_queries, k), float("inf"), device=queries.device)
+        indices = torch.full((num_queries, k), -1, dtype=torch.long, device=queries.device)
+        pending = torch.arange(num_queries, device=queries.device)
+        for ring in range(1, max_ring + 1):
+            # Neighbors within (ring - 0.5) voxels of the query are guaranteed to be in the searched block
+            covered_sq_dist = ((ring - 0.5) * self.voxel_size) ** 2
+            still_pending = []
+            for chunk_start in range(0, pending.shape[0], self.chunk_size):
+                chunk = pending[chunk_start:chunk_start + self.chunk_size]
+                chunk_query_ranks = None if query_ranks is None else query_ranks.index_select(0, chunk)
+                chunk_sq_dists, chunk_indices = self._knn_chunk(queries.index_select(0, chunk), k, ring,
+                                                                chunk_query_ranks,
+                                                                None if ring == max_ring else covered_sq_dist)
+                if ring == max_ring:
+                    sq_dists[chunk] = chunk_sq_dists
+                    indices[chunk] = chunk_indices
+                    continue
+                done = chunk_sq_dists[:, -1] <= covered_sq_dist
+                sq_dists[chunk[done]] = chunk_sq_dists[done]
+                indices[chunk[done]] = chunk_indices[done]
+                still_pending.append(chunk[~done])
+            pending = torch.cat(still_pending) if len(still_pending) > 0 else pending[:0]
+            if pending.shape[0] == 0:
+                break
+        return sq_dists, indices
+
+    def frustum_query(self, w2c, intrinsics, height, width, near=0.01, far=100.0, margin=0.0, exact=False):
+        """
+        Indices of the points in the voxels that intersect the view frustum of a camera.
+
+        Args:
+            w2c: (4, 4) world-to-camera pose.
+            intrinsics: (3, 3) camera intrinsics.
+            height, width: image size.
+            near, far: depth range of the frustum.
+            margin: distance by which the frustum is expanded (e.g. the max extent of the Gaussians).
+            exact: also test the points of the intersecting voxels (otherwise the result is conservative & may
+                   contain points of voxels that straddle the frustum boundary).
+
+        Returns:
+            indices: (P,) sorted indices of the points in the frustum.
+        """
+        self._build()
+        w2c = w2c.detach().float().to(self.points.device)
+        intrinsics = intrinsics.detach().float().to(self.points.device)
+        voxel_centers = (unpack_voxel_keys(self._voxel_keys).float() + 0.5) * self.voxel_size
+        voxel_radius = 0.5 * math.sqrt(3) * self.voxel_size
+        visible_voxels = points_in_frustum(voxel_centers, w2c, intrinsics, height, width, near, far,
+                                           margin=voxel_radius + margin)
+        starts, counts = self._voxel_starts[visible_voxels], self._voxel_counts[visible_voxels]
+        pair_offsets = torch.cumsum(counts, dim=0) - counts
+        ranks = torch.arange(int(counts.sum()), device=counts.device) - torch.repeat_interleave(pair_offsets, counts)
+        indices = self._sorted_idx[torch.repeat_interleave(starts, counts) + ranks]
+        if exact:
+            indices = indices[points_in_frustum(self.points[indices], w2c, intrinsics, height, width, near, far,
+                                                margin=margin)]
+        return torch.sort(indices).values
+
+
+def build_spatial_index(config, params, variables):
+    """Attach a voxel hash grid over the Gaussian centers to variables if the optional `spatial_index` section of
+    the config enables it."""
+    spatial_index_config = config.get('spatial_index', {})
+    if spatial_index_config.get('enabled', False):
+        spatial_index = VoxelHashGrid(voxel_size=spatial_index_config.get('voxel_size', 0.05),
+                                      chunk_size=spatial_index_config.get('chunk_size', 65536))
+        variables['spatial_index'] = spatial_index.insert(params['means3D'])
+    return variables
@@ -0,0 +1,74 @@
+"""
+Coarse-to-fine image pyramid of the frames for tracking.
+
+Most of the tracking iterations run on downsampled levels of the frame (where a render is cheaper & the loss basin is
+wider), and only the last few refine the pose at the tracking resolution. The color of a level is area-averaged while
+its depth is subsampled (nearest), so that depth discontinuities & invalid (zero) depth aren't blended, and its
+intrinsics are scaled with datautils.scale_intrinsics.
+"""
+
+import torch.nn.functional as F
+
+from datasets.gradslam_datasets.datautils import scale_intrinsics
+from utils.recon_helpers import setup_camera
+
+
+class TrackingPyramid:
+    """
+    Coarse levels of the tracking frames & their iteration budgets.
+
+    Args:
+        num_levels: number of levels, including the tracking resolution.
+        scale_factor: downsampling factor between consecutive levels.
+        level_iters: max number of iterations of every coarse level (coarsest first).
+        fine_iters: number of iterations at the tracking resolution (replaces tracking.num_iters).
+        convergence_thres: a coarse level stops early once its loss hasn't improved by more than this fraction ...
+        patience: ... for this many iterations.
+    """
+    def __init__(self, num_levels=3, scale_factor=0.5, level_iters=(30, 15), fine_iters=15, convergence_thres=1e-3,
+                 patience=5):
+        if len(level_iters) != num_levels - 1:
+            raise ValueError(f"Expected {num_levels - 1} coarse level iteration budgets, got {len(level_iters)}")
+        self.num_levels = num_levels
+        self.scale_factor = scale_factor
+        self.level_iters = list(level_iters)
+        self.fine_iters = max(fine_iters, 1)
+        self.convergence_thres = convergence_thres
+        self.patience = patience
+        # (height, width) -> camera of the level (the intrinsics & canonical w2c are fixed for a run)
+        self._cameras = {}
+
+    def build(self, curr_data):
+        """Data of the coarse levels of a frame, coarsest first (the finest level is curr_data itself)."""
+        height, width = curr_data['im'].shape[1], curr_data['im'].shape[2]
+        levels = []
+        for level in range(self.num_levels - 1, 0, -1):
+            scale = self.scale_factor ** level
+            level_height, level_width = max(int(round(height * scale)), 1), max(int(round(width * scale)), 1)
+            intrinsics = scale_intrinsics(curr_data['intrinsics'], level_height / height, level_width / width)
+            if (level_height, level_width) not in self._cameras:
+                self._cameras[(level_height, level_width)] = setup_camera(
+                    level_width, level_height, intrinsics.cpu().numpy(), curr_data['w2c'].detach().cpu().numpy())
+            level_data = {**curr_data,
+                          'cam': self._cameras[(level_height, level_width)],
+                          'im': F.interpolate(curr_data['im'][None], size=(level_height, level_width), mode='area')[0],
+                          'depth': F.interpolate(curr_data['depth'][None], size=(level_height, level_width),
+                                                 mode='nearest')[0],
+                          'intrinsics': intrinsics}
+            # The sampled loss pixels are specific to the tracking resolution
+            level_data.pop('pixel_idx', None)
+            levels.append(level_data)
+        return levels
+
+
+def build_tracking_pyramid(config):
+    """Build the tracking pyramid of a run from the optional `tracking.pyramid` section of its config (None if disabled)."""
+    pyramid_config = config['tracking'].get('pyramid', {})
+    if not pyramid_config.get('enabled', False):
+        return None
+    return TrackingPyramid(num_levels=pyramid_config.get('num_levels', 3),
+                           scale_factor=pyramid_config.get('scale_factor', 0.5),
+                           level_iters=pyramid_config.get('level_iters', (30, 15)),
+                           fine_iters=pyramid_config.get('fine_iters', 15),
+                           convergence_thres=pyramid_config.get('convergence_thres', 1e-3),
+                           patience=pyramid_config.get('patience', 5))
@@ -0,0 +1,310 @@
+"""
+Vectorized trajectory evaluation (ATE & RPE) on stacked (N, 4, 4) camera-to-world trajectories.
+
+Everything runs in numpy on the CPU. The alignment is the closed-form method of Umeyama (1991), which reduces to
+Horn's method for SE(3) & additionally estimates a global scale for Sim(3).
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+def umeyama_alignment(model, data, with_scale=False):
+    """
+    Closed-form alignment of two point sets, such that data ~= scale * rot @ model + trans.
+
+    Args:
+        model: (N, 3) points to align (e.g. estimated camera centers).
+        data: (N, 3) reference points (e.g. ground truth camera centers).
+        with_scale: Also estimate a global scale (Sim(3) instead of SE(3) alignment).
+
+    Returns:
+        rot: (3, 3) rotation matrix.
+        trans: (3,) translation vector.
+        scale: scale factor (1.0 if with_scale is False).
+    """
+    model = np.asarray(model, dtype=np.float64)
+    data = np.asarray(data, dtype=np.float64)
+    model_mean = model.mean(0)
+    data_mean = data.mean(0)
+    model_zerocentered = model - model_mean
+    data_zerocentered = data - data_mean
+
+    # Cross-covariance of the zero-centered point sets
+    cov = data_zerocentered.T @ model_zerocentered / model.shape[0]
+    U, D, Vh = np.linalg.svd(cov)
+    S = np.eye(3)
+    if np.linalg.det(U) * np.linalg.det(Vh) < 0:
+        S[2, 2] = -1
+    rot = U @ S @ Vh
+
+    if with_scale:
+        model_var = (model_zerocentered ** 2).sum() / model.shape[0]
+        scale = float((D * np.diag(S)).sum() / model_var)
+    else:
+        scale = 1.0
+    trans = data_mean - scale * rot @ model_mean
+    return rot, trans, scale
+
+
+def invert_poses(poses):
+    """Invert a stack of (N, 4, 4) rigid transformations."""
+    rot_t = np.swapaxes(poses[:, :3, :3], 1, 2)
+    inv_poses = np.zeros_like(poses)
+    inv_poses[:, :3, :3] = rot_t
+    inv_poses[:, :3, 3] = -(rot_t @ poses[:, :3, 3, None])[..., 0]
+    inv_poses[:, 3, 3] = 1.0
+    return inv_poses
+
+
+def rotation_angles(rots):
+    """Rotation angles (in degrees) of a stack of (N, 3, 3) rotation matrices."""
+    cos_angles = (np.trace(rots, axis1=1, axis2=2) - 1.0) / 2.0
+    return np.degrees(np.arccos(np.clip(cos_angles, -1.0, 1.0)))
+
+
+def error_stats(errors):
+    """Summary statistics of an array of errors."""
+    if len(errors) == 0:
+        return {k: float('nan') for k in ['rmse', 'mean', 'median', 'std', 'min', 'max']}
+    return {
+        'rmse': float(np.sqrt(np.mean(errors ** 2))),
+        'mean': float(np.mean(errors)),
+        'median': float(np.median(errors)),
+        'std': float(np.std(errors)),
+        'min': float(np.min(errors)),
+        'max': float(np.max(errors)),
+    }
+
+
+def compute_ate(gt_poses, est_poses, with_scale=False):
+    """
+    Absolute Trajectory Error of the camera positions after aligning the estimated to the ground truth trajectory.
+
+    Args:
+        gt_poses: (N, 4, 4) ground truth poses.
+        est_poses: (N, 4, 4) estimated poses.
+        with_scale: Use a Sim(3) instead of an SE(3) alignment.
+
+    Returns:
+        errors: (N,) translational error of every pose after alignment.
+        alignment: dict with the rotation, translation & scale of the alignment.
+    """
+    gt_pts = gt_poses[:, :3, 3]
+    est_pts = est_poses[:, :3, 3]
+    rot, trans, scale = umeyama_alignment(est_pts, gt_pts, with_scale=with_scale)
+    aligned_est_pts = scale * est_pts @ rot.T + trans
+    errors = np.linalg.norm(aligned_est_pts - gt_pts, axis=1)
+    return errors, {'rot': rot, 'trans': trans, 'scale': scale}
+
+
+def compute_rpe(gt_poses, est_poses, delta=1, scale=1.0):
+    """
+    Relative Pose Error between the motion of the estimated & ground truth trajectories over `delta` frames.
+
+    Args:
+        gt_poses: (N, 4, 4) ground truth camera-to-world poses.
+        est_poses: (N, 4, 4) estimated camera-to-world poses.
+        delta: Frame offset of the compared relative motions.
+        scale: Scale applied to the estimated translations (from a Sim(3) alignment).
+
+    Returns:
+        trans_errors: (N - delta,) translational errors.
+        rot_errors: (N - delta,) rotational errors in degrees.
+    """
+    if delta <= 0 or delta >= gt_poses.shape[0]:
+        return np.zeros(0), np.zeros(0)
+    est_poses = est_poses.copy()
+    est_poses[:, :3, 3] *= scale
+    gt_rel = invert_poses(gt_poses[:-delta]) @ gt_poses[delta:]
+    est_rel = invert_poses(est_poses[:-delta]) @ est_poses[delta:]
+    rel_errors = invert_poses(gt_rel) @ est_rel
+    trans_errors = np.linalg.norm(rel_errors[:, :3, 3], axis=1)
+    rot_errors = rotation_angles(rel_errors[:, :3, :3])
+    return trans_errors, rot_errors
+
+
+def evaluate_trajectory(gt_poses, est_poses, rpe_deltas=(1,), with_scale=False):
+    """
+    Compute the ATE & RPE of an estimated trajectory.
+
+    Args:
+        gt_poses: (N, 4, 4) ground truth camera-to-world poses.
+        est_poses: (N, 4, 4) estimated camera-to-world poses.
+        rpe_deltas: Frame offsets for which the RPE is computed.
+        with_scale: Use a Sim(3) instead of an SE(3) alignment.
+
+    Returns:
+        metrics: dict with the summary statistics ('ate', 'rpe'), the per-frame errors ('ate_errors', 'rpe_errors')
+                 & the alignment.
+    """
+    gt_poses = np.asarray(gt_poses, dtype=np.float64)
+    est_poses = np.asarray(est_poses, dtype=np.float64)
+    if gt_poses.shape != est_poses.shape:
+        raise ValueError(f"Trajectories must have the same shape, got {gt_poses.shape} and {est_poses.shape}.")
+
+    ate_errors, alignment = compute_ate(gt_poses, est_poses, with_scale=with_scale)
+    metrics = {'ate': error_stats(ate_errors), 'ate_errors': ate_errors, 'alignment': alignment,
+               'rpe': {}, 'rpe_errors': {}}
+    for delta in rpe_deltas:
+        trans_errors, rot_errors = compute_rpe(gt_poses, est_poses, delta, scale=alignment['scale'])
+        metrics['rpe'][delta] = {'trans': error_stats(trans_errors), 'rot': error_stats(rot_errors)}
+        metrics['rpe_errors'][delta] = {'trans': trans_errors, 'rot': rot_errors}
+    return metrics
+
+
+def print_trajectory_metrics(metrics):
+    ate = metrics['ate']
+    print("ATE RMSE: {:.2f} cm | Mean: {:.2f} cm | Median: {:.2f} cm | Max: {:.2f} cm".format(
+        ate['rmse']*100, ate['mean']*100, ate['median']*100, ate['max']*100))
+    for delta, rpe in metrics['rpe'].items():
+        print("RPE (delta={}) Trans RMSE: {:.2f} cm | Rot RMSE: {:.2f} deg".format(
+            delta, rpe['trans']['rmse']*100, rpe['rot']['rmse']))
+
+
+def save_trajectory_metrics(metrics, save_dir):
+    """Save the summary statistics as json & the per-frame errors as text files."""
+    os.makedirs(save_dir, exist_ok=True)
+    summary = {
+        'ate': metrics['ate'],
+        'rpe': {str(delta): rpe for delta, rpe in metrics['rpe'].items()},
+        'alignment': {k: np.asarray(v).tolist() for k, v in metrics['alignment'].items()},
+    }
+    with open(os.path.join(save_dir, "trajectory_metrics.json"), "w") as f:
+        json.dump(summary, f, indent=4)
+    np.savetxt(os.path.join(save_dir, "ate_errors.txt"), metrics['ate_errors'])
+    for delta, rpe_errors in metrics['rpe_errors'].items():
+        np.savetxt(os.path.join(save_dir, f"rpe_trans_errors_delta{delta}.txt"), rpe_errors['trans'])
+        np.savetxt(os.path.join(save_dir, f"rpe_rot_errors_delta{delta}.txt"), rpe_errors['rot'])
+
+
+def _to_numpy_pose(pose):
+    if hasattr(pose, 'detach'):
+        pose = pose.detach().cpu().numpy()
+    return np.asarray(pose, dtype=np.float64)
+
+
+class OnlineATEEstimator:
+    """
+    Running ATE of a trajectory that grows one pose at a time, without storing or re-aligning the trajectory.
+
+    Only the sufficient statistics of the alignment are kept: the means, the summed squared deviations & the
+    cross-covariance of the estimated and ground truth camera centers, which are updated with Welford's algorithm.
+    The RMSE after the optimal (Umeyama) alignment follows in closed form from a 3x3 SVD, so every update and query
+    is O(1) in the trajectory length. The result is exact as long as the poses of past frames are not modified
+    afterwards (SplaTAM only optimizes the pose of the current frame during tracking).
+
+    If drift_threshold is set, a drift alarm is raised whenever the running ATE RMSE crosses it (and re-armed once
+    it falls back below it).
+
+    Frames whose ground truth or estimated pose is not finite (e.g. the invalid -inf poses of ScanNet) are skipped.
+    """
+    def __init__(self, with_scale=False, drift_threshold=None, min_frames=10):
+        self.with_scale = with_scale
+        self.drift_threshold = drift_threshold
+        self.min_frames = min_frames
+
+        self.num_frames = 0
+        self.num_skipped = 0
+        self.est_mean = np.zeros(3)
+        self.gt_mean = np.zeros(3)
+        self.est_sq_dev = 0.0 # Sum of the squared deviations of the estimated centers from their mean
+        self.gt_sq_dev = 0.0 # Sum of the squared deviations of the ground truth centers from their mean
+        self.cross_cov = np.zeros((3, 3)) # Sum of the outer products (gt - gt_mean) (est - est_mean)^T
+        self.last_est_center = None
+        self.last_gt_center = None
+        self.alarm_active = False
+        self.num_alarms = 0
+
+    @staticmethod
+    def camera_center(w2c):
+        """Camera center in world coordinates of a 4x4 world-to-camera pose."""
+        return -w2c[:3, :3].T @ w2c[:3, 3]
+
+    def update(self, gt_w2c, est_w2c):
+        """
+        Add the pose of a new frame.
+
+        Args:
+            gt_w2c: 4x4 ground truth world-to-camera pose (tensor or array).
+            est_w2c: 4x4 estimated world-to-camera pose (tensor or array).
+
+        Returns:
+            alarm: True if the running ATE RMSE just crossed the drift threshold.
+        """
+        gt_w2c, est_w2c = _to_numpy_pose(gt_w2c), _to_numpy_pose(est_w2c)
+        if not (np.isfinite(gt_w2c).all() and np.isfinite(est_w2c).all()):
+            self.num_skipped += 1
+            return False
+        gt_center = self.camera_center(gt_w2c)
+        est_center = self.camera_center(est_w2c)
+        self.num_frames += 1
+        est_delta = est_center - self.est_mean
+        gt_delta = gt_center - self.gt_mean
+        self.est_mean += est_delta / self.num_frames
+        self.gt_mean += gt_delta / self.num_frames
+        self.est_sq_dev += float(est_delta @ (est_center - self.est_mean))
+        self.gt_sq_dev += float(gt_delta @ (gt_center - self.gt_mean))
+        self.cross_cov += np.outer(gt_center - self.gt_mean, est_delta)
+        self.last_est_center = est_center
+        self.last_gt_center = gt_center
+
+        if self.drift_threshold is None or self.num_frames < self.min_frames:
+            return False
+        drifting = self.rmse() > self.drift_threshold
+        alarm = drifting and not self.alarm_active
+        self.alarm_active = drifting
+        if alarm:
+            self.num_alarms += 1
+        return alarm
+
+    def alignment(self):
+        """
+        Current optimal alignment of the estimated to the ground truth camera centers.
+
+        Returns:
+            rot: (3, 3) rotation matrix.
+            trans: (3,) translation vector.
+            scale: scale factor (1.0 if with_scale is False).
+            sq_error: sum of the squared errors of all frames after alignment.
+        """
+        U, D, Vh = np.linalg.svd(self.cross_cov)
+        S = np.ones(3)
+        if np.linalg.det(U) * np.linalg.det(Vh) < 0:
+            S[2] = -1
+        rot = U @ np.diag(S) @ Vh
+        trace = float((D * S).sum())
+        if self.with_scale and self.est_sq_dev > 0:
+            scale = trace / self.est_sq_dev
+            sq_error = self.gt_sq_dev - trace * scale
+        else:
+            scale = 1.0
+            sq_error = self.gt_sq_dev + self.est_sq_dev - 2.0 * trace
+        trans = self.gt_mean - scale * rot @ self.est_mean
+        return rot, trans, scale, max(sq_error, 0.0)
+
+    def rmse(self):
+        """ATE RMSE of all (valid) frames added so far (NaN until there are at least 2 valid frames)."""
+        if self.num_frames < 2:
+            return float('nan')
+        return float(np.sqrt(self.alignment()[3] / self.num_frames))
+
+    def last_error(self):
+        """Error of the latest frame under the current alignment."""
+        if self.num_frames < 2:
+            return float('nan')
+        rot, trans, scale, _ = self.alignment()
+        return float(np.linalg.norm(scale * rot @ self.last_est_center + trans - self.last_gt_center))
+
+    def summary(self):
+        if self.num_frames < 2:
+            summary = f"Online ATE RMSE: n/a ({self.num_frames} valid frames)"
+        else:
+            summary = f"Online ATE RMSE: {self.rmse()*100:.2f} cm over {self.num_frames} frames"
+        if self.num_skipped > 0:
+            summary += f" | Skipped {self.num_skipped} frames with invalid poses"
+        if self.drift_threshold is not None:
+            summary += f" | Drift Alarms: {self.num_alarms}"
+        return summary
@@ -17,6 +17,7 @@ from diff_gaussian_rasterization import GaussianRasterizer as Renderer
 from diff_gaussian_rasterization import GaussianRasterizationSettings as Camera
 
 from utils.common_utils import seed_everything
+from utils.gaussian_lod import build_lod
 from utils.recon_helpers import setup_camera
 from utils.slam_helpers import get_depth_and_silhouette
 from utils.slam_external import build_rotation
@@ -66,6 +67,11 @@ def load_scene_data(scene_path, first_frame_w2c, intrinsics):
         rel_w2c[:3, 3] = cam_tran
         all_w2cs.append(rel_w2c.cpu().numpy())
 
+    rendervar, depth_rendervar = params2rendervar(params, first_frame_w2c)
+    return rendervar, depth_rendervar, all_w2cs
+
+
+def params2rendervar(params, first_frame_w2c):
     # Check if Gaussians are Isotropic or Anisotropic
     if params['log_scales'].shape[-1] == 1:
         log_scales = torch.tile(params['log_scales'], (1, 3))
@@ -88,7 +94,7 @@ def load_scene_data(scene_path, first_frame_w2c, intrinsics):
         'scales': torch.exp(log_scales),
         'means2D': torch.zeros_like(params['means3D'], device="cuda")
     }
-    return rendervar, depth_rendervar, all_w2cs
+    return rendervar, depth_rendervar
 
 
 def make_lineset(all_pts, all_cols, num_lines):
@@ -175,6 +181,12 @@ def visualize(scene_path, cfg):
 
     scene_data, scene_depth_data, all_w2cs = load_scene_data(scene_path, w2c, k)
 
+    # Render a cut of the LOD hierarchy of the scene (bounded number of Gaussians for large scenes)
+    lod_cfg = cfg.get('lod', {})
+    if lod_cfg.get('enabled', False):
+        lod = build_lod(scene_path, lod_cfg)
+        first_frame_w2c = torch.tensor(w2c).cuda().float()
+
     # vis.create_window()
     vis = o3d.visualization.Visualizer()
     vis.create_window(width=int(cfg['viz_w'] * cfg['view_scale']), 
@@ -250,6 +262,11 @@ def visualize(scene_path, cfg):
         k[2, 2] = 1
         w2c = cam_params.extrinsic
 
+        if lod_cfg.get('enabled', False):
+            cut = lod.cut(w2c, k, cfg['viz_h'], cfg['viz_w'], pixel_error=lod_cfg.get('pixel_error', 1.0),
+                          near=cfg['viz_near'], far=cfg['viz_far'])
+            scene_data, scene_depth_data = params2rendervar(cut, first_frame_w2c)
+
         if cfg['render_mode'] == 'centers':
             pts = o3d.utility.Vector3dVector(scene_data['means3D'].contiguous().double().cpu().numpy())
             cols = o3d.utility.Vector3dVector(scene_data['colors_precomp'].contiguous().double().cpu().numpy())